@@ -0,0 +1,125 @@
+"""
+Knocks losing entries (and entries that did not pick, unless their pool's
+default team won) out of suicide pools once all of a week's games are
+final, so that pool pages can just read each entry's `active` and
+`eliminated_week` properties instead of deriving them from picks.
+"""
+
+import logging
+from collections import defaultdict
+
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+from models import Season, Week, Pool, Entry, Pick
+import settings
+
+
+# How many picks are scanned by each task in the pipeline
+BATCH_SIZE = 500
+
+
+def eliminate_losers(week_key, cursor=None):
+    """Scans one batch of the given week's picks (starting at the given query
+    cursor), eliminating the suicide pool entries whose picks lost. If there
+    are more picks to scan, a task is deferred to handle the next batch."""
+    week = Week.get(week_key)
+    games = _final_games(week)
+    if games is None:
+        return logging.info(u'%s is not over yet, nobody eliminated' % week)
+
+    # Map each game to its winner's key (None for ties, which count as a win
+    # for both teams).
+    winners = dict((game.key(), game.get_winner_key()) for game in games)
+
+    query = week.picks
+    if cursor:
+        query.with_cursor(cursor)
+    picks = query.fetch(BATCH_SIZE)
+
+    # Gather up the losing entries, grouped by pool.
+    loser_keys = []
+    for pick in picks:
+        game_key = Pick.game.get_value_for_datastore(pick)
+        team_key = Pick.team.get_value_for_datastore(pick)
+        if winners.get(game_key, team_key) not in (team_key, None):
+            loser_keys.append(pick.parent_key())
+    losers = defaultdict(set)
+    for entry in filter(None, Entry.get(loser_keys)):
+        losers[entry.pool_key()].add(entry.key())
+
+    eliminated = 0
+    pools = Pool.get(losers.keys())
+    for pool in pools:
+        if pool is not None and pool.is_suicide and \
+                _has_started(pool, week_key):
+            eliminated += pool.eliminate_entries(losers[pool.key()], week)
+    logging.info(u'%s: eliminated %s entries from %s picks' % (
+            week, eliminated, len(picks)))
+
+    if len(picks) == BATCH_SIZE:
+        deferred.defer(eliminate_losers, week_key, query.cursor())
+    else:
+        # Now go after the entries that didn't pick at all, pool by pool
+        season = Season.get(week.parent_key())
+        for pool in Pool.get(season.pool_keys()):
+            if pool is not None and pool.is_suicide:
+                deferred.defer(eliminate_absent, week_key, pool.key())
+
+def eliminate_absent(week_key, pool_key, cursor=None):
+    """Scans one batch of the given suicide pool's active entries (starting
+    at the given query cursor), eliminating those that made no pick for the
+    given week. Entries that miss a pick are stuck with the pool's default
+    team, so they survive only if the pool has one and it won (or tied) its
+    game that week; a default team with a bye counts as a loss. If there are
+    more entries to scan, a task is deferred to handle the next batch."""
+    week, pool = db.get([week_key, pool_key])
+    if pool is None or not pool.is_suicide:
+        return
+    if not _has_started(pool, week_key):
+        return logging.info(u'%s starts after %s, nobody eliminated' % (
+                pool, week))
+    games = _final_games(week)
+    if games is None:
+        return logging.info(u'%s is not over yet, nobody eliminated' % week)
+    team_key = Pool.default_team.get_value_for_datastore(pool)
+    for game in games:
+        if team_key in game.teams and \
+                game.get_winner_key() in (team_key, None):
+            return logging.info(
+                u'%s: default team won, nobody eliminated' % pool)
+
+    query = pool.active_entries
+    if cursor:
+        query.with_cursor(cursor)
+    entries = query.fetch(BATCH_SIZE)
+    more = len(entries) == BATCH_SIZE
+    if cursor is None and not settings.ENTRIES_MIGRATED:
+        # The first batch also takes the entries that are still children of
+        # the pool (see data.migrations)
+        entries.extend(entry for entry in pool.legacy_entries
+                       if entry.active)
+    absent = [entry.key() for entry in entries
+              if not entry.has_picked_week(week)]
+    eliminated = absent and pool.eliminate_entries(absent, week) or 0
+    logging.info(u'%s: eliminated %s of %s entries with no pick in %s' % (
+            pool, eliminated, len(entries), week))
+
+    if more:
+        deferred.defer(eliminate_absent, week_key, pool_key, query.cursor())
+
+def eliminate_week(week):
+    """Kicks off the elimination pipeline for the given week."""
+    return deferred.defer(eliminate_losers, week.key())
+
+def _has_started(pool, week_key):
+    """Does the given pool start in (or before) the given week?"""
+    start_key = Pool.start_week.get_value_for_datastore(pool)
+    return start_key is None or start_key.id() <= week_key.id()
+
+def _final_games(week):
+    """The given week's games, or None if any of them is not final yet."""
+    games = week.games.fetch(100)
+    if not games or not all(game.final for game in games):
+        return None
+    return games
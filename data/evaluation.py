@@ -0,0 +1,54 @@
+"""
+Evaluates picks in bulk once their games have gone final, so that pages only
+ever have to read each pick's precomputed `correct` value.
+"""
+
+import logging
+
+from google.appengine.ext import db
+
+from models import Game, Pick
+
+
+# The maximum number of entities to fetch or put in a single call
+BATCH_SIZE = 500
+
+
+def evaluate_games(games):
+    """Evaluates every pick for each of the given games that are final. The
+    games may also be given as keys, which makes this function suitable for
+    use with the deferred library. Returns the number of picks updated."""
+    if games and isinstance(games[0], db.Key):
+        games = db.get(games)
+    updated = 0
+    for game in games:
+        if game is None or not game.final:
+            continue
+        updated += evaluate_game(game)
+    logging.info('Evaluated %s picks for %s games' % (updated, len(games)))
+    return updated
+
+def evaluate_game(game):
+    """Evaluates every pick that references the given final game, via the
+    game's `picks` collection, writing the picks whose `correct` value has
+    changed in batches. Returns the number of picks updated."""
+    winner_key = game.get_winner_key()
+    updated = 0
+    query = game.picks
+    picks = query.fetch(BATCH_SIZE)
+    while picks:
+        changed = []
+        for pick in picks:
+            team_key = Pick.team.get_value_for_datastore(pick)
+            correct = winner_key in (team_key, None)
+            if pick.correct != correct:
+                pick.correct = correct
+                changed.append(pick)
+        if changed:
+            db.put(changed)
+            updated += len(changed)
+        if len(picks) < BATCH_SIZE:
+            break
+        picks = query.with_cursor(query.cursor()).fetch(BATCH_SIZE)
+    logging.info(u'%s: updated %s picks' % (game, updated))
+    return updated
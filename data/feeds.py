@@ -0,0 +1,118 @@
+"""
+Conditional, concurrent fetching for the odds and scores feeds.
+
+The validators (ETag and Last-Modified) and a hash of the content of the
+last version of each feed we successfully handled are stored in a FeedState
+entity. Fetches send those validators along, and if the feed responds with a
+304 or its content hashes the same as last time, it isn't parsed at all.
+
+Several feeds can be updated at once, in which case they are all fetched
+concurrently with async urlfetch calls. The odds and scores crons (and the
+score poller) update both feeds at once.
+
+`fab checkfeeds` runs the feed updates against the example feeds in
+data/examples, served from a local HTTP server.
+"""
+
+import hashlib
+import logging
+
+from google.appengine.ext import db
+from google.appengine.api import urlfetch
+
+
+class FeedState(db.Model):
+    """What we know about the last version of a feed that was handled. The
+    key name should be the feed's name."""
+    url = db.StringProperty()
+    etag = db.StringProperty()
+    last_modified = db.StringProperty()
+    content_hash = db.StringProperty()
+    handled_at = db.DateTimeProperty(auto_now=True)
+
+
+class FeedFetch(object):
+    """An in-flight conditional fetch of a single feed."""
+
+    def __init__(self, name, url, state):
+        self.name = name
+        self.url = url
+        self.state = state or FeedState(key_name=name)
+        headers = {}
+        if self.state.url == url:
+            if self.state.etag:
+                headers['If-None-Match'] = self.state.etag
+            if self.state.last_modified:
+                headers['If-Modified-Since'] = self.state.last_modified
+        self.rpc = urlfetch.create_rpc(deadline=20)
+        urlfetch.make_fetch_call(self.rpc, url, headers=headers)
+
+    def get_content(self):
+        """Waits for the fetch to finish, returning the feed's content if it
+        has changed since it was last handled, or None otherwise."""
+        logging.info('Fetching %s...' % self.url)
+        try:
+            resp = self.rpc.get_result()
+        except urlfetch.Error, e:
+            logging.error('Could not fetch %s: %s' % (self.url, e))
+            return None
+        if resp.status_code == 304:
+            logging.info('%s: not modified' % self.name)
+            return None
+        if resp.status_code != 200:
+            logging.error('Could not fetch %s. Bad response: %s' % (
+                    self.url, resp.status_code))
+            return None
+
+        content_hash = hashlib.sha1(resp.content).hexdigest()
+        unchanged = self.state.url == self.url and \
+            self.state.content_hash == content_hash
+
+        self.state.url = self.url
+        self.state.etag = resp.headers.get('ETag')
+        self.state.last_modified = resp.headers.get('Last-Modified')
+        self.state.content_hash = content_hash
+        if unchanged:
+            logging.info('%s: content unchanged' % self.name)
+            self.state.put()
+            return None
+        return resp.content
+
+    def mark_handled(self):
+        """Stores the new feed state. Should only be called once the content
+        has been successfully handled, so that failures are retried."""
+        self.state.put()
+
+
+def fetch_feeds(feeds):
+    """Starts conditional fetches for all of the given (name, url) pairs at
+    once, returning a list of FeedFetch objects."""
+    names = [name for name, url in feeds]
+    states = FeedState.get_by_key_name(names)
+    return [FeedFetch(name, url, state)
+            for (name, url), state in zip(feeds, states)]
+
+def update_feeds(names):
+    """Fetches the named feeds concurrently, and hands the content of each
+    one that has changed to its handler. Returns the names of the feeds that
+    were handled successfully."""
+    from data import odds, scores
+    handlers = {
+        'odds': (odds.feed_url, odds.handle_content),
+        'scores': (scores.feed_url, scores.handle_content),
+        }
+    fetches = fetch_feeds([(name, handlers[name][0]) for name in names])
+    handled = []
+    for fetch in fetches:
+        content = fetch.get_content()
+        if content is None:
+            continue
+        handler = handlers[fetch.name][1]
+        try:
+            handler(content)
+        except Exception, e:
+            logging.exception('Error handling %s feed' % fetch.name)
+        else:
+            fetch.mark_handled()
+            handled.append(fetch.name)
+    return handled
@@ -1,15 +1,30 @@
 import csv
 import datetime
-from itertools import groupby
+import logging
 from operator import itemgetter
 
 from google.appengine.ext import db
 
+from lib import schedule
 from models import Team, Season, Week, Game
 
 
+# The maximum number of entities to get or put in a single call
+BATCH_SIZE = 100
 
-def import_schedule(season=None):
+SCHEDULE_PATH = 'data/examples/2011-2012-schedule.csv'
+
+
+def import_schedule(path=SCHEDULE_PATH, season=None, dry_run=False):
+    """Imports the schedule in the CSV file at the given path into the given
+    season (defaulting to the current season). Weeks and games are keyed
+    deterministically (by week number, and by 'away@home' under each week),
+    so the import is idempotent: existing entities are fetched in bulk and
+    only new or changed weeks and games are written, in batches.
+
+    If `dry_run` is True, nothing is written. Either way, returns a dict of
+    lists of the keys that were (or would be) `created` and `updated`, and
+    the number of entities that were `unchanged`."""
 
     # We want to convert from Eastern Time in the schedule to UTC
     import pytz
@@ -20,68 +35,97 @@ def import_schedule(season=None):
 
     # Make a map of all the teams. Map by both name and place because the
     # input data uses either one, sort of arbitrarily.
-    teams = Team.all().fetch(32)
+    teams = Team.all_teams()
     team_map = dict((t.name, t) for t in teams)
     team_map.update(
         dict((t.place, t) for t in teams))
 
-    # We'll build up the weeks and games we're importing in these structures.
-    week_map = {}
-    games = []
-
-    csvlines = open('data/examples/2011-2012-schedule.csv').readlines()[1:]
-    reader = csv.reader(csvlines)
-    for row in reader:
-        # Figure out kickoff
-        kickoff = '%s %s' % itemgetter(0,7)(row)
-        kickoff = datetime.datetime.strptime(kickoff, '%m/%d/%Y %I:%M %p')
-        kickoff = est.localize(kickoff).astimezone(pytz.utc)
-
-        # Look up home and away teams by team name in the team map
-        team_names = [_.strip() for _ in row[-2:]]
-        home, away = itemgetter(*team_names)(team_map)
-
-        # Figure out what week this game belongs to. The data in the CSV is a
-        # string like this:
-        # 'NFL Week 8:    Chargers @ Chiefs          [TV: ESPN]'
-        info = row[2]
-        week_num = int(info.split()[2][:-1])
-
-        if week_num not in week_map:
-            key = db.Key.from_path('Week', week_num, parent=season.key())
-            week_map[week_num] = Week(
-                key=key,
-                name = 'Week %s' % week_num)
-        week = week_map[week_num]
-
-        key_name = '%s@%s' % (away.slug, home.slug)
-
-        game = dict(
-            parent=week,
-            key_name=key_name,
-            home_team=home,
-            away_team=away,
-            teams=[home.key(), away.key()],
-            start=kickoff)
-        games.append(game)
-
-    games.sort(key=itemgetter('parent'))
-
-    # Figure out each week's end date based on the latest kickoff of its games
-    for week, week_games in groupby(games, itemgetter('parent')):
-        week_games = list(week_games)
-        start = min(game['start'] for game in week_games)
-        end = max(game['start'] for game in week_games)
-        week.start = start
-        week.end = end + datetime.timedelta(hours=5)
-
-    # Store the weeks, so they have "complete" keys, and can therefore be used
-    # as the parents to the games we're about to create.
-    week_keys = db.put(week_map.values())
-
-    # Create actual game entities from the kwargs we gathered, and store them.
-    games = [Game(**kwargs) for kwargs in games]
-    game_keys = db.put(games)
-
-    return week_keys + game_keys
-
+    # Stream through the schedule, keeping just the fields we need for each
+    # game, grouped by week number.
+    weeks = {}
+    f = open(path)
+    try:
+        reader = csv.reader(f)
+        reader.next() # Skip the header row
+        for row in reader:
+            # Figure out kickoff
+            kickoff = '%s %s' % itemgetter(0,7)(row)
+            kickoff = datetime.datetime.strptime(kickoff, '%m/%d/%Y %I:%M %p')
+            kickoff = est.localize(kickoff).astimezone(pytz.utc)
+            kickoff = kickoff.replace(tzinfo=None)
+
+            # Look up home and away teams by team name in the team map
+            team_names = [_.strip() for _ in row[-2:]]
+            home, away = itemgetter(*team_names)(team_map)
+
+            # Figure out what week this game belongs to. The data in the CSV
+            # is a string like this:
+            # 'NFL Week 8:    Chargers @ Chiefs          [TV: ESPN]'
+            info = row[2]
+            week_num = int(info.split()[2][:-1])
+            weeks.setdefault(week_num, []).append((home, away, kickoff))
+    finally:
+        f.close()
+
+    # Build the fields each week and game should have, by key
+    week_fields = {}
+    game_fields = {}
+    for week_num, games in weeks.iteritems():
+        week_key = db.Key.from_path('Week', week_num, parent=season.key())
+        # Each week's end is based on the latest kickoff of its games
+        kickoffs = [kickoff for _, _, kickoff in games]
+        week_fields[week_key] = dict(
+            name='Week %s' % week_num,
+            start=min(kickoffs),
+            end=max(kickoffs) + datetime.timedelta(hours=5))
+        for home, away, kickoff in games:
+            key_name = '%s@%s' % (away.slug, home.slug)
+            game_key = db.Key.from_path('Game', key_name, parent=week_key)
+            game_fields[game_key] = dict(
+                home_team=home.key(),
+                away_team=away.key(),
+                teams=[home.key(), away.key()],
+                start=kickoff)
+
+    # Weeks go first, so they exist before the games under them
+    report = dict(created=[], updated=[], unchanged=0)
+    for model, fields in ((Week, week_fields), (Game, game_fields)):
+        to_put = diff_entities(model, fields, report)
+        if not dry_run:
+            for i in xrange(0, len(to_put), BATCH_SIZE):
+                db.put(to_put[i:i + BATCH_SIZE])
+
+    logging.info('%s schedule import: %s created, %s updated, %s unchanged'
+                 % ('Dry run of' if dry_run else 'Finished',
+                    len(report['created']), len(report['updated']),
+                    report['unchanged']))
+
+    # Let any in-memory schedule indexes know that the schedule changed
+    if not dry_run and (report['created'] or report['updated']):
+        schedule.invalidate(season)
+
+    return report
+
+def diff_entities(model, fields, report):
+    """Compares the given dict of keys and property values against the
+    existing entities of the given model, fetched in batches. Returns the
+    list of new or changed entities that need to be written, and records
+    the differences in the given report."""
+    keys = sorted(fields)
+    to_put = []
+    for i in xrange(0, len(keys), BATCH_SIZE):
+        batch = keys[i:i + BATCH_SIZE]
+        for key, entity in zip(batch, model.get(batch)):
+            values = fields[key]
+            if entity is None:
+                to_put.append(model(key=key, **values))
+                report['created'].append(key)
+            elif any(model.properties()[name].get_value_for_datastore(entity)
+                     != value for name, value in values.iteritems()):
+                for name, value in values.iteritems():
+                    setattr(entity, name, value)
+                to_put.append(entity)
+                report['updated'].append(key)
+            else:
+                report['unchanged'] += 1
+    return to_put
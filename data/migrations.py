@@ -0,0 +1,138 @@
+"""
+One-off data migrations, run as chains of deferred tasks (see
+MigrationHandler in data.views).
+
+rekey_entries moves each Entry (along with its picks) to its deterministic
+root key (see Entry.key_for): out of its Pool's entity group, for entries
+that are still children of their pool, and from an allocated id to a key name
+made from the pool and account, for entries created before key names were.
+Once every entry has been re-keyed, settings.ENTRIES_MIGRATED should be set.
+
+build_pick_teams stores the pick_teams array of entries created before it
+existed, which otherwise have to rebuild it from their picks on every read.
+"""
+
+import logging
+
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+from models import Pool, Entry, Pick, PoolStandings, WeekPicks, \
+    reset_entry_counters
+
+
+# How many entries are scanned by each task in the pipeline
+BATCH_SIZE = 50
+
+
+def rekey_entries(cursor=None):
+    """Scans one batch of entries (starting at the given query cursor),
+    re-keying any that aren't at their deterministic keys yet. The pools'
+    standings and pick digests are thrown away to be rebuilt with the new
+    entry ids, and their entry counters are reset, in case they were seeded
+    by queries that could not see the old entries. If there are more entries
+    to scan, a task is deferred to handle the next batch."""
+    query = Entry.all()
+    if cursor:
+        query.with_cursor(cursor)
+    entries = query.fetch(BATCH_SIZE)
+
+    legacy = []
+    for entry in entries:
+        account_key = Entry.account.get_value_for_datastore(entry)
+        if account_key is None:
+            logging.warning('Not re-keying entry %s with no account' % (
+                    entry.key()))
+            continue
+        new_key = Entry.key_for(entry.pool_key(), account_key)
+        if entry.key() != new_key:
+            rekey_entry(entry.key(), new_key)
+            legacy.append(entry)
+
+    if legacy:
+        pool_keys = set(entry.pool_key() for entry in legacy)
+        stale = [PoolStandings.key_for(pool_key) for pool_key in pool_keys]
+        for pool_key in pool_keys:
+            digests = db.Query(WeekPicks, keys_only=True).ancestor(pool_key)
+            stale.extend(digests)
+        db.delete(stale)
+        for pool in filter(None, Pool.get(list(pool_keys))):
+            reset_entry_counters(pool)
+
+    logging.info('Re-keyed %s of %s entries' % (len(legacy), len(entries)))
+    if len(entries) == BATCH_SIZE:
+        deferred.defer(rekey_entries, query.cursor())
+
+def rekey_entry(entry_key, new_key):
+    """Copies the given entry and its picks to the given (root) key, and
+    deletes the originals, in a single cross-group transaction. Returns the
+    new entry, or None if the original no longer exists. If there is
+    already an entry at the new key (e.g., the account rejoined the pool
+    before its old entry was migrated), the old entry is left alone to be
+    sorted out by hand."""
+    def txn():
+        entry, existing = db.get([entry_key, new_key])
+        if entry is None:
+            return None
+        if existing is not None:
+            logging.error('Cannot re-key entry %s, %s already exists' % (
+                    entry_key, new_key))
+            return None
+        picks = entry.picks.fetch(100)
+        new_entry = Entry(key=new_key, **_values(entry))
+        new_entry.pool = entry.pool_key()
+        new_picks = [
+            Pick(key=db.Key.from_path('Pick', pick.key().id(), parent=new_key),
+                 **_values(pick))
+            for pick in picks]
+        db.put([new_entry] + new_picks)
+        db.delete([entry_key] + [pick.key() for pick in picks])
+        return new_entry
+    options = db.create_transaction_options(xg=True)
+    return db.run_in_transaction_options(options, txn)
+
+def build_pick_teams(cursor=None):
+    """Scans one batch of entries (starting at the given query cursor),
+    storing the pick_teams array of any that don't have one yet (see
+    Entry.get_pick_teams). If there are more entries to scan, a task is
+    deferred to handle the next batch."""
+    query = Entry.all()
+    if cursor:
+        query.with_cursor(cursor)
+    entries = query.fetch(BATCH_SIZE)
+
+    built = 0
+    for entry in entries:
+        if entry.pick_teams is None and store_pick_teams(entry.key()):
+            built += 1
+
+    logging.info('Built pick teams for %s of %s entries' % (
+            built, len(entries)))
+    if len(entries) == BATCH_SIZE:
+        deferred.defer(build_pick_teams, query.cursor())
+
+def store_pick_teams(entry_key):
+    """Builds and stores the given entry's pick_teams array from its picks,
+    in a transaction, unless it already has one. Returns True if it was
+    stored."""
+    def txn():
+        entry = Entry.get(entry_key)
+        if entry is None or entry.pick_teams is not None:
+            return False
+        entry.get_pick_teams()
+        entry.put()
+        return True
+    return db.run_in_transaction(txn)
+
+def _values(entity):
+    """The given entity's property values, as keyword arguments for creating
+    a copy of it."""
+    return dict((name, prop.get_value_for_datastore(entity))
+                for name, prop in entity.properties().iteritems())
+
+# The migrations that can be started by name (see MigrationHandler), each of
+# which takes care of deferring the rest of its batches
+MIGRATIONS = {
+    'rekey_entries': rekey_entries,
+    'build_pick_teams': build_pick_teams,
+    }
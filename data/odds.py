@@ -1,49 +1,111 @@
 import datetime
 import logging
 import re
+from StringIO import StringIO
 from xml.etree import ElementTree
 
 from google.appengine.ext import db
-from google.appengine.api import urlfetch
 
-from models import Team, Game
+from lib import schedule
+from models import Team, Season, Game, LineHistory
+import settings
 
 
-feed_url = 'http://content.linesmaker.com/xml/lines/203.xml'
+feed_url = settings.ODDS_FEED_URL
 teams = Team.all_teams()
 team_map = dict((team.name.lower(), team) for team in teams)
 
+# How many days past an event's posting date to look for its game
+MATCH_WINDOW = datetime.timedelta(days=7)
+
 
 def update_odds():
-    logging.info('Fetching %s...' % feed_url)
-    resp = urlfetch.fetch(feed_url)
-    if not resp.status_code == 200:
-        return logging.error(
-            'Could not update odds. Bad response: %s' % resp.status_code)
+    from data import feeds
+    return feeds.update_feeds(['odds'])
+
+def handle_content(content):
     logging.info('Parsing XML...')
     try:
-        doc = ElementTree.fromstring(resp.content)
+        lines = parse_lines(content)
     except Exception, e:
         logging.error('Parse error: %s' % e)
-        logging.error('Contents:\n%s' % resp.content)
-    else:
-        events = doc.findall('event')
-        games = [handle_event(event) for event in events]
-        logging.info('Found odds for %s games' % len(games))
-        db.put(games)
+        logging.error('Contents:\n%s' % content)
+        raise
+    return handle_lines(lines)
 
-def handle_event(event):
-    home_team, away_team, date = find_event_info(event)
-    game = Game.all()\
-        .filter('home_team =', home_team)\
-        .filter('away_team =', away_team)\
-        .filter('start >=', date)\
-        .get()
+def parse_lines(content):
+    """Streams through the given feed XML, returning a list of (home team,
+    away team, date, points) tuples, one per event. Each event is discarded
+    as soon as it has been parsed, so memory use stays flat."""
+    lines = []
+    for _, elem in ElementTree.iterparse(StringIO(content)):
+        if elem.tag == 'event':
+            lines.append(handle_event(elem))
+            elem.clear()
+    return lines
+
+def handle_lines(lines, season=None):
+    """Matches the given lines to their games in memory, using an index of
+    the candidate games loaded in a single query, and writes the games whose
+    lines changed in a single batch. Returns the list of updated games."""
+    if not lines:
+        return []
+    season = season or Season.current()
+    first_date = min(date for _, _, date, _ in lines)
+    last_date = max(date for _, _, date, _ in lines) + MATCH_WINDOW
+
+    # Index the candidate games by matchup, in order of kickoff
+    index = {}
+    for game in schedule.fetch_games(season, first_date, last_date):
+        home_key = Game.home_team.get_value_for_datastore(game)
+        away_key = Game.away_team.get_value_for_datastore(game)
+        index.setdefault((home_key, away_key), []).append(game)
 
-    if not game:
-        return logging.error(
-            'No game for %s @ %s @ %s' % (away_team, home_team, date))
+    changed = []
+    for home_team, away_team, date, points in lines:
+        game = find_game(index, home_team, away_team, date)
+        if not game:
+            logging.error(
+                'No game for %s @ %s @ %s' % (away_team, home_team, date))
+            continue
+        if game.spread != points:
+            game.spread = points
+            changed.append(game)
+            logging.info('%s: %s' % (game, points))
 
+    logging.info('Found odds for %s games, %s changed' % (
+            len(lines), len(changed)))
+    if changed:
+        histories = record_lines(changed)
+        db.put(changed + histories)
+    return changed
+
+def record_lines(games):
+    """Appends each of the given games' current spread to its LineHistory,
+    fetching the histories in a single batch. Returns the (unsaved)
+    histories."""
+    now = datetime.datetime.utcnow()
+    keys = [LineHistory.key_for(game) for game in games]
+    histories = []
+    for game, key, history in zip(games, keys, db.get(keys)):
+        if game.spread is None:
+            continue
+        if history is None:
+            history = LineHistory(key=key)
+        history.append(game.spread, now)
+        histories.append(history)
+    return histories
+
+def find_game(index, home_team, away_team, date):
+    """Finds the first game between the given teams on or after the given
+    date in the given index."""
+    for game in index.get((home_team.key(), away_team.key()), []):
+        if schedule.local_date(game) >= date:
+            return game
+    return None
+
+def handle_event(event):
+    home_team, away_team, date = find_event_info(event)
     markets = event.find('markets').findall('market')
     points = None
     for market in markets:
@@ -56,9 +118,7 @@ def handle_event(event):
                     'Unknown points: %r' % market.find('points').text)
                 points = None
             break
-    game.spread = points
-    logging.info('%s: %s' % (game, points))
-    return game
+    return home_team, away_team, date, points
 
 def find_event_info(event):
     meta = event.find('eventDescriptor')
@@ -0,0 +1,95 @@
+"""
+Schedules score updates around the games themselves: while games are live
+(or about to kick off), the scores feed is polled every minute; once every
+game in the window is final, polling goes idle until shortly before the next
+kickoff.
+
+Polling runs as a chain of deferred tasks, each of which updates the scores
+(along with the odds, in the same concurrent fetch) and then enqueues the
+next one. Tasks are named after their (aligned) ETAs,
+so however many times the chain is (re)started, e.g. by the cron watchdog,
+only one poll runs per slot.
+"""
+
+import calendar
+import datetime
+import logging
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import deferred
+
+from lib import schedule
+from models import Season
+
+from data import feeds
+
+
+# How often to poll while games are live or about to start
+LIVE_INTERVAL = datetime.timedelta(minutes=1)
+
+# How often to poll for games that should be over, but aren't final yet
+OVERDUE_INTERVAL = datetime.timedelta(minutes=10)
+
+# How long before kickoff to start polling
+PREGAME = datetime.timedelta(minutes=10)
+
+# How long after kickoff a game is expected to be over
+GAME_LENGTH = datetime.timedelta(hours=4)
+
+# How far ahead to look for upcoming games
+LOOKAHEAD = datetime.timedelta(days=8)
+
+
+def poll_scores():
+    """Updates the scores and odds, then schedules the next poll."""
+    feeds.update_feeds(['odds', 'scores'])
+    return schedule_next_poll()
+
+def schedule_next_poll(now=None):
+    """Enqueues the next poll (if there is one to be made) based on the
+    current season's games. Returns the poll's ETA, or None."""
+    now = now or datetime.datetime.now()
+    season = Season.current()
+    if season is None:
+        return None
+    today = now.date()
+    games = schedule.fetch_games(
+        season, today - datetime.timedelta(days=1), today + LOOKAHEAD)
+    eta = next_poll_time(games, now)
+    if eta is None:
+        logging.info('No upcoming games, score polling is idle')
+        return None
+
+    name = 'poll-scores-%d' % calendar.timegm(eta.timetuple())
+    try:
+        deferred.defer(poll_scores, _name=name, _eta=eta)
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError), e:
+        logging.info('Score poll %s already scheduled' % name)
+    else:
+        logging.info('Next score poll at %s' % eta)
+    return eta
+
+def next_poll_time(games, now):
+    """Figures out when the scores should next be polled, given the games
+    around now: soon if any are live or about to start, less often if some
+    should be over but aren't final, and otherwise shortly before the next
+    kickoff. Returns None if there are no unfinished games at all."""
+    unfinished = [game for game in games if not game.final]
+    if any(game.start - PREGAME <= now < game.start + GAME_LENGTH
+           for game in unfinished):
+        return align(now, LIVE_INTERVAL)
+    if any(game.start + GAME_LENGTH <= now for game in unfinished):
+        return align(now, OVERDUE_INTERVAL)
+    upcoming = [game.start for game in unfinished if game.start > now]
+    if upcoming:
+        return align(min(upcoming) - PREGAME, LIVE_INTERVAL)
+    return None
+
+def align(when, interval):
+    """Rounds the given time up to the next multiple of the given interval,
+    so that polls scheduled from different places land on the same slot."""
+    seconds = interval.days * 86400 + interval.seconds
+    timestamp = calendar.timegm(when.timetuple())
+    timestamp = (timestamp // seconds + 1) * seconds
+    return datetime.datetime.utcfromtimestamp(timestamp)
@@ -0,0 +1,135 @@
+"""
+Ingests the live scores feed, updating the scores of the games in it and
+kicking off pick evaluation (and suicide pool elimination) for the games
+that have just gone final.
+
+The feed is a JSON object keyed by game id (the game's local date plus a
+two digit sequence number, e.g. '2010091907'). Each game has `home` and
+`away` teams, each with an `abbr` and per-quarter scores (with `T` being the
+total), and a `qtr` that starts with 'final' once the game is over. See
+data/examples/scores.json.
+"""
+
+import datetime
+import logging
+
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+from django.utils import simplejson as json
+
+from lib import schedule
+from models import Season, Game
+
+from data import evaluation, elimination
+import settings
+
+
+feed_url = settings.SCORES_FEED_URL
+
+# The few feed abbreviations that don't match our team slugs
+FEED_TEAM_SLUGS = {
+    'ARZ': 'ari',
+    'BLT': 'bal',
+    'CLV': 'cle',
+    'HST': 'hou',
+    'JAX': 'jac',
+    'SL': 'stl',
+    'WAS': 'wsh',
+    }
+
+
+def update_scores():
+    from data import feeds
+    return feeds.update_feeds(['scores'])
+
+def handle_content(content):
+    try:
+        feed = json.loads(content)
+    except Exception, e:
+        logging.error('Parse error: %s' % e)
+        logging.error('Contents:\n%s' % content)
+        raise
+    return handle_feed(feed)
+
+def handle_feed(feed, season=None):
+    """Updates the games in the given (parsed) scores feed, writing only the
+    games whose scores or status changed in a single batch. Returns the list
+    of updated games."""
+    results = filter(None, [parse_result(game_id, data)
+                            for game_id, data in feed.iteritems()])
+    if not results:
+        return []
+
+    season = season or Season.current()
+    games = find_games(season, [result['date'] for result in results])
+
+    changed = []
+    newly_final = []
+    for result in results:
+        game = games.get((result['away'], result['home'], result['date']))
+        if game is None:
+            logging.error('No game for %(away)s @ %(home)s on %(date)s'
+                          % result)
+            continue
+        if (game.home_score, game.away_score, game.final) == \
+                (result['home_score'], result['away_score'], result['final']):
+            continue
+        if result['final'] and not game.final:
+            newly_final.append(game)
+        game.home_score = result['home_score']
+        game.away_score = result['away_score']
+        game.final = result['final']
+        changed.append(game)
+
+    logging.info('Updating scores for %s of %s games (%s newly final)' % (
+            len(changed), len(results), len(newly_final)))
+    if changed:
+        db.put(changed)
+    if newly_final:
+        handle_final_games(newly_final)
+    return changed
+
+def handle_final_games(games):
+    """Kicks off pick evaluation for the given games, which have just gone
+    final, and suicide pool elimination for any of their weeks that are now
+    over."""
+    deferred.defer(evaluation.evaluate_games, [game.key() for game in games])
+    week_keys = set(game.parent_key() for game in games)
+    for week in db.get(list(week_keys)):
+        if all(game.final for game in week.games.fetch(100)):
+            elimination.eliminate_week(week)
+
+def parse_result(game_id, data):
+    """Parses a single game from the feed into a dict with home and away
+    team slugs, the game's local date, scores and whether it is final.
+    Returns None for games that haven't started."""
+    try:
+        date = datetime.datetime.strptime(game_id[:8], '%Y%m%d').date()
+        home, away = data['home'], data['away']
+        home_score, away_score = home['score']['T'], away['score']['T']
+    except (KeyError, TypeError, ValueError), e:
+        logging.error('Bad scores data for game %s: %s' % (game_id, e))
+        return None
+    if home_score is None or away_score is None:
+        return None
+    return dict(
+        home=get_slug(home['abbr']),
+        away=get_slug(away['abbr']),
+        date=date,
+        home_score=int(home_score),
+        away_score=int(away_score),
+        final=(data.get('qtr') or '').lower().startswith('final'))
+
+def find_games(season, dates):
+    """Fetches all of the given season's games on the given (local) dates in
+    a single query, returning a dict mapping (away slug, home slug, local
+    date) to each game."""
+    index = {}
+    for game in schedule.fetch_games(season, min(dates), max(dates)):
+        away = Game.away_team.get_value_for_datastore(game).name()
+        home = Game.home_team.get_value_for_datastore(game).name()
+        index[(away, home, schedule.local_date(game))] = game
+    return index
+
+def get_slug(abbr):
+    return FEED_TEAM_SLUGS.get(abbr, abbr.lower())
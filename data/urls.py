@@ -3,4 +3,8 @@ import views
 
 urls = [
     Route(r'/data/odds', views.OddsHandler, 'odds'),
+    Route(r'/data/scores', views.ScoresHandler, 'scores'),
+    Route(r'/data/feeds', views.FeedsHandler, 'feeds'),
+    Route(r'/data/migrations/<:\w+>', views.MigrationHandler, 'migration'),
+    Route(r'/data/cache', views.CacheStatsHandler, 'cache-stats'),
     ]
@@ -1,4 +1,5 @@
 import logging
+from webob.exc import HTTPNotFound
 from lib.webapp import RequestHandler
 
 
@@ -10,7 +11,37 @@ class OddsHandler(RequestHandler):
         odds.update_odds()
 
 
+class FeedsHandler(RequestHandler):
+
+    def get(self):
+        from data import feeds
+        logging.info('Updating odds and scores...')
+        feeds.update_feeds(['odds', 'scores'])
+
+
 class ScoresHandler(RequestHandler):
 
     def get(self):
+        from data import polling
         logging.info('Updating scores...')
+        polling.poll_scores()
+
+
+class CacheStatsHandler(RequestHandler):
+
+    def get(self):
+        from lib.caching import cache_stats
+        import models # Registers the model caches in this process
+        self.send_json(cache_stats())
+
+
+class MigrationHandler(RequestHandler):
+
+    def get(self, name):
+        from google.appengine.ext import deferred
+        from data import migrations
+        migration = migrations.MIGRATIONS.get(name)
+        if migration is None:
+            raise HTTPNotFound('Unknown migration: %s' % name)
+        logging.info('Starting migration %s...' % name)
+        deferred.defer(migration)
@@ -0,0 +1,97 @@
+"""
+Sends pool invitation emails in the background. An Invitation records the
+rendered email and the delivery state of each address, and the addresses are
+sent in small batches by deferred tasks on the rate-limited `mail` queue (see
+queue.yaml), so that inviting hundreds of people doesn't happen inside the
+inviter's request, and a failure partway through can be retried without
+re-sending to anyone.
+"""
+
+import logging
+import os
+
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+from google.appengine.api import mail
+from google.appengine.api import taskqueue
+
+from models import Invitation
+import settings
+
+
+# How many addresses each task sends to
+BATCH_SIZE = 10
+
+# How many times to try sending to an address before giving up on it
+MAX_ATTEMPTS = 5
+
+
+class DeliveryError(Exception):
+    """Raised to have a batch retried when some of its sends failed."""
+
+
+def send_invitations(pool, sender, subject, body, emails):
+    """Records an invitation to the given pool from the given account, with
+    the given (already rendered) subject and body, and enqueues tasks to
+    send it to the given email addresses. Returns the Invitation."""
+    emails = list(dict.fromkeys(emails))
+    invitation = Invitation(
+        parent=pool,
+        sender=sender.key(),
+        subject=subject,
+        body=body,
+        pending=emails)
+    def txn():
+        invitation.put()
+        deferred.defer(queue_batches, invitation.key(), _transactional=True)
+    db.run_in_transaction(txn)
+    logging.info('Queued invitation %s to %s addresses' % (
+            invitation.key(), len(emails)))
+    return invitation
+
+def queue_batches(invitation_key):
+    """Enqueues a task to send each batch of the given invitation's pending
+    addresses. Deferred in the transaction that stores the invitation, which
+    can only enqueue a handful of tasks itself. The batch tasks are named
+    after the invitation, so this can safely be retried."""
+    invitation = Invitation.get(invitation_key)
+    emails = invitation.pending
+    for i in xrange(0, len(emails), BATCH_SIZE):
+        name = 'invitation-%s-%s-%d' % (
+            invitation_key.parent().id_or_name(), invitation_key.id(),
+            i // BATCH_SIZE)
+        try:
+            deferred.defer(send_batch, invitation_key,
+                           emails[i:i + BATCH_SIZE], _queue='mail',
+                           _name=name)
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError), e:
+            pass
+
+def send_batch(invitation_key, emails):
+    """Sends the given invitation to the given addresses, skipping any that
+    have already been handled. If any sends fail, the task is retried (for
+    just the failed addresses), up to MAX_ATTEMPTS times."""
+    invitation = Invitation.get(invitation_key)
+    emails = [email for email in emails if email in invitation.pending]
+    sent, failed = [], []
+    for email in emails:
+        try:
+            mail.send_mail(
+                sender=settings.EMAIL_FROM,
+                to=email,
+                subject=invitation.subject,
+                body=invitation.body)
+        except Exception, e:
+            logging.error('Could not send invitation to %s: %s' % (email, e))
+            failed.append(email)
+        else:
+            sent.append(email)
+
+    # Give up on the failed addresses once we've run out of attempts
+    attempts = int(os.environ.get('HTTP_X_APPENGINE_TASKRETRYCOUNT', 0)) + 1
+    give_up = attempts >= MAX_ATTEMPTS
+    Invitation.record_deliveries(
+        invitation_key, sent, failed if give_up else [])
+    if failed and not give_up:
+        raise DeliveryError('Failed to send to %s addresses' % len(failed))
@@ -1,8 +1,10 @@
 """
-Some code written by Nick Johnson of Google to help cache lists of models.
+Some code written by Nick Johnson of Google to help cache lists of models,
+and a two-tier (in-process LRU + memcache) cache built on top of it.
 """
 
 import logging
+import time
 from binascii import b2a_base64 as b2a, a2b_base64 as a2b
 
 from google.appengine.ext import db
@@ -29,40 +31,229 @@ def deserialize_models(data):
         return [db.model_from_protobuf(entity_pb.EntityProto(x))
                 for x in data]
 
-def cachemodel(key, model, **kwargs):
-    """Serializes the given model or models and caches them under the given
-    key. If key is a list, model should be an equal-length list.  Keyword args
-    are passed on to memcache."""
-    data = serialize_models(model)
-    if isinstance(key, (list, tuple)):
-        to_cache = dict((k, v) for k, v in zip(key, data))
+
+##############################################################################
+# A two-tier cache: a bounded in-process LRU in front of memcache
+##############################################################################
+
+# Used to tell a cache miss apart from a cached None
+MISSING = object()
+
+# How long (in seconds) a process trusts its copy of a namespace's
+# generation before checking memcache for a newer one
+GENERATION_CHECK_INTERVAL = 10
+
+# Every two-tier cache created in this process, by namespace
+caches = {}
+
+
+class LRUCache(object):
+    """A bounded, in-process cache that evicts its least recently used
+    entries first. Each entry may have its own TTL, in seconds."""
+
+    def __init__(self, max_size=500):
+        self.max_size = max_size
+        self.evictions = 0
+        # Entries are kept in a circular doubly-linked list, most recently
+        # used first. Each link is [prev, next, key, value, expires].
+        self._links = {}
+        self._root = root = []
+        root[:] = [root, root, None, None, None]
+
+    def __len__(self):
+        return len(self._links)
+
+    def get(self, key, default=MISSING):
+        link = self._links.get(key)
+        if link is None:
+            return default
+        if link[4] is not None and link[4] <= time.time():
+            self._unlink(link)
+            return default
+        # Move the link to the front of the list
+        self._unlink(link)
+        self._link(link)
+        return link[3]
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        link = self._links.get(key)
+        if link is not None:
+            self._unlink(link)
+        self._link([None, None, key, value, expires])
+        while len(self._links) > self.max_size:
+            self._unlink(self._root[0])
+            self.evictions += 1
+
+    def delete(self, key):
+        link = self._links.get(key)
+        if link is not None:
+            self._unlink(link)
+
+    def clear(self):
+        self._links.clear()
+        self._root[:] = [self._root, self._root, None, None, None]
+
+    def _link(self, link):
+        root = self._root
+        first = root[1]
+        link[0], link[1] = root, first
+        first[0] = root[1] = link
+        self._links[link[2]] = link
+
+    def _unlink(self, link):
+        prev, next = link[0], link[1]
+        prev[1], next[0] = next, prev
+        del self._links[link[2]]
+
+
+class Cache(object):
+    """A two-tier cache for a single namespace: values are looked up in a
+    bounded in-process LRU first, then in memcache. Models (and lists of
+    models) are stored in memcache as protobufs and only decoded once per
+    process, when they're copied into the local tier.
+
+    NOTE: Values in the local tier are shared between requests, so they
+    should be treated as read-only.
+
+    Every key in the namespace is prefixed with the namespace's generation
+    number, so the whole namespace can be invalidated at once by bumping the
+    generation with `invalidate()`."""
+
+    def __init__(self, namespace, max_size=500, ttl=None, local_ttl=60):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.local = LRUCache(max_size)
+        self.hits = self.local_hits = self.misses = 0
+        self._generation = None
+        self._generation_checked_at = 0
+        caches[namespace] = self
+
+    @property
+    def stats(self):
+        """Hit, miss and eviction counts for this process."""
+        return dict(hits=self.hits,
+                    local_hits=self.local_hits,
+                    misses=self.misses,
+                    evictions=self.local.evictions,
+                    size=len(self.local))
+
+    @property
+    def generation(self):
+        now = time.time()
+        if now - self._generation_checked_at > GENERATION_CHECK_INTERVAL:
+            generation = memcache.get(
+                self.namespace, namespace='cache-generations')
+            if generation is None:
+                generation = int(now)
+                if not memcache.add(self.namespace, generation,
+                                    namespace='cache-generations'):
+                    generation = memcache.get(
+                        self.namespace, namespace='cache-generations')
+            if generation != self._generation:
+                self.local.clear()
+                self._generation = generation
+            self._generation_checked_at = now
+        return self._generation
+
+    def invalidate(self):
+        """Invalidates every key in this namespace, in every process (within
+        GENERATION_CHECK_INTERVAL seconds)."""
         try:
-            return memcache.set_multi(to_cache, **kwargs)
+            memcache.incr(self.namespace, namespace='cache-generations',
+                          initial_value=int(time.time()))
         except Exception, e:
-            logging.error('cachemodel: memcache.set_multi(%r) failed' % key)
-            return False
-    else:
+            logging.error('Cache: could not invalidate %s' % self.namespace)
+        self.local.clear()
+        self._generation_checked_at = 0
+
+    def get(self, key, default=None):
+        return self.get_multi([key]).get(key, default)
+
+    def get_multi(self, keys):
+        """Gets the given keys, returning a dict of the ones that were
+        found."""
+        generation = self.generation
+        found = {}
+        remote_keys = []
+        for key in keys:
+            value = self.local.get((generation, key))
+            if value is MISSING:
+                remote_keys.append(key)
+            else:
+                found[key] = value
+        self.hits += len(found)
+        self.local_hits += len(found)
+
+        if remote_keys:
+            try:
+                data = memcache.get_multi(
+                    remote_keys, key_prefix=self._prefix(generation),
+                    namespace=self.namespace)
+            except Exception, e:
+                logging.error('Cache: memcache.get_multi(%r) failed' % keys)
+                data = {}
+            for key, value in data.iteritems():
+                value = _decode(value)
+                self.local.set((generation, key), value, self.local_ttl)
+                found[key] = value
+            self.hits += len(data)
+            self.misses += len(remote_keys) - len(data)
+        return found
+
+    def set(self, key, value, ttl=None):
+        return self.set_multi({ key: value }, ttl)
+
+    def set_multi(self, mapping, ttl=None):
+        """Caches the given dict of keys and values in both tiers."""
+        ttl = ttl or self.ttl
+        generation = self.generation
+        local_ttl = min(filter(None, [ttl, self.local_ttl]) or [None])
+        for key, value in mapping.iteritems():
+            self.local.set((generation, key), value, local_ttl)
+        data = dict((k, _encode(v)) for k, v in mapping.iteritems())
         try:
-            return memcache.set(key, data, **kwargs)
+            return not memcache.set_multi(
+                data, time=ttl or 0, key_prefix=self._prefix(generation),
+                namespace=self.namespace)
         except Exception, e:
-            logging.error('cachemodel: memcache.set(%r) failed' % key)
+            logging.error('Cache: memcache.set_multi(%r) failed' % mapping)
             return False
 
-def uncachemodel(key, **kwargs):
-    """Tries to retrieve the specified value from the cache.  If found, it is
-    assumed to be a cached model and will be deserialized.  If key is a list,
-    a dictionary will be returned.  Keyword args are passed on to memcache."""
-    if isinstance(key, (list, tuple)):
-        try:
-            data = memcache.get_multi(key, **kwargs)
-        except Exception, e:
-            logging.error('uncachemodel: memcache.get_multi(%r) failed' % key)
-            return None
-        else:
-            return dict((k,deserialize_models(v)) for k,v in data.iteritems())
-    else:
-        try:
-            return deserialize_models(memcache.get(key, **kwargs))
-        except Exception, e:
-            logging.error('uncachemodel: memcache.get(%r) failed' % key)
-            return None
+    def delete(self, key):
+        generation = self.generation
+        self.local.delete((generation, key))
+        memcache.delete_multi([key], key_prefix=self._prefix(generation),
+                              namespace=self.namespace)
+
+    def get_or_set(self, key, func, ttl=None):
+        """Gets the given key, or caches and returns the result of calling
+        `func` if it is not cached. None is a perfectly good value to cache.
+        """
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            value = func()
+            self.set(key, value, ttl)
+        return value
+
+    def _prefix(self, generation):
+        return '%s:' % generation
+
+
+def cache_stats():
+    """The stats of every two-tier cache in this process, by namespace."""
+    return dict((ns, cache.stats) for ns, cache in caches.iteritems())
+
+def _encode(value):
+    if isinstance(value, db.Model) or \
+            (isinstance(value, list) and value and
+             all(isinstance(x, db.Model) for x in value)):
+        return ('models', serialize_models(value))
+    return ('value', value)
+
+def _decode(data):
+    kind, value = data
+    if kind == 'models':
+        return deserialize_models(value)
+    return value
@@ -0,0 +1,126 @@
+"""
+Sharded counters, so that frequently-read counts (like the number of entries
+in a pool) can be read in constant time and incremented without contention.
+
+Each named counter is spread across NUM_SHARDS CounterShard entities, which
+are always fetched by key (never queried). The total is cached in memcache
+and kept up to date as the counter is incremented.
+
+Counters for things that existed before the counter did can be seeded from
+a (slow) count of them, by passing an `initial` callable to increment or
+get_count. The seed is kept in a shard of its own, so a counter is seeded
+exactly once, however many times it was incremented beforehand. Counters for
+new things should be seeded with zero when they are created, with seed.
+"""
+
+import logging
+import random
+
+from google.appengine.ext import db
+from google.appengine.api import memcache
+
+
+NUM_SHARDS = 10
+CACHE_NAMESPACE = 'counters'
+CACHE_TIME = 60 * 60
+
+
+class CounterShard(db.Model):
+    """One shard of a named counter. The key name should be the counter's
+    name and the shard's index, separated by a colon."""
+    name = db.StringProperty(required=True)
+    count = db.IntegerProperty(default=0)
+
+
+def shard_keys(name):
+    return [db.Key.from_path(CounterShard.kind(), '%s:%d' % (name, i))
+            for i in xrange(NUM_SHARDS)]
+
+def seed_key(name):
+    return db.Key.from_path(CounterShard.kind(), '%s:seed' % name)
+
+def increment(name, delta=1, initial=None):
+    """Adds the given delta (which may be negative) to the named counter. If
+    an `initial` callable is given and the counter has not been seeded yet,
+    it is seeded instead, and the delta dropped: the change being counted
+    should already be reflected in the initial count."""
+    if initial is not None and _seed(name, initial):
+        return
+    key = random.choice(shard_keys(name))
+    def txn():
+        shard = CounterShard.get(key)
+        if shard is None:
+            shard = CounterShard(key=key, name=name)
+        shard.count += delta
+        shard.put()
+    db.run_in_transaction(txn)
+
+    # Only adjust the cached total if there is one; otherwise the next read
+    # will total up the shards.
+    try:
+        if delta >= 0:
+            memcache.incr(name, delta, namespace=CACHE_NAMESPACE)
+        else:
+            memcache.decr(name, -delta, namespace=CACHE_NAMESPACE)
+    except Exception, e:
+        logging.error('counters: memcache update of %r failed' % name)
+        memcache.delete(name, namespace=CACHE_NAMESPACE)
+
+def get_count(name, initial=None):
+    """Gets the total of the named counter. If an `initial` callable is given
+    and the counter has not been seeded yet, it is seeded with its return
+    value first."""
+    count = memcache.get(name, namespace=CACHE_NAMESPACE)
+    if count is None:
+        if initial is not None:
+            _seed(name, initial)
+        count = _total(name)
+        memcache.add(name, count, time=CACHE_TIME, namespace=CACHE_NAMESPACE)
+    return count
+
+def seed(name, count):
+    """Seeds the named counter with the given count, unless it has been
+    seeded already. Returns True if it was seeded by this call."""
+    return _seed(name, lambda: count)
+
+def reset(name):
+    """Throws away the named counter's shards, seed and cached total, so that
+    it starts from scratch (and is seeded again, if it is given an `initial`
+    callable)."""
+    db.delete(shard_keys(name) + [seed_key(name)])
+    memcache.delete_multi([name, _seeded_flag(name)],
+                          namespace=CACHE_NAMESPACE)
+
+def _seed(name, initial):
+    """Seeds the named counter with the given callable's return value, unless
+    it has been seeded already. Whatever the counter was incremented by
+    before it was seeded is subtracted from the seed, since the initial
+    count should include those changes too. Returns True if the counter was
+    seeded by this call."""
+    flag = _seeded_flag(name)
+    if memcache.get(flag, namespace=CACHE_NAMESPACE):
+        return False
+    key = seed_key(name)
+    if CounterShard.get(key) is None:
+        shards = db.get(shard_keys(name))
+        count = initial() - sum(shard.count for shard in shards if shard)
+        def txn():
+            if CounterShard.get(key) is not None:
+                return False
+            CounterShard(key=key, name=name, count=count).put()
+            return True
+        seeded = db.run_in_transaction(txn)
+    else:
+        seeded = False
+    if seeded:
+        logging.info('counters: seeded %r with %s' % (name, count))
+        memcache.delete(name, namespace=CACHE_NAMESPACE)
+    memcache.set(flag, True, namespace=CACHE_NAMESPACE)
+    return seeded
+
+def _total(name):
+    shards = db.get(shard_keys(name) + [seed_key(name)])
+    return sum(shard.count for shard in shards if shard)
+
+def _seeded_flag(name):
+    return 'seeded:%s' % name
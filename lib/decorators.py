@@ -17,7 +17,10 @@ def objects_required(*kinds):
        corresponding kind.
 
      - If more than one kind is specified, each subsequent kind is a child of
-       the previous one.
+       the previous one. A kind whose model sets `path_parent` to the name
+       of a ReferenceProperty is instead a root entity that must refer to
+       the previous one through that property (e.g., Entry and its pool),
+       or a child of the previous one that has yet to be migrated.
 
     So, given a route like:
 
@@ -45,20 +48,38 @@ def objects_required(*kinds):
             kinds_ids = zip(kinds, args)
             parent_key = None
             keys = []
+            scopes = []
             for i, (kind, id) in enumerate(kinds_ids):
                 if id.isdigit():
                     id = int(id)
-                key = db.Key.from_path(kind, id, parent=parent_key)
+                scope = getattr(db.class_for_kind(kind), 'path_parent', None)
+                if scope and parent_key:
+                    key = db.Key.from_path(kind, id)
+                    scopes.append((i, scope, parent_key))
+                else:
+                    key = db.Key.from_path(kind, id, parent=parent_key)
                 parent_key = key
                 keys.append(key)
             try:
                 objs = db.get(keys)
+                # Entities that have not been moved out from under their
+                # path parent yet (see data.migrations) are still found
+                for i, scope, scope_key in scopes:
+                    if objs[i] is None:
+                        objs[i] = db.get(db.Key.from_path(
+                                kinds[i], keys[i].id_or_name(),
+                                parent=scope_key))
             except:
                 objs = [None]
             if not all(objs):
                 raise HTTPNotFound
-            else:
-                new_args = objs + list(args[len(kinds):])
-                return meth(self, *new_args, **kwargs)
+            for i, scope, scope_key in scopes:
+                prop = getattr(objs[i].__class__, scope)
+                value = prop.get_value_for_datastore(objs[i]) or \
+                    objs[i].parent_key()
+                if value != scope_key:
+                    raise HTTPNotFound
+            new_args = objs + list(args[len(kinds):])
+            return meth(self, *new_args, **kwargs)
         return decorated_meth
     return real_decorator
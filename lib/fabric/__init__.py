@@ -59,7 +59,7 @@ def production(version=None):
 
 def deploy(git=None, inplace=None):
     """Clones the current project's git HEAD to a temporary directory,
-updates its submodules, and deploys from the clone.
+updates its submodules, compiles its templates, and deploys from the clone.
 
 Optional arguments:
 
@@ -114,23 +114,33 @@ Usage:
         deploy_src = '.'
         local('mv settings/secrets.py settings/secrets.py.orig')
 
-    # Copy in deployed secrets file
-    with cd(deploy_src):
-        local('scp overloaded.org:pickempickem/secrets.py settings/')
+    compiled_dir = None
+    try:
+        # Copy in deployed secrets file
+        with cd(deploy_src):
+            local('scp overloaded.org:pickempickem/secrets.py settings/')
 
-    # Deploy the application using appcfg.py
-    cmd = 'appcfg.py -A %s -V %s update %s' % (
-        env.gae.app_id, env.gae.version, deploy_src)
-    local(cmd, capture=False)
+        # Compile the templates into Python modules, so that production
+        # doesn't have to (see lib.jinja)
+        compiled_dir = utils.compile_templates(deploy_src)
 
-    # Clean up after ourselves if we made a clone of the source code
-    if inplace is None:
-        assert deploy_src not in ('.', env.cwd)
-        local('rm -r %s' % deploy_src)
+        # Deploy the application using appcfg.py
+        cmd = 'appcfg.py -A %s -V %s update %s' % (
+            env.gae.app_id, env.gae.version, deploy_src)
+        local(cmd, capture=False)
 
-    # Or move the original settings back in place if we overwrote them
-    else:
-        local('mv settings/secrets.py.orig settings/secrets.py')
+    finally:
+        # Clean up after ourselves if we made a clone of the source code
+        if inplace is None:
+            assert deploy_src not in ('.', env.cwd)
+            local('rm -r %s' % deploy_src)
+
+        # Or move the original settings back in place if we overwrote them,
+        # and clean up the compiled templates
+        else:
+            local('mv settings/secrets.py.orig settings/secrets.py')
+            if compiled_dir and os.path.isdir(compiled_dir):
+                local('rm -r %s' % compiled_dir)
 
 
 def shell(cmd=None, path='/remote_api'):
@@ -216,7 +226,7 @@ Usage:
             except ImportError:
                 plain_shell()
 
-def loaddata(path):
+def loaddata(path, batch=None, threads=None):
     """Load the specified JSON fixtures.  If preceded by a deployment target,
 the fixture data will be loaded onto that target.  Otherwise they will be
 loaded into the local datastore.
@@ -225,6 +235,12 @@ Arguments:
 
     :path -- The path to the fixture data to load
 
+Optional arguments:
+
+    :batch -- Write the fixtures in batches of this size. Defaults to 100.
+
+    :threads -- Write batches in this many parallel threads. Defaults to 1.
+
 Usage:
 
     # Load data locally
@@ -232,6 +248,9 @@ Usage:
 
     # Load data onto staging
     fab staging loaddata:groups/fixtures/test_groups.json
+
+    # Load data onto staging in batches of 200, with 4 writer threads
+    fab staging loaddata:data/fixtures/games.json,batch=200,threads=4
 """
     import fixtures
 
@@ -243,23 +262,113 @@ Usage:
 
     # Actually load the fixtures (tweak the logging so their info shows up)
     logging.getLogger().setLevel(logging.INFO)
-    fixtures.load_fixtures(path)
+    loaded = fixtures.load_fixtures(
+        path, batch_size=int(batch or fixtures.BATCH_SIZE),
+        threads=int(threads or 1))
+    if not loaded:
+        abort('Some fixtures failed to load.')
 
-def dumpjson(kinds):
-    """Dumps data from the local or remote datastore in JSON format.
+def dumpjson(kinds, dest='.', resume=None, threads=None, batch=None):
+    """Dumps data from the local or remote datastore as JSON lines, one file
+per kind, which can be loaded again with loaddata.
 
 Arguments:
 
     :kinds -- A comma-separated list of kinds to dump, specified as
               `path.to.module.ModelName `
+
+Optional arguments:
+
+    :dest -- The directory to write the `<kind>.jsonl` files to. Defaults to
+    the current directory.
+
+    :resume -- Resume interrupted dumps from their `.cursor` checkpoints.
+
+    :threads -- Dump this many kinds in parallel. Defaults to 1.
+
+    :batch -- Fetch entities in pages of this size. Defaults to 100.
+
+Usage:
+
+    # Dump all teams and games from production
+    fab production dumpjson:models.Team,models.Game
+
+    # Resume an interrupted dump of games, into the fixtures directory
+    fab production dumpjson:models.Game,dest=data/fixtures,resume=1
     """
     import fixtures
     if hasattr(env, 'gae'):
         utils.prep_remote_shell()
     else:
         utils.prep_local_shell()
-    for kind in kinds.split(','):
-        print fixtures.serialize_entities(kind)
+    logging.getLogger().setLevel(logging.INFO)
+    failed = fixtures.export_kinds(
+        kinds.split(','),
+        directory=dest,
+        threads=int(threads or 1),
+        batch_size=int(batch or fixtures.BATCH_SIZE),
+        resume=resume is not None)
+    if failed:
+        abort('Failed to dump %s (rerun with resume=1 to pick up where they '
+              'left off).' % ', '.join(failed))
+
+def benchpicks(layout='both', entries=None, threads=None, keep=None):
+    """Benchmarks pick submission throughput for a throwaway pool, comparing
+the old key layout (every entry in its pool's entity group) with the current
+one (every entry in its own group). Only meaningful against a deployment.
+For the current layout, the time includes the deferred tasks that bring the
+pool's standings up to date with the picks.
+
+Optional arguments:
+
+    :layout -- 'pool' for the old layout, 'entry' for the current one, or
+    'both' (the default).
+
+    :entries -- How many entries the pool gets. Defaults to 1000.
+
+    :threads -- How many picks are submitted at once. Defaults to 20.
+
+    :keep -- Keep the benchmark pools around afterwards.
+
+Usage:
+
+    # Compare both layouts on staging
+    fab staging benchpicks
+
+    # Benchmark the current layout with 50 threads
+    fab staging benchpicks:entry,threads=50
+"""
+    import benchmarks
+    if not hasattr(env, 'gae'):
+        abort('benchpicks requires a remote deployment.')
+    utils.prep_remote_shell()
+    logging.getLogger().setLevel(logging.INFO)
+    benchmarks.benchmark_picks(layout,
+                               entries=int(entries or benchmarks.ENTRIES),
+                               threads=int(threads or benchmarks.THREADS),
+                               keep=keep is not None)
+
+def checkfeeds(port=None):
+    """Runs the feed updates against the example feeds in data/examples, served
+from a local HTTP server, using the local datastore. Fails unless the first
+update handles the scores feed and the second skips it as unchanged.
+
+Optional arguments:
+
+    :port -- The local port to serve the example feeds from. Defaults to
+    8081.
+
+Usage:
+
+    fab checkfeeds
+"""
+    import feedcheck
+    if hasattr(env, 'gae'):
+        abort('checkfeeds only runs locally.')
+    utils.prep_local_shell()
+    logging.getLogger().setLevel(logging.INFO)
+    if not feedcheck.check_feeds(port=int(port or feedcheck.PORT)):
+        abort('Feed check failed.')
 
 def dumpdata(kind=None, batch=None, resume=None):
     """Dump data from a remote deployment using the bulkloader.py tool.
@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+from Queue import Queue, Empty
+
+from google.appengine.ext import db
+
+
+# How many entries the benchmark pool gets by default
+ENTRIES = 1000
+
+# How many threads submit picks at once by default
+THREADS = 20
+
+# How long (in seconds) to wait for the standings to catch up with the picks
+SYNC_TIMEOUT = 600
+
+
+def benchmark_picks(layout='both', entries=ENTRIES, threads=THREADS,
+                    keep=False):
+    """Measures pick submission throughput for a throwaway pool with the
+    given number of entries, with picks submitted for every entry from the
+    given number of threads at once. `layout` is 'pool' for the old key
+    layout (every entry a child of its pool, with the standings updated in
+    each pick's transaction), 'entry' for the current one (every entry in its
+    own entity group), or 'both'. Only meaningful against a real deployment,
+    since the local datastore doesn't contend like the real one does.
+
+    In the current layout, the pool's standings are updated afterwards by
+    deferred sync_pool_entry tasks, which still contend on the pool's group.
+    So its time runs until the standings show every pick, not just until
+    the picks are written."""
+    import models
+    week = models.Week.current() or models.Week.next()
+    games = week and week.games.fetch(1)
+    if not games:
+        raise ValueError('No games to pick from')
+    game = games[0]
+    team = game.home_team
+
+    layouts = ['pool', 'entry'] if layout == 'both' else [layout]
+    results = {}
+    for layout in layouts:
+        pool, entry_keys = create_pool(layout, entries)
+        try:
+            if layout == 'pool':
+                submit = lambda key: legacy_make_pick(key, week, game, team)
+            else:
+                submit = lambda key: models.Entry.get(key).make_pick(
+                    week, game, team)
+            count, failures, elapsed = run(submit, entry_keys, threads)
+            if layout == 'entry':
+                synced = wait_for_standings(pool, count)
+                if synced is None:
+                    logging.error('Standings did not catch up in %ss' % (
+                            SYNC_TIMEOUT))
+                    synced = SYNC_TIMEOUT
+                logging.info('Picks written in %.1fs, standings caught up '
+                             '%.1fs later' % (elapsed, synced))
+                elapsed += synced
+            results[layout] = count, failures, elapsed
+        finally:
+            if not keep:
+                delete_pool(pool)
+
+    for layout in layouts:
+        count, failures, elapsed = results[layout]
+        logging.info(
+            '%s layout: %d picks (%d failed) in %.1fs, %.1f picks/s' % (
+                layout, count, failures, elapsed, count / max(elapsed, 0.001)))
+    return results
+
+def create_pool(layout, entries):
+    """Creates a benchmark pool with the given number of entries in the given
+    layout, along with its standings. Returns the pool and entry keys."""
+    import models
+    pool = models.Pool(manager=db.Key.from_path('Account', 'benchmark'),
+                       name='Benchmark (%s)' % layout)
+    pool.put()
+    if layout == 'pool':
+        batch = [models.Entry(parent=pool) for i in xrange(entries)]
+    else:
+        batch = [models.Entry(pool=pool) for i in xrange(entries)]
+    entry_keys = []
+    for i in xrange(0, entries, 100):
+        entry_keys.extend(db.put(batch[i:i + 100]))
+    standings = models.PoolStandings(key=models.PoolStandings.key_for(pool))
+    for entry in batch:
+        standings.update_entry(entry, name=u'Benchmark')
+    standings.put()
+    logging.info('Created %s pool with %d entries' % (layout, entries))
+    return pool, entry_keys
+
+def legacy_make_pick(entry_key, week, game, team):
+    """Makes a pick the way Entry.make_pick did when entries were children of
+    their pool: the pick, entry and standings in a single transaction on the
+    pool's entity group."""
+    import models
+    pick_key = db.Key.from_path('Pick', week.key().id(), parent=entry_key)
+    standings_key = models.PoolStandings.key_for(entry_key.parent())
+    def txn():
+        pick, standings, entry = db.get([pick_key, standings_key, entry_key])
+        pick = models.Pick(key=pick_key, week=week, game=game, team=team)
+        standings.update_entry(entry, picks=1)
+        db.put([pick, entry, standings])
+    db.run_in_transaction(txn)
+
+def wait_for_standings(pool, count, timeout=SYNC_TIMEOUT):
+    """Waits for the given pool's standings to show a pick for the given
+    number of entries, as the deferred sync_pool_entry tasks catch up.
+    Returns the number of seconds waited, or None if it timed out."""
+    import models
+    key = models.PoolStandings.key_for(pool)
+    start = time.time()
+    while time.time() - start < timeout:
+        standings = models.PoolStandings.get(key)
+        if len([row for row in standings.rows if row['picks']]) >= count:
+            return time.time() - start
+        time.sleep(1)
+    return None
+
+def run(submit, entry_keys, threads):
+    """Calls the given function for each of the given entry keys from the
+    given number of threads. Returns the number of successful calls, the
+    number of failed calls and the elapsed time."""
+    work = Queue()
+    for key in entry_keys:
+        work.put(key)
+    counts = []
+    failures = []
+    def worker():
+        while True:
+            try:
+                key = work.get_nowait()
+            except Empty:
+                break
+            try:
+                submit(key)
+            except db.TransactionFailedError:
+                failures.append(key)
+            except Exception, e:
+                logging.exception('Error submitting pick for %s' % key)
+                failures.append(key)
+            else:
+                counts.append(key)
+
+    start = time.time()
+    workers = [threading.Thread(target=worker) for i in xrange(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return len(counts), len(failures), time.time() - start
+
+def delete_pool(pool):
+    """Deletes the given benchmark pool and everything in it."""
+    import models
+    keys = [pool.key()]
+    keys.extend(db.Query(keys_only=True).ancestor(pool))
+    for entry_key in db.Query(models.Entry, keys_only=True)\
+            .filter('pool =', pool):
+        keys.append(entry_key)
+        keys.extend(db.Query(keys_only=True).ancestor(entry_key))
+    keys = list(set(keys))
+    for i in xrange(0, len(keys), 500):
+        db.delete(keys[i:i + 500])
+    logging.info('Deleted %s and %d other entities' % (pool, len(keys) - 1))
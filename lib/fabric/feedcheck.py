@@ -0,0 +1,56 @@
+import logging
+import os
+import posixpath
+import threading
+import urllib
+from BaseHTTPServer import HTTPServer
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+
+# Where the example feeds live, relative to the project root
+EXAMPLES_DIR = os.path.join('data', 'examples')
+
+# The local port the example feeds are served from by default
+PORT = 8081
+
+
+class ExampleFeedHandler(SimpleHTTPRequestHandler):
+    """Serves files from the examples directory, quietly."""
+
+    def translate_path(self, path):
+        path = posixpath.normpath(urllib.unquote(path.split('?', 1)[0]))
+        return os.path.join(
+            os.path.abspath(EXAMPLES_DIR), path.lstrip('/'))
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+def check_feeds(port=PORT):
+    """Serves the example scores feed from a local HTTP server and runs the
+    real feed update (see data.feeds.update_feeds) against it twice, in the
+    local datastore. The first run should handle the feed, and the second
+    should skip it as unchanged. Returns True if both did. (There is no
+    example odds feed to check against.)"""
+    server = HTTPServer(('localhost', port), ExampleFeedHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+
+    from data import feeds, scores
+    scores.feed_url = 'http://localhost:%d/scores.json' % port
+    state = feeds.FeedState.get_by_key_name('scores')
+    if state is not None:
+        state.delete()
+
+    ok = True
+    for expected in (['scores'], []):
+        handled = feeds.update_feeds(['scores'])
+        if handled == expected:
+            logging.info('OK: handled %r' % handled)
+        else:
+            logging.error('FAILED: handled %r, expected %r' % (
+                    handled, expected))
+            ok = False
+    server.shutdown()
+    return ok
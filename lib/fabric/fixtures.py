@@ -5,6 +5,9 @@ import datetime
 import logging
 import os
 import sys
+import threading
+import time
+from Queue import Queue, Empty
 
 from google.appengine.ext import db
 from django.utils import simplejson as json
@@ -13,6 +16,12 @@ from django.utils import simplejson as json
 DATE_FORMAT = '%Y-%m-%d'
 DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
 
+# How many entities to write in each batch when loading fixtures
+BATCH_SIZE = 100
+
+# How much of a fixtures file to read at a time
+READ_SIZE = 64 * 1024
+
 
 def json_encoder(obj):
     """Objects are encoded as one-item dictionaries mapping '__TYPENAME__' to
@@ -24,9 +33,11 @@ def json_encoder(obj):
     elif isinstance(obj, datetime.date):
         return { '__date__': obj.strftime(DATE_FORMAT) }
 
-    # Blobs are base64-encoded
+    # Blobs and byte strings are base64-encoded
     elif isinstance(obj, db.Blob):
         return { '__blob__': base64.b64encode(obj) }
+    elif isinstance(obj, db.ByteString):
+        return { '__bytestring__': base64.b64encode(obj) }
 
     # Keys are encoded as a 3-element list of [kind, id_or_name, parent]
     # where the parent can be null or another key.
@@ -60,24 +71,132 @@ def json_decoder(dct):
             return datetime.datetime.strptime(value, DATE_FORMAT).date()
         elif type_name == 'blob':
             return db.Blob(base64.b64decode(value))
+        elif type_name == 'bytestring':
+            return db.ByteString(base64.b64decode(value))
         elif type_name == 'key':
             kind, keydata, parent = value
             return db.Key.from_path(kind, keydata, parent=parent)
     return dct
 
 
-def load_fixtures(filename):
-    """Loads fixtures from the given path into the datastore."""
+def load_fixtures(filename, batch_size=BATCH_SIZE, threads=1):
+    """Loads fixtures from the given path into the datastore. The file may
+    contain a JSON array or JSON lines. The fixtures are streamed from it
+    and written in batches of the given size. If `threads` is more than
+    one, that many threads write batches in parallel. Returns True if every
+    batch was written."""
     logging.info("Loading fixtures from %s..." % os.path.basename(filename))
+    start = time.time()
+
+    batches = Queue(maxsize=threads * 2)
+    counts = []
+    errors = []
+    def writer():
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            try:
+                db.put(batch)
+            except Exception, e:
+                logging.exception('Error writing batch of %d' % len(batch))
+                errors.append(e)
+            else:
+                counts.append(len(batch))
+                logging.debug('Wrote batch of %d fixtures' % len(batch))
+
+    workers = [threading.Thread(target=writer) for i in xrange(threads)]
+    for worker in workers:
+        worker.start()
 
-    with open(filename, 'r') as f:
-        json_obj = json.load(f, object_hook=json_decoder)
+    try:
+        with open(filename, 'r') as f:
+            batch = []
+            for data in iter_records(f, object_hook=json_decoder):
+                model = get_model(data['model'])
+                batch.append(build_entity(model, data.get('key'),
+                                          data['fields']))
+                if len(batch) >= batch_size:
+                    batches.put(batch)
+                    batch = []
+            if batch:
+                batches.put(batch)
+    finally:
+        for worker in workers:
+            batches.put(None)
+        for worker in workers:
+            worker.join()
 
-    for count, data in enumerate(json_obj):
-        model = get_model(data['model'])
-        create_entity(model, data.get('key'), data['fields'])
+    count = sum(counts)
+    elapsed = time.time() - start
+    logging.info("Loaded %d fixtures in %d batches in %.1fs (%.1f/s)" % (
+            count, len(counts), elapsed, count / max(elapsed, 0.001)))
+    if errors:
+        logging.error("%d batches failed to load" % len(errors))
+    return not errors
 
-    logging.info("Loaded %d fixtures..." % (count + 1))
+def iter_records(f, object_hook=None):
+    """Yields each record in the given file, which may contain either a
+    JSON array of records or one record per line (as written by
+    export_entities)."""
+    first = f.read(1)
+    while first and first.isspace():
+        first = f.read(1)
+    f.seek(-len(first), os.SEEK_CUR)
+    if first == '[':
+        return iter_json_array(f, object_hook)
+    return iter_json_lines(f, object_hook)
+
+def iter_json_lines(f, object_hook=None):
+    """Yields the JSON object on each non-blank line of the given file."""
+    for line in f:
+        if line.strip():
+            yield json.loads(line, object_hook=object_hook)
+
+def iter_json_array(f, object_hook=None):
+    """Yields each item of the JSON array in the given file, one at a time,
+    reading the file in chunks rather than all at once."""
+    decoder = json.JSONDecoder(object_hook=object_hook)
+    buf = ''
+    eof = False
+    # What comes next: the array's opening bracket ('open'), its first item
+    # or closing bracket ('first'), an item after a comma ('item'), or a
+    # comma or closing bracket after an item ('after')
+    state = 'open'
+    while True:
+        buf = buf.lstrip()
+        if buf:
+            # Step past exactly one piece of the array's punctuation
+            if state == 'open':
+                if not buf.startswith('['):
+                    raise ValueError('Expected a JSON array')
+                buf = buf[1:]
+                state = 'first'
+                continue
+            if state in ('first', 'after') and buf.startswith(']'):
+                return
+            if state == 'after':
+                if not buf.startswith(','):
+                    raise ValueError('Expected , or ] after array item')
+                buf = buf[1:]
+                state = 'item'
+                continue
+            try:
+                obj, end = decoder.raw_decode(buf)
+            except ValueError:
+                # Probably an incomplete item; read more below
+                if eof:
+                    raise
+            else:
+                buf = buf[end:]
+                state = 'after'
+                yield obj
+                continue
+        if eof:
+            raise ValueError('Unterminated JSON array')
+        chunk = f.read(READ_SIZE)
+        eof = not chunk
+        buf += chunk
 
 def get_model(modelspec):
     """Gets the model class specified in the given modelspec, which should
@@ -95,8 +214,13 @@ def create_entity(model, key, fields):
     """Creates an entity of the given type in the datastore, based on the
     given fields.  ReferenceProperties and ListProperties are containing Keys
     are looked up in the datastore."""
+    return build_entity(model, key, fields).put()
 
-    logging.debug('Creating %s entity with key %r' % (model.kind(), key))
+def build_entity(model, key, fields):
+    """Builds (but does not store) an entity of the given type, based on the
+    given fields."""
+
+    logging.debug('Building %s entity with key %r' % (model.kind(), key))
 
     # The final keyword arguments we'll pass to the entity's constructor
     args = { 'key': key }
@@ -107,27 +231,100 @@ def create_entity(model, key, fields):
         # Any special casing based on property type should happen here
         args[str(field)] = value
 
-    # Create and store the entity
-    return model(**args).put()
+    return model(**args)
+
+def serialize_entity(modelspec, entity):
+    """Serializes a single entity as a JSON record, on a single line."""
+    # We have to go head and run the json_encoder over the entity's fields
+    # here to properly handle db.Blob properties, which are string subclasses
+    # and therefore do not get sent through the json_encoder as you might
+    # hope they would be. Reference properties are serialized as their keys,
+    # without fetching the referenced entities; everything else as its
+    # (user-facing) value, so that e.g. dates stay dates.
+    fields = {}
+    for name, prop in entity.properties().iteritems():
+        if isinstance(prop, db.ReferenceProperty):
+            value = prop.get_value_for_datastore(entity)
+        else:
+            value = getattr(entity, name)
+        fields[name] = json_encoder(value)
+    record = {
+        'model': modelspec,
+        'key': entity.key(),
+        'fields': fields,
+        }
+    return json.dumps(record, default=json_encoder)
 
-def serialize_entities(modelspec):
-    """Serializes all of the entities of the kind specified by the given
-    modelspec as JSON."""
+def export_entities(modelspec, filename, batch_size=BATCH_SIZE, resume=False):
+    """Exports all of the entities of the kind specified by the given
+    modelspec to the given file, as JSON lines. The kind is paged through
+    with query cursors, and each page is written as soon as it is fetched.
+
+    After each page, the query cursor is checkpointed to a `.cursor` file
+    next to the output file. If `resume` is True and a checkpoint exists,
+    the export picks up where it left off, appending to the output file.
+    (At most one page may be written twice, which is harmless, since loading
+    the same fixtures twice just rewrites the same entities.) Returns the
+    number of entities exported."""
     model = get_model(modelspec)
-    fields = model.properties()
-
-    def prep_fields(entity):
-        # We have to go head and run the json_encoder over the entity's fields
-        # here to properly handle db.Blob properties, which are string
-        # subclasses and therefore do not get sent through the json_encoder as
-        # you might hope they would be.
-        return dict((name, json_encoder(getattr(entity, name)))
-                    for name in fields)
-
-    entities = [
-        { 'model': modelspec,
-          'key': entity.key(),
-          'fields': prep_fields(entity) }
-        for entity in model.all()]
-
-    return json.dumps(entities, default=json_encoder, indent=4)
+    checkpoint = filename + '.cursor'
+
+    cursor = None
+    if resume and os.path.exists(checkpoint):
+        with open(checkpoint, 'r') as f:
+            cursor = f.read().strip() or None
+        logging.info('Resuming export of %s from checkpoint' % modelspec)
+
+    count = 0
+    query = model.all()
+    with open(filename, 'a' if cursor else 'w') as out:
+        while True:
+            if cursor:
+                query.with_cursor(cursor)
+            entities = query.fetch(batch_size)
+            for entity in entities:
+                out.write(serialize_entity(modelspec, entity))
+                out.write('\n')
+            out.flush()
+            count += len(entities)
+            cursor = query.cursor()
+            with open(checkpoint, 'w') as f:
+                f.write(cursor)
+            logging.info('Exported %d %s entities...' % (count, modelspec))
+            if len(entities) < batch_size:
+                break
+
+    # The export finished, so there's nothing to resume
+    os.remove(checkpoint)
+    return count
+
+def export_kinds(modelspecs, directory='.', threads=1, **kwargs):
+    """Exports each of the given kinds to its own `<modelspec>.jsonl` file in
+    the given directory, using up to the given number of threads to export
+    several kinds in parallel. Keyword args are passed on to
+    export_entities. Returns the list of kinds that failed to export."""
+    pending = Queue()
+    for modelspec in modelspecs:
+        pending.put(modelspec)
+    failed = []
+
+    def exporter():
+        while True:
+            try:
+                modelspec = pending.get_nowait()
+            except Empty:
+                break
+            filename = os.path.join(directory, '%s.jsonl' % modelspec)
+            try:
+                export_entities(modelspec, filename, **kwargs)
+            except Exception, e:
+                logging.exception('Error exporting %s' % modelspec)
+                failed.append(modelspec)
+
+    workers = [threading.Thread(target=exporter)
+               for i in xrange(min(threads, len(modelspecs)))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return failed
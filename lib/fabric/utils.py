@@ -1,6 +1,9 @@
 import functools
 import getpass
+import logging
 import os
+import shutil
+import subprocess
 import sys
 
 try:
@@ -73,6 +76,33 @@ def prep_local_shell():
     # Finally, set up the stubs
     dev_appserver.SetupStubs(env.gae.app_id, **args)
 
+# Compiles a project's templates with that project's own Jinja environment
+# setup (see lib.jinja.compile_templates), when run from its directory
+COMPILE_TEMPLATES = '; '.join([
+        "import os, sys",
+        "sys.path[:0] = [os.getcwd(), os.path.join(os.getcwd(), 'ext')]",
+        "os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')",
+        "from lib import jinja",
+        "jinja.compile_templates()",
+        ])
+
+def compile_templates(project_dir):
+    """Compiles the templates of the project in the given directory (e.g., a
+    deployment's clean checkout) into Python modules in its
+    templates_compiled directory. Runs in a separate Python process, so that
+    the templates are compiled with the given project's code rather than
+    whatever this process has already imported. Returns the directory the
+    templates were compiled into."""
+    target_dir = os.path.join(project_dir, 'templates_compiled')
+    if os.path.isdir(target_dir):
+        shutil.rmtree(target_dir)
+    # Pass along the App Engine SDK paths this process has set up
+    environ = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    logging.info('Compiling templates in %s...' % project_dir)
+    subprocess.check_call([sys.executable, '-c', COMPILE_TEMPLATES],
+                          cwd=project_dir, env=environ)
+    return target_dir
+
 @with_appcfg
 def prep_remote_shell(path='/remote_api'):
     """Prepares a remote shell using remote_api located at the given path on
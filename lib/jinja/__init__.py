@@ -1,27 +1,44 @@
 import inspect
 import logging
+import os
 
 from ext import jinja2
 
 import filters, helpers, tests
 import settings
-
-
-# The environment used to render every template
-environment = jinja2.Environment(
-    loader=jinja2.FileSystemLoader(settings.TEMPLATE_DIR),
-    undefined=jinja2.Undefined,
-    autoescape=True)
-
-# A shortcut for rendering a template with the default environment
-def render_to_string(filename, context={}):
-    template = environment.get_or_select_template(filename)
-    return template.render(context)
+from bccache import AppEngineBytecodeCache
+from loaders import PrecompiledLoader
 
 
 ##############################################################################
 # Utility functions
 ##############################################################################
+def make_environment(loader, **options):
+    """Makes a Jinja environment that loads templates with the given loader,
+    set up with our custom filters, helpers and tests."""
+    env = jinja2.Environment(
+        loader=loader,
+        undefined=jinja2.Undefined,
+        autoescape=True,
+        **options)
+    add_module_to_env(filters, env.filters)
+    add_module_to_env(helpers, env.globals)
+    add_module_to_env(tests, env.tests)
+    return env
+
+def compile_templates(target=None, source_dir=None, log_function=None):
+    """Compiles every template in the given source directory (by default,
+    the template directory) into a Python module in the given target
+    directory (by default, the compiled template directory), where the
+    production environment's loader can import them. Run by `fab deploy`.
+    Raises an error if any template fails to compile."""
+    env = make_environment(
+        jinja2.FileSystemLoader(source_dir or settings.TEMPLATE_DIR))
+    env.compile_templates(target or settings.COMPILED_TEMPLATE_DIR,
+                          zip=None,
+                          ignore_errors=False,
+                          log_function=log_function)
+
 def add_module_to_env(module, env_place, exceptions=None):
     """Adds the callable contents of the given module to the given 'place'
     (for lack of a better name) in a Jinja environment.  Useful for, e.g.,
@@ -34,10 +51,28 @@ def add_module_to_env(module, env_place, exceptions=None):
             env_place[name] = value
 
 
-# Add our custom filters, helpers and tests
-add_module_to_env(filters, environment.filters)
-add_module_to_env(helpers, environment.globals)
-add_module_to_env(tests, environment.tests)
+# Compiled templates are shared between instances through memcache
+bytecode_cache = AppEngineBytecodeCache()
+
+# In production, templates are imported from the modules compiled at deploy
+# time (falling back on their sources, should any be missing), and are never
+# checked for changes. In development, they're compiled from source and
+# reloaded whenever they change.
+source_loader = jinja2.FileSystemLoader(settings.TEMPLATE_DIR)
+if settings.PRODUCTION and os.path.isdir(settings.COMPILED_TEMPLATE_DIR):
+    loader = PrecompiledLoader(settings.COMPILED_TEMPLATE_DIR, source_loader)
+else:
+    loader = source_loader
+
+# The environment used to render every template
+environment = make_environment(loader,
+                               auto_reload=not settings.PRODUCTION,
+                               bytecode_cache=bytecode_cache)
+
+# A shortcut for rendering a template with the default environment
+def render_to_string(filename, context={}):
+    template = environment.get_or_select_template(filename)
+    return template.render(context)
 
 
 # Enabling this monkeypatch can help track down hard to find errors that crop
@@ -0,0 +1,41 @@
+"""
+A Jinja bytecode cache backed by App Engine's memcache, so that a fresh
+instance can load the compiled code for a template instead of lexing, parsing
+and compiling it again.
+"""
+
+import os
+
+from google.appengine.api import memcache
+
+from ext.jinja2.bccache import MemcachedBytecodeCache
+
+
+class AppEngineBytecodeCache(MemcachedBytecodeCache):
+    """A MemcachedBytecodeCache that talks to App Engine's memcache. Keys are
+    scoped to the deployed app version, so instances of different versions
+    (which may have different templates, or even a different Python) never
+    load each other's code. Keeps hit, miss and store counts for this
+    process."""
+
+    def __init__(self, version=None, timeout=None):
+        version = version or os.environ.get('CURRENT_VERSION_ID', 'dev')
+        MemcachedBytecodeCache.__init__(
+            self, memcache, prefix='jinja2/%s/' % version, timeout=timeout)
+        self.hits = self.misses = self.stores = 0
+
+    @property
+    def stats(self):
+        """Hit, miss and store counts for this process."""
+        return dict(hits=self.hits, misses=self.misses, stores=self.stores)
+
+    def load_bytecode(self, bucket):
+        MemcachedBytecodeCache.load_bytecode(self, bucket)
+        if bucket.code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def dump_bytecode(self, bucket):
+        MemcachedBytecodeCache.dump_bytecode(self, bucket)
+        self.stores += 1
@@ -0,0 +1,27 @@
+"""
+A Jinja loader for templates compiled ahead of time (see
+lib.jinja.compile_templates), so that production never has to read, parse or
+compile a template's source.
+"""
+
+from ext.jinja2 import ModuleLoader, TemplateNotFound
+
+
+class PrecompiledLoader(ModuleLoader):
+    """A ModuleLoader that imports templates compiled into the given
+    directory, falling back on the given loader for any template that wasn't
+    compiled. (Jinja's ChoiceLoader can't do this, since a ModuleLoader has
+    no source to hand it.)"""
+
+    def __init__(self, path, fallback):
+        ModuleLoader.__init__(self, path)
+        self.fallback = fallback
+
+    def load(self, environment, name, globals=None):
+        try:
+            return ModuleLoader.load(self, environment, name, globals)
+        except TemplateNotFound:
+            return self.fallback.load(environment, name, globals)
+
+    def list_templates(self):
+        return self.fallback.list_templates()
@@ -0,0 +1,102 @@
+"""
+A request-scoped identity map, and a helper for resolving the entities
+referenced by a batch of models in a single datastore RPC, so that rendering
+a list of entities (and their accounts, teams, games, etc.) doesn't cost one
+db.get per dereference.
+
+Usage:
+
+    picks = entry.picks.fetch(100)
+    prefetch(picks, 'team', 'game.home_team', 'game.away_team')
+
+Each argument after the entities names a ReferenceProperty to resolve, and
+may be a dotted path to follow a chain of references. The special name
+`parent` resolves each entity's parent. Teams always come from the team
+registry instead of the datastore.
+"""
+
+import logging
+
+from google.appengine.ext import db
+
+from models import Team
+
+
+# Maps keys to the entities fetched during the current request. Reset at the
+# start of every request by lib.webapp.RequestHandler.
+_identity_map = {}
+
+
+def reset():
+    """Empties the identity map."""
+    _identity_map.clear()
+
+def remember(entities):
+    """Adds the given entities to the identity map."""
+    for entity in entities:
+        if entity is not None:
+            _identity_map[entity.key()] = entity
+
+def get(keys):
+    """Gets the entities with the given keys from the identity map, the team
+    registry or (in a single batch) the datastore, returning a dict mapping
+    the keys to the entities that exist."""
+    found = {}
+    missing = []
+    for key in keys:
+        if key in _identity_map:
+            found[key] = _identity_map[key]
+        elif key not in missing:
+            missing.append(key)
+
+    if missing and any(key.kind() == Team.kind() for key in missing):
+        teams = Team.registry()
+        remember(teams.values())
+        for key in missing:
+            if key in _identity_map:
+                found[key] = _identity_map[key]
+        missing = [key for key in missing if key not in found]
+
+    if missing:
+        entities = db.get(missing)
+        remember(entities)
+        found.update((entity.key(), entity)
+                     for entity in entities if entity is not None)
+    return found
+
+def prefetch(entities, *paths):
+    """Resolves the given reference paths for all of the given entities at
+    once, seeding each entity's reference caches so that dereferencing them
+    (e.g., in a template) doesn't touch the datastore. Returns the entities.
+    """
+    entities = [entity for entity in entities if entity is not None]
+    remember(entities)
+    for path in paths:
+        _prefetch_path(entities, path.split('.'))
+    return entities
+
+def _prefetch_path(entities, names):
+    name, rest = names[0], names[1:]
+    refs = []
+    for entity in entities:
+        if name == 'parent':
+            key = entity.parent_key()
+        else:
+            prop = getattr(entity.__class__, name)
+            key = prop.get_value_for_datastore(entity)
+        if key is not None:
+            refs.append((entity, key))
+
+    resolved = get([key for entity, key in refs])
+    for entity, key in refs:
+        value = resolved.get(key)
+        if value is None:
+            logging.warning('prefetch: missing %s for %s' % (name, key))
+        elif name == 'parent':
+            # Model.parent() caches the parent it fetches here
+            entity._parent = value
+        else:
+            setattr(entity, name, value)
+
+    if rest:
+        _prefetch_path(resolved.values(), rest)
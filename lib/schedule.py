@@ -0,0 +1,232 @@
+"""
+A process-level index of a season's schedule, so that looking up which game
+a team is playing in a given week (or how a week's games are grouped for
+display) doesn't cost any datastore RPCs on the hot path.
+
+The index is built once per season from its weeks and games, and is rebuilt
+whenever the season's schedule version changes. Anything that writes to the
+schedule (e.g. the data importers) should call `invalidate(season)` to bump
+that version.
+
+Only the schedule itself (weeks, matchups and kickoffs) is kept up to date
+in the index. The live parts of its games (scores, final flags and spreads)
+are only as fresh as the index, since the feeds update them every minute
+during games, and rebuilding every index that often would be too costly.
+Pages that show them read the week's games from the datastore instead.
+"""
+
+import datetime
+import logging
+import time
+from bisect import bisect_right
+from itertools import groupby
+
+from google.appengine.ext import db
+from google.appengine.api import memcache
+
+
+# How often (in seconds) each process checks whether the schedule version
+# has changed out from under its index.
+VERSION_CHECK_INTERVAL = 60
+
+# Game times are stored as UTC, need to be offset back to EST or the night
+# games overflow into the next day.
+LOCAL_OFFSET = datetime.timedelta(hours=-5)
+
+# Indexes built by this process, keyed by season key
+_indexes = {}
+
+
+class ScheduleIndex(object):
+    """An immutable index of a single season's weeks and games."""
+
+    def __init__(self, season_key, weeks, games, teams, version):
+        self.season_key = season_key
+        self.version = version
+        self.checked_at = time.time()
+
+        # Seed the games' team references from the team registry, so that
+        # rendering a game never has to fetch its teams.
+        teams = dict((team.key(), team) for team in teams)
+        from models import Game
+        for game in games:
+            for prop in (Game.home_team, Game.away_team):
+                team_key = prop.get_value_for_datastore(game)
+                if team_key in teams:
+                    setattr(game, prop.name, teams[team_key])
+
+        self.weeks = tuple(sorted(weeks, key=lambda week: week.start))
+        self._weeks = dict((week.key(), week) for week in self.weeks)
+
+        # The week boundaries, for resolving the current and next weeks, and
+        # the last resolution, as a (valid_from, valid_until, weeks) tuple.
+        self._week_starts = [week.start for week in self.weeks]
+        self._resolution = None
+
+        games = sorted(games, key=lambda game: game.start)
+        by_week = dict((week.key(), []) for week in self.weeks)
+        by_team = {}
+        by_week_team = {}
+        for game in games:
+            week_key = game.parent_key()
+            by_week.setdefault(week_key, []).append(game)
+            for team_key in game.teams:
+                by_team.setdefault(team_key, []).append(game)
+                by_week_team[(week_key, team_key)] = game
+
+        self._games_by_week = dict(
+            (k, tuple(v)) for k, v in by_week.iteritems())
+        self._games_by_team = dict(
+            (k, tuple(v)) for k, v in by_team.iteritems())
+        self._games_by_week_team = by_week_team
+        self._grouped_games = dict(
+            (k, group_games(v)) for k, v in self._games_by_week.iteritems())
+
+    @classmethod
+    def build(cls, season, version=None):
+        """Builds a new index for the given season from the datastore."""
+        from models import Team, Week, Game
+        logging.info(u'Building schedule index for %s' % season)
+        if version is None:
+            version = get_version(season)
+        weeks = db.Query(Week).ancestor(season).fetch(100)
+        games = db.Query(Game).ancestor(season).fetch(1000)
+        return cls(season.key(), weeks, games, Team.all_teams(), version)
+
+    def resolve_weeks(self, now=None):
+        """Finds the current week (the last one to have started) and the next
+        week (the first one that hasn't started yet) as of the given time,
+        defaulting to now. Either may be None. The answer is computed by
+        binary search over the week boundaries and reused until the next
+        boundary passes."""
+        now = now or datetime.datetime.now()
+        resolution = self._resolution
+        if resolution and resolution[0] <= now < resolution[1]:
+            return resolution[2]
+        starts = self._week_starts
+        i = bisect_right(starts, now)
+        current_week = self.weeks[i - 1] if i > 0 else None
+        next_week = self.weeks[i] if i < len(starts) else None
+        valid_from = starts[i - 1] if i > 0 else datetime.datetime.min
+        valid_until = starts[i] if i < len(starts) else datetime.datetime.max
+        weeks = (current_week, next_week)
+        self._resolution = (valid_from, valid_until, weeks)
+        return weeks
+
+    def current_week(self, now=None):
+        return self.resolve_weeks(now)[0]
+
+    def next_week(self, now=None):
+        return self.resolve_weeks(now)[1]
+
+    def get_week(self, week_num):
+        """Gets the week with the given ordinal number, or None."""
+        week_key = db.Key.from_path('Week', week_num, parent=self.season_key)
+        return self._weeks.get(week_key)
+
+    def games_for_week(self, week):
+        """A week's games, in order of kickoff."""
+        return self._games_by_week.get(_key(week), ())
+
+    def grouped_games(self, week):
+        """A week's games, grouped by (local) date and then by kickoff time,
+        as a nested sequence of (date, [(time, [games])]) tuples."""
+        return self._grouped_games.get(_key(week), ())
+
+    def find_game(self, week, team):
+        """Finds the game the given team plays in the given week, or None."""
+        return self._games_by_week_team.get((_key(week), _key(team)))
+
+    def games_for_team(self, team):
+        """A team's games for the whole season, in order of kickoff."""
+        return self._games_by_team.get(_key(team), ())
+
+
+def group_games(games):
+    """Groups the given games (which must be sorted by kickoff) by local date
+    and by time."""
+    date_grouper = lambda g: (g.start + LOCAL_OFFSET).date()
+    time_grouper = lambda g: g.start.time()
+    groups = []
+    for date, games1 in groupby(games, date_grouper):
+        group = tuple((time, tuple(games2)) for time, games2
+                      in groupby(games1, time_grouper))
+        groups.append((date, group))
+    return tuple(groups)
+
+def fetch_games(season, first_date, last_date):
+    """Fetches all of the given season's games played between the given
+    local dates (inclusive) in a single query, ordered by kickoff."""
+    from models import Game
+    # Local midnight is LOCAL_OFFSET behind UTC midnight
+    start = datetime.datetime.combine(first_date, datetime.time())
+    end = datetime.datetime.combine(last_date, datetime.time())
+    start -= LOCAL_OFFSET
+    end += datetime.timedelta(days=1) - LOCAL_OFFSET
+    return db.Query(Game).ancestor(season)\
+        .filter('start >=', start)\
+        .filter('start <', end)\
+        .order('start')\
+        .fetch(1000)
+
+def local_date(game):
+    """The local date a game is played on."""
+    return (game.start + LOCAL_OFFSET).date()
+
+def get_index(season):
+    """Gets the schedule index for the given season, building it if this
+    process doesn't have one yet or if the season's schedule has changed
+    since it was built."""
+    season_key = _key(season)
+    index = _indexes.get(season_key)
+    if index is not None:
+        if time.time() - index.checked_at < VERSION_CHECK_INTERVAL:
+            return index
+        if get_version(season) == index.version:
+            index.checked_at = time.time()
+            return index
+    if not isinstance(season, db.Model):
+        from models import Season
+        season = Season.get(season_key)
+    index = ScheduleIndex.build(season)
+    _indexes[season_key] = index
+    return index
+
+def get_version(season):
+    """Gets the current schedule version for the given season, from memcache
+    if possible."""
+    cache_key = _version_cache_key(season)
+    version = memcache.get(cache_key)
+    if version is None:
+        if not isinstance(season, db.Model):
+            from models import Season
+            season = Season.get(season)
+        version = season.schedule_version
+        memcache.add(cache_key, version)
+    return version
+
+def invalidate(season):
+    """Bumps the given season's schedule version, so that every process will
+    rebuild its index the next time it checks the version. Should be called
+    after writing any changes to the season's weeks or games."""
+    from models import Season
+    season_key = _key(season)
+    def txn():
+        season = Season.get(season_key)
+        season.schedule_version += 1
+        season.put()
+        return season.schedule_version
+    version = db.run_in_transaction(txn)
+    memcache.set(_version_cache_key(season_key), version)
+    _indexes.pop(season_key, None)
+
+    # The cached current season may have changed, too
+    from models import schedule_cache
+    schedule_cache.invalidate()
+    return version
+
+def _version_cache_key(season):
+    return 'schedule-version:%s' % _key(season)
+
+def _key(obj):
+    return obj if isinstance(obj, db.Key) else obj.key()
@@ -10,10 +10,14 @@ import logging
 import re
 import time
 
+from google.appengine.ext import db
+from google.appengine.api import memcache
+
 from ext import webapp2
 from ext.webapp2_extras import securecookie, json
 
 from lib.jinja import render_to_string
+from lib import prefetch
 
 from models import Account
 import settings
@@ -25,6 +29,92 @@ DEFAULT_MIMETYPE = 'text/html; charset=utf-8'
 SECURE_COOKIE_SERIALIZER = \
     securecookie.SecureCookieSerializer(settings.SECRET)
 
+# Account cookies last for 14 days
+ACCOUNT_COOKIE_AGE = 60 * 60 * 24 * 14
+
+
+class AccountSnapshot(object):
+    """A compact snapshot of an Account (its key, names and version) that is
+    stored in the signed account cookie, so that most requests never need to
+    fetch the account itself. Any attribute not in the snapshot is looked up
+    on the full Account, which is fetched lazily the first time it is needed.
+    If the fetched account's version doesn't match the snapshot's, the
+    snapshot is stale and `on_stale` is called with the fresh account.
+
+    Every request also checks the snapshot's version against the latest one
+    in memcache (see check_version), so that stale snapshots are caught even
+    when the account itself is never needed."""
+
+    def __init__(self, key, first_name, last_name, version, on_stale=None):
+        self._key = key
+        self.first_name = first_name
+        self.last_name = last_name
+        self.version = version
+        self.on_stale = on_stale
+
+    @classmethod
+    def from_account(cls, account, **kwargs):
+        return cls(account.key(), account.first_name, account.last_name,
+                   account.version, **kwargs)
+
+    @classmethod
+    def from_cookie(cls, data, **kwargs):
+        return cls(db.Key(data['k']), data['f'], data['l'], data['v'],
+                   **kwargs)
+
+    def to_cookie(self):
+        return { 'k': str(self._key),
+                 'f': self.first_name,
+                 'l': self.last_name,
+                 'v': self.version }
+
+    def key(self):
+        return self._key
+
+    @property
+    def name(self):
+        return u'%s %s' % (self.first_name, self.last_name)
+
+    def check_version(self):
+        """Compares this snapshot's version with the account's latest version
+        in memcache, fetching the account (which refreshes the snapshot) if
+        they differ, or if the latest version is not cached."""
+        version = memcache.get(Account.version_cache_key(self._key))
+        if version != self.version:
+            self.entity
+
+    @property
+    def entity(self):
+        """The full Account, fetched on first access."""
+        if not hasattr(self, '_entity'):
+            self._entity = Account.get(self._key)
+            if self._entity is not None:
+                memcache.add(Account.version_cache_key(self._key),
+                             self._entity.version)
+            if self._entity is not None and \
+                    self._entity.version != self.version:
+                logging.info('Stale account snapshot for %s' % self._key)
+                self.first_name = self._entity.first_name
+                self.last_name = self._entity.last_name
+                self.version = self._entity.version
+                if self.on_stale:
+                    self.on_stale(self._entity)
+        return self._entity
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.entity, name)
+
+    def __eq__(self, other):
+        return hasattr(other, 'key') and other.key() == self._key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __unicode__(self):
+        return self.name
+
 
 class RequestHandler(webapp2.RequestHandler):
     """A custom Tornado RequestHandler that knows how to tell if a user has
@@ -35,6 +125,9 @@ class RequestHandler(webapp2.RequestHandler):
 
     def dispatch(self, *args, **kwargs):
 
+        # Start every request with an empty identity map
+        prefetch.reset()
+
         # If this handler requires login and there is no account, render the
         # login page in place, with an appropriate status code.
         if self.login_required and self.account is None:
@@ -63,16 +156,41 @@ class RequestHandler(webapp2.RequestHandler):
 
     @property
     def account(self):
-        """A account is considered to be logged in via Twitter if they have
-        their account_id stored in a secure cookie."""
+        """A account is considered to be logged in via Facebook if they have
+        an AccountSnapshot stored in a secure cookie. Cookies from before
+        snapshots existed just contain the account's key, and are upgraded.
+        """
         if not hasattr(self, '_account'):
-            account_key = self.get_secure_cookie('account')
-            try:
-                self._account = Account.get(account_key)
-            except:
-                self._account = None
+            data = self.get_secure_cookie('account')
+            self._account = None
+            if isinstance(data, dict):
+                try:
+                    self._account = AccountSnapshot.from_cookie(
+                        data, on_stale=self.set_account_cookie)
+                except Exception, e:
+                    logging.warning('Bad account cookie: %r' % data)
+                else:
+                    self._account.check_version()
+            elif data:
+                try:
+                    account = Account.get(data)
+                except Exception, e:
+                    account = None
+                if account is not None:
+                    self.set_account_cookie(account)
         return self._account
 
+    def set_account_cookie(self, account):
+        """Stores a snapshot of the given account in the account cookie, and
+        makes it the current account."""
+        snapshot = AccountSnapshot.from_account(
+            account, on_stale=self.set_account_cookie)
+        snapshot._entity = account
+        self.set_secure_cookie(
+            'account', snapshot.to_cookie(), max_age=ACCOUNT_COOKIE_AGE)
+        self._account = snapshot
+        return snapshot
+
     def render(self, template, context=None, status=None, mimetype=None):
         """Renders the given template (or list of templates to choose) with
         the given context using Jinja2."""
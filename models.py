@@ -1,11 +1,36 @@
+import calendar
 import datetime
 import hashlib
 import logging
-from itertools import groupby
+import struct
+from array import array
+from collections import defaultdict
 
 from google.appengine.ext import db
+from google.appengine.ext import deferred
+from google.appengine.api import memcache
+from django.utils import simplejson as json
 
-from lib.caching import cachemodel, uncachemodel
+from lib import counters
+from lib.caching import Cache
+import settings
+
+
+# Caches for data that almost never changes
+team_cache = Cache('teams', max_size=50, ttl=60 * 60 * 24, local_ttl=60 * 60)
+schedule_cache = Cache('schedule', max_size=50, ttl=60 * 60)
+
+
+# Every team's slug, in a fixed order. A team's position in this list is its
+# team number, which is persisted in Entry.pick_teams, so new teams must only
+# ever be appended.
+TEAM_SLUGS = (
+    'ari', 'atl', 'bal', 'buf', 'car', 'chi', 'cin', 'cle',
+    'dal', 'den', 'det', 'gb', 'hou', 'ind', 'jac', 'kc',
+    'mia', 'min', 'ne', 'no', 'nyg', 'nyj', 'oak', 'phi',
+    'pit', 'sd', 'sea', 'sf', 'stl', 'tb', 'ten', 'wsh',
+    )
+TEAM_NUMBERS = dict((slug, i) for i, slug in enumerate(TEAM_SLUGS))
 
 
 class Account(db.Model):
@@ -15,10 +40,24 @@ class Account(db.Model):
     last_name = db.StringProperty()
     oauth_token = db.StringProperty()
 
+    # Bumped whenever a field carried in the account cookie changes, so that
+    # stale cookie snapshots can be detected (see lib.webapp.AccountSnapshot)
+    version = db.IntegerProperty(default=1)
+
     @property
     def name(self):
         return u'%s %s' % (self.first_name, self.last_name)
 
+    @staticmethod
+    def version_cache_key(key):
+        return 'account-version:%s' % key
+
+    def cache_version(self):
+        """Records this account's current version in memcache, where every
+        request checks its cookie snapshot against it. Should be called
+        after bumping the version."""
+        memcache.set(Account.version_cache_key(self.key()), self.version)
+
     def __unicode__(self):
        return self.name
 
@@ -34,13 +73,19 @@ class Team(db.Model):
     def slug(self):
         return self.key().name()
 
+    @property
+    def number(self):
+        """This team's position in TEAM_SLUGS."""
+        return TEAM_NUMBERS[self.slug]
+
     @classmethod
     def all_teams(cls):
-        teams = uncachemodel('teams', namespace='teams')
-        if not teams:
-            teams = cls.all().fetch(32)
-            cachemodel('teams', teams, namespace='teams')
-        return teams
+        return team_cache.get_or_set('teams', lambda: cls.all().fetch(32))
+
+    @classmethod
+    def registry(cls):
+        """A dict mapping each team's slug to the team."""
+        return dict((team.slug, team) for team in cls.all_teams())
 
     def __unicode__(self):
         return u'%s %s' % (self.place, self.name)
@@ -54,6 +99,15 @@ class Season(db.Model):
     year and end year separated by a dash (e.g. '2010-2011')."""
     start_date = db.DateProperty(required=True)
 
+    # Bumped whenever this season's weeks or games are written, so that
+    # in-memory schedule indexes know when to rebuild (see lib.schedule).
+    schedule_version = db.IntegerProperty(default=0)
+
+    @property
+    def schedule(self):
+        from lib import schedule
+        return schedule.get_index(self)
+
     @property
     def weeks(self):
         return db.Query(Week).ancestor(self).order('start')
@@ -66,15 +120,60 @@ class Season(db.Model):
     def name(self):
         return u'%s Season' % self.key().name()
 
+    @property
+    def pool_counter(self):
+        return 'season-pools:%s' % self.key()
+
+    @property
+    def entry_counter(self):
+        return 'season-entries:%s' % self.key()
+
+    @property
+    def pool_count(self):
+        return counters.get_count(self.pool_counter, initial=self.count_pools)
+
+    @property
+    def entry_count(self):
+        if not settings.ENTRIES_MIGRATED:
+            return self.count_entries()
+        return counters.get_count(
+            self.entry_counter, initial=self.count_entries)
+
+    def pool_keys(self):
+        """The keys of the pools played in this season (see Pool.season), by
+        query. Only meant for seeding this season's counters."""
+        week_keys = [week.key() for week in self.schedule.weeks]
+        keys = []
+        for i in xrange(0, len(week_keys), 30):
+            keys.extend(db.Query(Pool, keys_only=True)
+                        .filter('start_week IN', week_keys[i:i + 30]))
+        current = Season.current()
+        if current and current.key() == self.key():
+            keys.extend(db.Query(Pool, keys_only=True)
+                        .filter('start_week =', None))
+        return keys
+
+    def count_pools(self):
+        return len(self.pool_keys())
+
+    def count_entries(self):
+        count = 0
+        for key in self.pool_keys():
+            count += db.Query(Entry, keys_only=True).filter('pool =', key)\
+                .count()
+            if not settings.ENTRIES_MIGRATED:
+                count += db.Query(Entry, keys_only=True).ancestor(key).count()
+        return count
+
     @classmethod
     def current(cls):
-        if not hasattr(cls, '_current'):
-            today = datetime.date.today()
-            season = cls.all()\
-                .order('-start_date')\
-                .get()
-            cls._current = season
-        return cls._current
+        """The latest season, cached once there is one."""
+        season = schedule_cache.get('current-season')
+        if season is None:
+            season = cls.all().order('-start_date').get()
+            if season is not None:
+                schedule_cache.set('current-season', season)
+        return season
 
     def __unicode__(self):
         return self.name
@@ -91,51 +190,36 @@ class Week(db.Model):
     def games(self):
         return db.Query(Game).ancestor(self).order('start')
 
+    @property
+    def schedule(self):
+        from lib import schedule
+        return schedule.get_index(self.parent_key())
+
     @property
     def grouped_games(self):
-        """Yields this week's games in a nested sequence of groupings, by date
-        and by time.
+        """This week's games in a nested sequence of groupings, by date and
+        by time, from the season's schedule index.
         """
-        # Game times are stored as UTC, need to be offset back to EST or the
-        # night games overflow into the next day.
-        offset = datetime.timedelta(hours=-5)
-        date_grouper = lambda g: (g.start + offset).date()
-        time_grouper = lambda g: g.start.time()
-        for date, games1 in groupby(self.games.fetch(100), date_grouper):
-            group = [(time, list(games2)) for time, games2
-                     in groupby(games1, time_grouper)]
-            yield date, group
+        return self.schedule.grouped_games(self)
 
     @property
     def closed(self):
         return datetime.datetime.now() > self.start
 
     def find_game_for(self, team):
-        return self.games.filter('teams =', team.key()).get()
+        return self.schedule.find_game(self, team)
 
     @classmethod
     def next(cls):
-        if not hasattr(cls, '_next'):
-            season = Season.current()
-            if season:
-                now = datetime.datetime.now()
-                week = season.weeks.filter('start >', now).get()
-                cls._next = week
-            else:
-                cls._next = None
-        return cls._next
+        """The current season's next week (the first that hasn't started)."""
+        season = Season.current()
+        return season and season.schedule.next_week()
 
     @classmethod
     def current(cls):
-        if not hasattr(cls, '_current'):
-            season = Season.current()
-            now = datetime.datetime.now()
-            week = season.weeks\
-                .filter('start <=', now)\
-                .order('-start')\
-                .get()
-            cls._current = week
-        return cls._current
+        """The current season's current week (the last to have started)."""
+        season = Season.current()
+        return season and season.schedule.current_week()
 
     def __unicode__(self):
         return self.name
@@ -158,14 +242,35 @@ class Game(db.Model):
     start = db.DateTimeProperty()
     final = db.BooleanProperty(default=False)
 
+    # The latest point spread, from the home team's perspective. Earlier
+    # lines are kept in the game's LineHistory.
+    spread = db.FloatProperty()
+
     updated_at = db.DateTimeProperty(auto_now=True)
 
+    @property
+    def line_history(self):
+        return LineHistory.get(LineHistory.key_for(self))
+
     def is_winner(self, team):
         """Returns True if the given team won or tied the game. NOTE: Assumes
         that the game is over.
         """
         return self.get_winner() in (team, None)
 
+    def get_winner_key(self):
+        """Like get_winner, but returns the winning team's key (or None in
+        the case of a tie) without fetching any teams. NOTE: Assumes that the
+        game is over.
+        """
+        diff = self.home_score - self.away_score
+        if diff > 0:
+            return Game.home_team.get_value_for_datastore(self)
+        elif diff < 0:
+            return Game.away_team.get_value_for_datastore(self)
+        else:
+            return None
+
     def get_winner(self):
         """Determines the winner of the game. Returns the winning team, or
         None in the case of a tie. NOTE: Assumes that the game is over.
@@ -212,11 +317,11 @@ class Pool(db.Model):
 
     @property
     def entries(self):
-        return db.Query(Entry).ancestor(self)
+        return db.Query(Entry).filter('pool =', self)
 
     @property
     def entry_keys(self):
-        return db.Query(Entry, keys_only=True).ancestor(self)
+        return db.Query(Entry, keys_only=True).filter('pool =', self)
 
     @property
     def active_entries(self):
@@ -226,9 +331,68 @@ class Pool(db.Model):
     def inactive_entries(self):
         return self.entries.filter('active =', False)
 
+    @property
+    def legacy_entries(self):
+        """This pool's entries that are still its children (see
+        data.migrations), which the queries above can't see."""
+        return db.Query(Entry).ancestor(self)
+
+    def all_entries(self):
+        """All of this pool's entries (up to 1000), including the ones that
+        have not been re-keyed yet, until settings.ENTRIES_MIGRATED is set."""
+        entries = self.entries.fetch(1000)
+        if not settings.ENTRIES_MIGRATED:
+            entries.extend(self.legacy_entries.fetch(1000))
+        return entries
+
+    @property
+    def standings(self):
+        """This pool's PoolStandings snapshot, built (and stored) on demand
+        if it does not exist yet."""
+        return PoolStandings.for_pool(self)
+
+    @property
+    def season(self):
+        """The season this pool is played in, based on its starting week."""
+        week_key = Pool.start_week.get_value_for_datastore(self)
+        if week_key is not None:
+            return Season.get(week_key.parent())
+        return Season.current()
+
+    @property
+    def entry_counter(self):
+        return 'pool-entries:%s' % self.key()
+
+    @property
+    def active_counter(self):
+        return 'pool-active-entries:%s' % self.key()
+
+    @property
+    def entry_count(self):
+        # The counters can't be seeded until every entry can be counted by
+        # query (see settings.ENTRIES_MIGRATED)
+        if not settings.ENTRIES_MIGRATED:
+            return self.entries.count() + self.legacy_entries.count()
+        return counters.get_count(
+            self.entry_counter, initial=self.entries.count)
+
+    @property
+    def active_count(self):
+        if not settings.ENTRIES_MIGRATED:
+            return self.active_entries.count() + \
+                self.legacy_entries.filter('active =', True).count()
+        return counters.get_count(
+            self.active_counter, initial=self.active_entries.count)
+
+    def seed_counters(self):
+        """Seeds a new pool's entry counters with zero, so that they are
+        never seeded by queries that might not see its first entries yet."""
+        for name in (self.entry_counter, self.active_counter):
+            counters.seed(name, 0)
+
     @property
     def pot(self):
-        return self.entry_fee * self.entries.count()
+        return self.entry_fee * self.entry_count
 
     @property
     def open(self):
@@ -248,9 +412,16 @@ class Pool(db.Model):
 
     def find_entry_for(self, account, key_only=False):
         """Find an entry in this pool for the given account, if there is one.
+        Until settings.ENTRIES_MIGRATED is set, falls back on looking for an
+        entry that is still a child of this pool (see data.migrations) if
+        there is none at the deterministic key.
         """
-        q = self.entry_keys if key_only else self.entries
-        return q.filter('account =', account).get()
+        entry = Entry.get(Entry.key_for(self, account))
+        if entry is None:
+            entry = self._find_legacy_entry(account)
+        if key_only:
+            return entry and entry.key()
+        return entry
 
     def is_member(self, account):
         """Does the given account have an entry in this pool?
@@ -259,32 +430,167 @@ class Pool(db.Model):
 
     def add_entry(self, account):
         """Adds an entry for the given account, if one does not already exist.
-        Returns a boolean indicated whether a new entry was created."""
+        Returns a boolean indicated whether a new entry was created. Works
+        like get_or_insert on the entry's deterministic key, and also has the
+        pool's standings pick up a new entry in a task (see
+        sync_pool_entry). Until settings.ENTRIES_MIGRATED is set, an entry
+        that is still a child of this pool counts as an existing one."""
+        account_key = _key(account)
+        legacy = self._find_legacy_entry(account_key)
+        if legacy is not None:
+            return legacy, False
+        key = Entry.key_for(self, account_key)
         def txn():
-            entry = self.entries.filter('account =', account).get()
-            if not entry:
-                entry = Entry(account=account, parent=self)
-                entry.put()
-                created = True
-            else:
-                created = False
-            return entry, created
+            entry = Entry.get(key)
+            if entry is not None:
+                return entry, False
+            entry = Entry(key=key, pool=self, account=account_key)
+            entry.put()
+            deferred.defer(sync_pool_entry, key, _transactional=True)
+            deferred.defer(count_entries, self.key(), _transactional=True)
+            return entry, True
         return db.run_in_transaction(txn)
 
+    def _find_legacy_entry(self, account):
+        """The given account's entry among the ones that are still children
+        of this pool, or None (always, once settings.ENTRIES_MIGRATED is
+        set)."""
+        if settings.ENTRIES_MIGRATED:
+            return None
+        return self.legacy_entries.filter('account =', _key(account)).get()
+
+    def eliminate_entries(self, entry_keys, week):
+        """Marks the given entries in this pool as eliminated in the given
+        week, each in its own transaction, and then brings the pool's
+        standings up to date with all of them. Entries that are already
+        inactive are left alone (but are still synced to the standings, so
+        that this can safely be retried). Returns the number of entries
+        eliminated."""
+        def txn(entry_key):
+            entry = Entry.get(entry_key)
+            if entry is None or not entry.active:
+                return entry, False
+            entry.active = False
+            entry.eliminated_week = week
+            entry.revision += 1
+            entry.put()
+            deferred.defer(count_entries, self.key(), -1, active_only=True,
+                           _transactional=True)
+            return entry, True
+        results = [db.run_in_transaction(txn, key) for key in entry_keys]
+        entries = [entry for entry, changed in results if entry is not None]
+        eliminated = len([changed for entry, changed in results if changed])
+        PoolStandings.sync_entries(self, entries)
+        return eliminated
+
     def __unicode__(self):
         return self.name
 
 
+def count_pool(pool_key):
+    """Counts a new pool in its season's pool counter. Deferred in the
+    pool's creating transaction, so it is only counted if that commits."""
+    pool = Pool.get(pool_key)
+    season = pool and pool.season
+    if season:
+        # The pool may be too new for the seeding query to see it, but it
+        # has to be in the seed, since this increment is dropped if seeding
+        initial = lambda: len(set(season.pool_keys()) | set([pool_key]))
+        counters.increment(season.pool_counter, initial=initial)
+
+def count_entries(pool_key, delta=1, active_only=False):
+    """Adds the given delta to the given pool's (and its season's) entry
+    counters, or only to its active entry counter. Deferred in the
+    transaction that adds or eliminates the entries being counted, so they
+    are only counted if it commits."""
+    pool = Pool.get(pool_key)
+    if pool is None:
+        return
+    counters.increment(pool.active_counter, delta,
+                       initial=_seed_entries(pool.active_entries.count))
+    if active_only:
+        return
+    counters.increment(pool.entry_counter, delta,
+                       initial=_seed_entries(pool.entries.count))
+    season = pool.season
+    if season:
+        counters.increment(season.entry_counter, delta,
+                           initial=_seed_entries(season.count_entries))
+
+def reset_entry_counters(pool):
+    """Throws away the given pool's (and its season's) entry counters, so
+    that they are seeded again from scratch. Used after re-keying entries
+    that the counters' seeds may have missed (see data.migrations)."""
+    names = [pool.entry_counter, pool.active_counter]
+    season = pool.season
+    if season:
+        names.append(season.entry_counter)
+    for name in names:
+        counters.reset(name)
+
+def _seed_entries(count):
+    """The given callable, to seed an entry counter with, or None until
+    every entry can be counted by query (see settings.ENTRIES_MIGRATED)."""
+    if settings.ENTRIES_MIGRATED:
+        return count
+    return None
+
+
 class Entry(db.Model):
-    """A single user's entry into a given Pool."""
+    """A single user's entry into a given Pool. Each entry is the root of its
+    own entity group (with its picks as children), so that entries in the same
+    pool can be written concurrently. The key name is made from the pool's id
+    and the account's key name (see key_for), so an account's entry in a
+    pool can be found with a get. Older entries are re-keyed by
+    data.migrations."""
+    pool = db.ReferenceProperty(Pool, collection_name='pool_entries')
     account = db.ReferenceProperty(Account, collection_name='entries')
 
+    # URLs address entries under their pool (see lib.decorators)
+    path_parent = 'pool'
+
     # Is this entry still active (ie, has not lost)?
     active = db.BooleanProperty(default=True)
 
+    # Which week was this entry knocked out in, if any?
+    eliminated_week = db.ReferenceProperty(
+        Week, collection_name='eliminated_entries')
+
     # Has it been paid up?
     paid = db.BooleanProperty(default=False)
 
+    # A packed array of the teams this entry has picked, indexed by week
+    # number minus one. Each byte is the picked team's number (see
+    # TEAM_SLUGS) plus one, or zero if no pick has been made for that week.
+    # Kept up to date in the same transaction as each pick's write.
+    pick_teams = db.ByteStringProperty()
+
+    # Bumped on every write that changes what the pool's standings or pick
+    # digests show for this entry, so that they can ignore stale updates
+    revision = db.IntegerProperty(default=0)
+
+    @classmethod
+    def key_for(cls, pool, account):
+        """The key of the given account's entry in the given pool."""
+        return db.Key.from_path(cls.kind(), '%s:%s' % (
+                _key(pool).id_or_name(), _key(account).id_or_name()))
+
+    @classmethod
+    def find_for(cls, pools, account):
+        """Finds the given account's entries in each of the given pools, with
+        a single batch get. Returns a list of entries (or None, where the
+        account has no entry) in the same order as the pools."""
+        return cls.get([cls.key_for(pool, account) for pool in pools])
+
+    def pool_key(self):
+        """The key of this entry's pool (which is its parent, for entries that
+        have not been migrated yet)."""
+        return Entry.pool.get_value_for_datastore(self) or self.parent_key()
+
+    def get_pool(self):
+        """This entry's pool (see pool_key)."""
+        return self.pool or self.parent()
+
     @property
     def picks(self):
         return db.Query(Pick).ancestor(self)
@@ -299,24 +605,169 @@ class Entry(db.Model):
 
     def find_pick_for_week(self, week, key_only=False):
         """Find this entry's pick for the given week."""
-        return self.find_pick('week', week)
+        pick_key = self.pick_key_for_week(week)
+        if key_only:
+            return pick_key if self.has_picked_week(week) else None
+        return db.get(pick_key)
 
     def find_pick_for_team(self, team, key_only=False):
-        """Find this entry's pick for the given week."""
-        return self.find_pick('team', team)
+        """Find this entry's pick for the given team."""
+        return self.find_pick('team', team, key_only=key_only)
+
+    def picks_by_week(self):
+        """A dict mapping week numbers to this entry's picks."""
+        return dict((pick.key().id(), pick) for pick in self.picks.fetch(100))
+
+    def pick_key_for_week(self, week):
+        week_id = week if isinstance(week, (int, long)) else _key(week).id()
+        return db.Key.from_path('Pick', week_id, parent=self.key())
+
+    def get_pick_teams(self):
+        """This entry's pick_teams array, as a mutable array of bytes. If it
+        has never been built (e.g., for entries created before it existed), it
+        is built from the entry's picks (but only stored along with the next
+        pick, or by data.migrations.build_pick_teams)."""
+        if self.pick_teams is None:
+            pick_teams = array('B')
+            for pick in self.picks.fetch(100):
+                team_key = Pick.team.get_value_for_datastore(pick)
+                _set_pick_team(pick_teams, pick.key().id(), team_key.name())
+            self.pick_teams = pick_teams.tostring()
+        return array('B', self.pick_teams)
 
-    def has_picked_week(self, week):
-        """Has a pick been made for the given week?"""
-        return self.find_pick_for_week(week, key_only=True) is not None
+    @property
+    def pick_count(self):
+        """The number of weeks this entry has made a pick for."""
+        return len(filter(None, self.get_pick_teams()))
+
+    def team_number_for_week(self, week):
+        """The number of the team picked for the given week, or None."""
+        week_id = week if isinstance(week, (int, long)) else _key(week).id()
+        pick_teams = self.get_pick_teams()
+        if 0 < week_id <= len(pick_teams) and pick_teams[week_id - 1]:
+            return pick_teams[week_id - 1] - 1
+        return None
+
+    def team_for_week(self, week):
+        """The team picked for the given week, from the team registry, or
+        None."""
+        number = self.team_number_for_week(week)
+        if number is None:
+            return None
+        return Team.registry().get(TEAM_SLUGS[number])
+
+    def teams_used(self, exclude_week=None):
+        """A bitmask of the numbers of the teams this entry has picked,
+        optionally ignoring the pick for the given week."""
+        exclude = exclude_week and _key(exclude_week).id()
+        mask = 0
+        for i, value in enumerate(self.get_pick_teams()):
+            if value and i + 1 != exclude:
+                mask |= 1 << (value - 1)
+        return mask
 
-    def has_picked_team(self, team):
+    def has_picked_week(self, week):
         """Has a pick been made for the given week?"""
-        return self.find_pick_for_team(team, key_only=True) is not None
+        return self.team_number_for_week(week) is not None
+
+    def has_picked_team(self, team, exclude_week=None):
+        """Has the given team been picked (in any week other than the given
+        one)?"""
+        return bool(self.teams_used(exclude_week) & (1 << team.number))
+
+    def make_pick(self, week, game, team, submitted_at=None, unique=False):
+        """Creates or replaces this entry's pick for the given week, in a
+        transaction (on this entry's own entity group) that also keeps the
+        entry's pick_teams array up to date and enqueues a task to sync the
+        pool's standings and digest of the week's picks. Returns the pick.
+        If `unique` is true (as in suicide pools), raises DuplicatePickError
+        if the team has already been picked in another week, as of the
+        transaction.
+
+        A pick is only replaced by one submitted after it, so that picks
+        applied late (see pickbuffer) can't clobber newer ones, and applying
+        the same submission twice is harmless."""
+        pick_key = self.pick_key_for_week(week)
+        submitted_at = submitted_at or datetime.datetime.now()
+        def txn():
+            previous, entry = db.get([pick_key, self.key()])
+            if previous and previous.submitted_at and \
+                    previous.submitted_at >= submitted_at:
+                return previous, entry
+            if unique and entry.has_picked_team(team, exclude_week=week):
+                raise DuplicatePickError(u'Already picked %s' % team)
+            pick = Pick(key=pick_key, week=week, game=game, team=team,
+                        submitted_at=submitted_at)
+            pick_teams = entry.get_pick_teams()
+            _set_pick_team(pick_teams, week.key().id(), team.slug)
+            entry.pick_teams = pick_teams.tostring()
+            entry.revision += 1
+            db.put([pick, entry])
+            deferred.defer(sync_pool_entry, entry.key(), week.key(),
+                           _transactional=True)
+            return pick, entry
+        pick, entry = db.run_in_transaction(txn)
+        self.pick_teams = entry.pick_teams
+        self.revision = entry.revision
+        return pick
 
     def __unicode__(self):
         return unicode(self.account)
 
 
+class DuplicatePickError(Exception):
+    """Raised by Entry.make_pick when a team can only be picked once."""
+
+
+def sync_pool_entry(entry_key, week_key=None):
+    """Brings the given entry's row in its pool's standings (and its pick in
+    the pool's digest of the given week's picks, if any) up to date with the
+    entry, in a transaction on the pool's entity group. Run in a task after
+    each write to an entry, so that the pool's group is not part of the
+    entry's own transaction."""
+    entry = Entry.get(entry_key)
+    if entry is None:
+        return
+    # Make sure the pick_teams array is built outside the transaction, since
+    # building it queries the entry's own entity group
+    entry.get_pick_teams()
+    pool_key = entry.pool_key()
+    keys = [PoolStandings.key_for(pool_key)]
+    if week_key is not None:
+        keys.append(WeekPicks.key_for(pool_key, week_key))
+    name = unicode(entry.account)
+    def txn():
+        entities = filter(None, db.get(keys))
+        changed = [entity for entity in entities
+                   if entity.sync_entry(entry, name=name)]
+        db.put(changed)
+    db.run_in_transaction(txn)
+
+def sync_account_name(account_key):
+    """Brings the display name of the given account's entries up to date in
+    their pools' standings, in a transaction per pool. Deferred when an
+    account is renamed, since the standings only pick up names along with
+    changes to the entries themselves."""
+    account = Account.get(account_key)
+    if account is None:
+        return
+    name = unicode(account)
+    for entry in Entry.all().filter('account =', account_key):
+        key = PoolStandings.key_for(entry.pool_key())
+        def txn():
+            standings = PoolStandings.get(key)
+            if standings is not None and standings.rename_entry(entry, name):
+                standings.put()
+        db.run_in_transaction(txn)
+
+def _set_pick_team(pick_teams, week_id, team_slug):
+    """Records the team with the given slug as the pick for the given week in
+    a pick_teams array, growing it as necessary."""
+    if len(pick_teams) < week_id:
+        pick_teams.extend([0] * (week_id - len(pick_teams)))
+    pick_teams[week_id - 1] = TEAM_NUMBERS[team_slug] + 1
+
+
 class Pick(db.Model):
     """A single user's pick for a specific game. Should have an entry as its
     parent."""
@@ -325,11 +776,18 @@ class Pick(db.Model):
     team = db.ReferenceProperty(Team, collection_name='picks')
     correct = db.BooleanProperty()
 
+    # When the user submitted this pick (which may be earlier than when it
+    # was written, for buffered picks)
+    submitted_at = db.DateTimeProperty()
+
     def evaluate(self, commit=True):
         """Evaluates this pick to determine if it's correct.  Returns True if
-        so, False if not, or None if the game has not finished."""
+        so, False if not, or None if the game has not finished. NOTE: Picks
+        are evaluated in bulk by data.evaluation when their games go final,
+        so pages should just read `correct` instead of calling this."""
         if self.game.final:
-            self.correct = self.game.is_winner(self.team)
+            team_key = Pick.team.get_value_for_datastore(self)
+            self.correct = self.game.get_winner_key() in (team_key, None)
             if commit:
                 self.put()
             return self.correct
@@ -338,3 +796,391 @@ class Pick(db.Model):
 
     def __unicode__(self):
         return unicode(self.team)
+
+
+class PoolStandings(db.Model):
+    """A denormalized snapshot of a Pool's entries, so that a pool's page can
+    be rendered with a single get, no matter how many entries it has. Parent
+    should be the Pool, and the key name should always be 'standings'.
+
+    Each entry is stored as a row (a dict with the entry's id, account key,
+    display name, pick count, active flag, the id of the week it was
+    eliminated in and the entry's revision) in a JSON blob. The snapshot is
+    updated incrementally by sync_pool_entry after entries and picks are
+    written."""
+    KEY_NAME = 'standings'
+
+    data = db.TextProperty(default='[]')
+    updated_at = db.DateTimeProperty(auto_now=True)
+
+    @classmethod
+    def key_for(cls, pool):
+        pool_key = pool if isinstance(pool, db.Key) else pool.key()
+        return db.Key.from_path(cls.kind(), cls.KEY_NAME, parent=pool_key)
+
+    @classmethod
+    def for_pool(cls, pool):
+        """Gets the standings for the given pool, building and storing them
+        from scratch if they do not exist yet."""
+        key = cls.key_for(pool)
+        standings = cls.get(key)
+        if standings is None:
+            standings = _insert_snapshot(cls.build(pool))
+            # Entries written while the snapshot was being built found no
+            # snapshot to sync to, so catch up with them now
+            stale = [entry for entry in pool.all_entries()
+                     if standings.is_stale(entry)]
+            if stale:
+                for entry in stale:
+                    sync_pool_entry(entry.key())
+                standings = cls.get(key)
+        return standings
+
+    @classmethod
+    def build(cls, pool):
+        """Builds a new (unsaved) snapshot of the given pool's standings from
+        its entries."""
+        logging.info(u'Building standings for pool %s' % pool)
+        standings = cls(key=cls.key_for(pool))
+        entries = pool.all_entries()
+        account_keys = [Entry.account.get_value_for_datastore(entry)
+                        for entry in entries]
+        accounts = db.get(filter(None, account_keys))
+        names = dict((account.key(), unicode(account))
+                     for account in accounts if account)
+        for entry, account_key in zip(entries, account_keys):
+            standings.update_entry(
+                entry,
+                name=names.get(account_key, u''),
+                picks=entry.pick_count)
+        return standings
+
+    @classmethod
+    def sync_entries(cls, pool, entries):
+        """Syncs the rows for the given entries into the given pool's
+        standings (if they exist), in a transaction."""
+        key = cls.key_for(pool)
+        for entry in entries:
+            entry.get_pick_teams()
+        account_keys = [Entry.account.get_value_for_datastore(entry)
+                        for entry in entries]
+        names = dict((account.key(), unicode(account))
+                     for account in db.get(filter(None, account_keys))
+                     if account)
+        def txn():
+            standings = cls.get(key)
+            if standings is None:
+                return
+            changed = [entry for entry, account_key
+                       in zip(entries, account_keys)
+                       if standings.sync_entry(entry, names.get(account_key))]
+            if changed:
+                standings.put()
+        db.run_in_transaction(txn)
+
+    @property
+    def rows(self):
+        if not hasattr(self, '_rows'):
+            self._rows = json.loads(self.data or '[]')
+        return self._rows
+
+    @property
+    def active(self):
+        """Rows for the entries still alive, ordered by name."""
+        return sorted((row for row in self.rows if row['active']),
+                      key=lambda row: row['name'].lower())
+
+    @property
+    def eliminated(self):
+        """Rows for the entries that are out of the running, ordered by the
+        week they were eliminated in (most recent first) and then by name."""
+        return sorted((row for row in self.rows if not row['active']),
+                      key=lambda row: (-(row.get('eliminated') or 0),
+                                       row['name'].lower()))
+
+    @property
+    def count(self):
+        return len(self.rows)
+
+    def find_row(self, entry):
+        entry_id = entry.key().id_or_name()
+        for row in self.rows:
+            if row['id'] == entry_id:
+                return row
+        return None
+
+    def update_entry(self, entry, name=None, picks=None):
+        """Adds or updates the row for the given entry. The display name and
+        pick count are only changed if given (or if the row is new)."""
+        row = self.find_row(entry)
+        if row is None:
+            account_key = Entry.account.get_value_for_datastore(entry)
+            row = { 'id': entry.key().id_or_name(),
+                    'account': account_key and str(account_key),
+                    'name': u'',
+                    'picks': 0 }
+            self.rows.append(row)
+        if name is not None:
+            row['name'] = name
+        if picks is not None:
+            row['picks'] = picks
+        row['active'] = entry.active
+        week_key = Entry.eliminated_week.get_value_for_datastore(entry)
+        row['eliminated'] = week_key and week_key.id()
+        row['rev'] = entry.revision
+        self._encode()
+        return row
+
+    def is_stale(self, entry):
+        """Is the given entry missing, or older than the entry itself?"""
+        row = self.find_row(entry)
+        return row is None or row.get('rev', 0) < entry.revision
+
+    def sync_entry(self, entry, name=None):
+        """Updates the row for the given entry from the entry itself, and
+        its display name (if given), unless the row already reflects that
+        revision of the entry (or a later one). Returns True if the row was
+        changed."""
+        row = self.find_row(entry)
+        if row is not None and row.get('rev', 0) >= entry.revision:
+            return False
+        if row is None and name is None:
+            name = u''
+        self.update_entry(entry, name=name, picks=entry.pick_count)
+        return True
+
+    def rename_entry(self, entry, name):
+        """Changes the display name in the row for the given entry, if there
+        is one. Returns True if the row was changed."""
+        row = self.find_row(entry)
+        if row is None or row['name'] == name:
+            return False
+        row['name'] = name
+        self._encode()
+        return True
+
+    def _encode(self):
+        self.data = json.dumps(self.rows, separators=(',', ':'))
+
+
+class WeekPicks(db.Model):
+    """A digest of the picks made by a Pool's entries in a single week, so
+    that the picks for a pool can be shown without querying every pick made
+    for the week across the whole site. Parent should be the Pool, and the key
+    name is 'week-<week id>'.
+
+    Stores a map of entry id to picked team slug, along with the number of
+    entries that picked each team, as a JSON blob. The digest is updated by
+    sync_pool_entry after each pick is written."""
+    week = db.ReferenceProperty(Week, collection_name='pool_picks')
+    data = db.TextProperty(default='{}')
+    updated_at = db.DateTimeProperty(auto_now=True)
+
+    @classmethod
+    def key_for(cls, pool, week):
+        pool_key = pool if isinstance(pool, db.Key) else pool.key()
+        week_key = week if isinstance(week, db.Key) else week.key()
+        return db.Key.from_path(
+            cls.kind(), 'week-%s' % week_key.id(), parent=pool_key)
+
+    @classmethod
+    def for_pool(cls, pool, week):
+        """Gets the digest of the given pool's picks in the given week,
+        building and storing it from scratch if it does not exist yet."""
+        key = cls.key_for(pool, week)
+        week_picks = cls.get(key)
+        if week_picks is None:
+            week_picks = _insert_snapshot(cls.build(pool, week))
+            # Catch up with picks made while the digest was being built (see
+            # PoolStandings.for_pool)
+            stale = [entry for entry in pool.all_entries()
+                     if week_picks.is_stale(entry)]
+            if stale:
+                for entry in stale:
+                    sync_pool_entry(entry.key(), _key(week))
+                week_picks = cls.get(key)
+        return week_picks
+
+    @classmethod
+    def build(cls, pool, week):
+        """Builds a new (unsaved) digest of the given pool's picks in the
+        given week."""
+        logging.info(u'Building picks for pool %s in %s' % (pool, week))
+        week_picks = cls(key=cls.key_for(pool, week), week=week)
+        for entry in pool.all_entries():
+            week_picks._set(entry, week_picks._slug_for_entry(entry))
+        week_picks._encode()
+        return week_picks
+
+    @property
+    def picks(self):
+        """A dict mapping entry ids (as strings) to team slugs."""
+        return self._decoded['picks']
+
+    @property
+    def counts(self):
+        """A dict mapping team slugs to the number of entries that picked
+        them."""
+        return self._decoded['counts']
+
+    @property
+    def count(self):
+        return len(self.picks)
+
+    @property
+    def team_counts(self):
+        """(team, count) pairs, most picked first."""
+        registry = Team.registry()
+        counts = self.counts
+        slugs = sorted(counts, key=lambda slug: (-counts[slug], slug))
+        return [(registry[slug], counts[slug]) for slug in slugs]
+
+    def slug_for(self, entry):
+        """The slug of the team the given entry (or entry id) picked, or
+        None."""
+        if isinstance(entry, Entry):
+            entry = entry.key().id_or_name()
+        return self.picks.get(str(entry))
+
+    def is_stale(self, entry):
+        """Has the given entry been written since its pick was recorded?"""
+        rev = self._decoded['revs'].get(str(entry.key().id_or_name()))
+        return rev is None or rev < entry.revision
+
+    def sync_entry(self, entry, name=None):
+        """Records the given entry's current pick for this week, unless that
+        revision of the entry (or a later one) has already been recorded.
+        Returns True if the digest was changed."""
+        if self._decoded['revs'].get(str(entry.key().id_or_name()), -1) >= \
+                entry.revision:
+            return False
+        changed = self._set(entry, self._slug_for_entry(entry))
+        if changed:
+            self._encode()
+        return changed
+
+    @property
+    def _decoded(self):
+        if not hasattr(self, '_data'):
+            self._data = json.loads(self.data or '{}')
+            self._data.setdefault('picks', {})
+            self._data.setdefault('counts', {})
+            self._data.setdefault('revs', {})
+        return self._data
+
+    def _slug_for_entry(self, entry):
+        number = entry.team_number_for_week(
+            WeekPicks.week.get_value_for_datastore(self))
+        return number is not None and TEAM_SLUGS[number] or None
+
+    def _set(self, entry, slug):
+        """Records the given team slug as the given entry's pick, replacing
+        any earlier one. Returns True if anything changed."""
+        entry_id = str(entry.key().id_or_name())
+        self._decoded['revs'][entry_id] = entry.revision
+        previous = self.picks.get(entry_id)
+        if previous == slug:
+            return False
+        if previous is not None:
+            self.counts[previous] -= 1
+            if not self.counts[previous]:
+                del self.counts[previous]
+            del self.picks[entry_id]
+        if slug is not None:
+            self.picks[entry_id] = slug
+            self.counts[slug] = self.counts.get(slug, 0) + 1
+        return True
+
+    def _encode(self):
+        self.data = json.dumps(self._decoded, separators=(',', ':'))
+
+
+class Invitation(db.Model):
+    """A batch of email invitations to join a Pool, sent in the background by
+    the invitations module. Parent should be the Pool. Tracks the delivery
+    state of every invited address."""
+    sender = db.ReferenceProperty(Account, collection_name='invitations')
+    subject = db.StringProperty()
+    body = db.TextProperty()
+
+    # Addresses not yet sent to, sent to, and given up on
+    pending = db.StringListProperty()
+    sent = db.StringListProperty()
+    failed = db.StringListProperty()
+
+    created_at = db.DateTimeProperty(auto_now_add=True)
+    updated_at = db.DateTimeProperty(auto_now=True)
+
+    @classmethod
+    def record_deliveries(cls, key, sent, failed):
+        """Moves the given addresses from pending to sent or failed, in a
+        transaction."""
+        def txn():
+            invitation = cls.get(key)
+            done = set(sent) | set(failed)
+            invitation.pending = [email for email in invitation.pending
+                                  if email not in done]
+            invitation.sent.extend(sent)
+            invitation.failed.extend(failed)
+            invitation.put()
+            return invitation
+        return db.run_in_transaction(txn)
+
+
+class LineHistory(db.Model):
+    """The history of a Game's point spread, stored compactly as an
+    append-only packed array of (timestamp, points) records in a single
+    blob, so that line movement doesn't cost an entity per snapshot. Parent
+    should be the Game, and the key name should always be 'lines'."""
+    KEY_NAME = 'lines'
+
+    # Each record is a UTC timestamp (in seconds) and the points
+    RECORD = struct.Struct('!If')
+
+    data = db.BlobProperty(default='')
+
+    @classmethod
+    def key_for(cls, game):
+        game_key = game if isinstance(game, db.Key) else game.key()
+        return db.Key.from_path(cls.kind(), cls.KEY_NAME, parent=game_key)
+
+    @property
+    def lines(self):
+        """A list of (datetime, points) tuples, oldest first."""
+        size = self.RECORD.size
+        data = self.data or ''
+        return [self._unpack(data[i:i + size])
+                for i in xrange(0, len(data), size)]
+
+    @property
+    def latest(self):
+        data = self.data or ''
+        if not data:
+            return None
+        return self._unpack(data[-self.RECORD.size:])
+
+    def append(self, points, when=None):
+        """Records the given points as of the given time (default: now)."""
+        when = when or datetime.datetime.utcnow()
+        record = self.RECORD.pack(calendar.timegm(when.utctimetuple()), points)
+        self.data = db.Blob((self.data or '') + record)
+
+    def _unpack(self, record):
+        timestamp, points = self.RECORD.unpack(record)
+        return datetime.datetime.utcfromtimestamp(timestamp), points
+
+
+def _insert_snapshot(snapshot):
+    """Stores the given freshly built snapshot (e.g., PoolStandings), unless
+    another request stored one while it was being built, in a transaction.
+    Returns the snapshot that ended up stored."""
+    def txn():
+        existing = snapshot.get(snapshot.key())
+        if existing is not None:
+            return existing
+        snapshot.put()
+        return snapshot
+    return db.run_in_transaction(txn)
+
+def _key(obj):
+    return obj if isinstance(obj, db.Key) else obj.key()
@@ -0,0 +1,169 @@
+"""
+Absorbs the surge of picks made in the last few minutes before a week's
+deadline. Inside that window (settings.FAST_PICK_WINDOW), PickHandler checks a
+pick against the cached schedule index and the entry it has already fetched,
+records it on the `picks` pull queue (see queue.yaml) and responds right away,
+instead of writing it. Drain tasks then lease the buffered picks in batches
+and apply them with Entry.make_pick.
+
+Buffered picks carry the time they were submitted, and make_pick only
+replaces a pick with one submitted after it, so picks may be drained in any
+order, or more than once, and each entry still ends up with its latest pick.
+"""
+
+import calendar
+import datetime
+import logging
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+from django.utils import simplejson as json
+
+from lib import schedule
+from models import Entry, Pool, Team, DuplicatePickError
+import settings
+
+
+# The pull queue buffered picks are recorded on
+QUEUE_NAME = 'picks'
+
+# How many buffered picks each drain task applies
+BATCH_SIZE = 100
+
+# How long a drain task has to apply its batch before the picks in it are
+# handed out again
+LEASE_SECONDS = 60
+
+# How often buffered picks are drained
+DRAIN_INTERVAL = datetime.timedelta(seconds=5)
+
+# How many times a buffered pick is leased before it is given up on
+MAX_ATTEMPTS = 5
+
+
+def in_fast_window(week, now=None):
+    """Should picks for the given week be buffered instead of written?"""
+    window = getattr(settings, 'FAST_PICK_WINDOW', None)
+    if not window:
+        return False
+    now = now or datetime.datetime.now()
+    return week.start - window <= now < week.start
+
+def buffer_pick(entry, week, team, now=None):
+    """Records the given entry's pick of the given team for the given week on
+    the pick queue, and makes sure a drain task is coming to apply it."""
+    now = now or datetime.datetime.now()
+    payload = json.dumps({
+            'entry': str(entry.key()),
+            'week': str(week.key()),
+            'team': team.slug,
+            'at': [calendar.timegm(now.timetuple()), now.microsecond],
+            })
+    taskqueue.Queue(QUEUE_NAME).add(
+        taskqueue.Task(payload=payload, method='PULL'))
+    schedule_drain(now)
+
+def schedule_drain(now=None):
+    """Enqueues a drain task for the next drain slot, unless there already is
+    one."""
+    now = now or datetime.datetime.now()
+    seconds = DRAIN_INTERVAL.seconds
+    timestamp = (calendar.timegm(now.timetuple()) // seconds + 1) * seconds
+    name = 'drain-picks-%d' % timestamp
+    try:
+        deferred.defer(drain_picks, _name=name,
+                       _eta=datetime.datetime.utcfromtimestamp(timestamp))
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError), e:
+        pass
+
+def drain_picks():
+    """Leases a batch of buffered picks and applies them (see apply_picks).
+    If any of them could not be applied, another drain is deferred to retry
+    them once their leases run out, so that they aren't stranded when no
+    more picks are coming in (e.g., after the deadline). If the batch was
+    full, another drain task is deferred right away. Returns the number of
+    picks applied."""
+    queue = taskqueue.Queue(QUEUE_NAME)
+    tasks = queue.lease_tasks(LEASE_SECONDS, BATCH_SIZE)
+    if not tasks:
+        return 0
+    retry = lambda: deferred.defer(drain_picks, _countdown=LEASE_SECONDS + 1)
+    try:
+        applied, failed = apply_picks(queue, tasks)
+    except Exception, e:
+        retry()
+        raise
+    logging.info('Applied %s of %s buffered picks (%s failed)' % (
+            applied, len(tasks), failed))
+    if len(tasks) == BATCH_SIZE:
+        deferred.defer(drain_picks)
+    if failed:
+        retry()
+    return applied
+
+def apply_picks(queue, tasks):
+    """Applies the buffered picks in the given leased tasks, keeping only the
+    latest submission for each entry and week. Picks that are no longer
+    valid (e.g., submitted after the deadline, or repeating a team in a
+    suicide pool) are dropped. The tasks for a pick are deleted once it has
+    been applied or dropped, and left leased if it fails (until it has been
+    leased MAX_ATTEMPTS times). Returns the number of picks applied and the
+    number that failed."""
+    # The latest submission for each entry and week, and all of the tasks
+    # it supersedes (including its own)
+    latest = {}
+    grouped = {}
+    for task in tasks:
+        data = json.loads(task.payload)
+        key = (data['entry'], data['week'])
+        if key not in latest or data['at'] > latest[key]['at']:
+            latest[key] = data
+        grouped.setdefault(key, []).append(task)
+
+    entry_keys = list(set(db.Key(entry) for entry, week in latest))
+    entries = dict((entry.key(), entry)
+                   for entry in Entry.get(entry_keys) if entry)
+    pool_keys = list(set(entry.pool_key() for entry in entries.values()))
+    pools = dict((pool.key(), pool) for pool in Pool.get(pool_keys) if pool)
+    teams = Team.registry()
+
+    applied = 0
+    failed = 0
+    done = []
+    for key, data in latest.iteritems():
+        entry = entries.get(db.Key(data['entry']))
+        pool = entry and pools.get(entry.pool_key())
+        week_key = db.Key(data['week'])
+        index = schedule.get_index(week_key.parent())
+        week = index.get_week(week_key.id())
+        team = teams.get(data['team'])
+        game = week and team and index.find_game(week, team)
+        seconds, microseconds = data['at']
+        submitted_at = datetime.datetime.utcfromtimestamp(seconds)\
+            .replace(microsecond=microseconds)
+
+        if pool is None or game is None or submitted_at >= week.start:
+            logging.warning('Dropped invalid buffered pick: %r' % data)
+            done.extend(grouped[key])
+            continue
+        try:
+            entry.make_pick(week, game, team, submitted_at=submitted_at,
+                            unique=pool.is_suicide)
+        except DuplicatePickError, e:
+            logging.warning('Dropped repeated buffered pick: %r' % data)
+        except Exception, e:
+            logging.exception('Error applying buffered pick: %r' % data)
+            attempts = max(task.retry_count for task in grouped[key]) + 1
+            if attempts < MAX_ATTEMPTS:
+                failed += 1
+                continue
+            logging.error('Gave up on buffered pick: %r' % data)
+        else:
+            applied += 1
+        done.extend(grouped[key])
+
+    if done:
+        queue.delete_tasks(done)
+    return applied, failed
@@ -1,3 +1,4 @@
+import datetime
 import os, sys
 
 PROJECT_ROOT = os.path.realpath(
@@ -10,5 +11,22 @@ DEBUG = not PRODUCTION
 
 TEMPLATE_DIR = os.path.join(PROJECT_ROOT, 'templates')
 
+# Where `fab deploy` puts the templates it compiles into Python modules
+COMPILED_TEMPLATE_DIR = os.path.join(PROJECT_ROOT, 'templates_compiled')
+
 EMAIL_FROM = '"Pick\'em Pick\'em Robot" <robot@pickempickem.com>'
 
+# Where the data crons get their odds and scores (see data/feeds.py)
+ODDS_FEED_URL = 'http://content.linesmaker.com/xml/lines/203.xml'
+SCORES_FEED_URL = 'http://www.nfl.com/liveupdate/scores/scores.json'
+
+# How long before a week's deadline picks are buffered and written in the
+# background (see pickbuffer.py). None always writes picks right away.
+FAST_PICK_WINDOW = datetime.timedelta(minutes=10)
+
+
+# Have all entries been re-keyed out of their pools' entity groups (see
+# data/migrations.py)? Until then, entries that are still children of their
+# pool are looked up (and counted) with extra ancestor queries. Once set, the
+# fallbacks can be removed.
+ENTRIES_MIGRATED = False
@@ -0,0 +1,129 @@
+"""
+Tests, run against the App Engine SDK's service stubs. From the project
+root, with the SDK (and its bundled libraries) on the path and a
+settings/secrets.py in place (see settings/secrets.py.example):
+
+    python -m unittest discover -s tests -t .
+"""
+
+import base64
+import datetime
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+extpath = os.path.join(ROOT, 'ext')
+if extpath not in sys.path:
+    sys.path.append(extpath)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import deferred
+from google.appengine.ext import testbed
+
+
+class TestCase(unittest.TestCase):
+    """Gives each test its own empty datastore, memcache and task queues, and
+    empties this process's in-memory caches. Tests may change
+    settings.ENTRIES_MIGRATED, which is put back afterwards."""
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        # A high replication datastore (so that cross-group transactions
+        # work) that is always consistent
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+
+        from lib import caching, schedule
+        for cache in caching.caches.values():
+            cache.local.clear()
+            cache._generation_checked_at = 0
+        schedule._indexes.clear()
+
+        import settings
+        self._entries_migrated = settings.ENTRIES_MIGRATED
+
+    def tearDown(self):
+        import settings
+        settings.ENTRIES_MIGRATED = self._entries_migrated
+        self.testbed.deactivate()
+
+    def run_tasks(self, queue_name='default'):
+        """Runs the deferred tasks on the given queue, including any that
+        they enqueue, until there are none left. Returns how many ran."""
+        stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        count = 0
+        while True:
+            tasks = stub.GetTasks(queue_name)
+            if not tasks:
+                return count
+            for task in tasks:
+                stub.DeleteTask(queue_name, task['name'])
+                deferred.run(base64.b64decode(task['body']))
+                count += 1
+
+
+def data_path(*parts):
+    """The path to the given file under the data directory."""
+    return os.path.join(ROOT, 'data', *parts)
+
+def create_season(weeks=2, start=None):
+    """Creates a small season to test against, along with every team. Each
+    of the given number of weeks (a week apart, the first starting at the
+    given time, by default a day from now) has two games: Miami at New
+    England, and the New York Giants at Dallas. Returns the season."""
+    from google.appengine.ext import db
+    from models import TEAM_SLUGS, Team, Season, Week, Game
+    db.put([Team(key_name=slug, place=slug.upper(), name=slug)
+            for slug in TEAM_SLUGS])
+    start = start or datetime.datetime.now() + datetime.timedelta(days=1)
+    season = Season(key_name='2011-2012', start_date=start.date())
+    season.put()
+    for i in xrange(weeks):
+        week_start = start + datetime.timedelta(days=7 * i)
+        week = Week(key=db.Key.from_path('Week', i + 1, parent=season.key()),
+                    name='Week %d' % (i + 1),
+                    start=week_start,
+                    end=week_start + datetime.timedelta(days=4))
+        week.put()
+        games = []
+        for away, home in (('mia', 'ne'), ('nyg', 'dal')):
+            home_key = db.Key.from_path('Team', home)
+            away_key = db.Key.from_path('Team', away)
+            games.append(Game(parent=week,
+                              home_team=home_key,
+                              away_team=away_key,
+                              teams=[home_key, away_key],
+                              start=week_start))
+        db.put(games)
+    return season
+
+def create_pool(**kwargs):
+    """Creates a pool (with its own manager), with the given properties."""
+    from models import Pool
+    manager = create_account('manager@example.com')
+    kwargs.setdefault('name', 'Test Pool')
+    pool = Pool(manager=manager, **kwargs)
+    pool.put()
+    return pool
+
+def create_account(email, first_name='Test', last_name='User'):
+    from models import Account
+    account = Account(key_name=email, email=email, first_name=first_name,
+                      last_name=last_name)
+    account.put()
+    return account
+
+def finish_game(game, home_score, away_score):
+    """Records the given final score for the given game."""
+    game.home_score = home_score
+    game.away_score = away_score
+    game.final = True
+    game.put()
+    return game
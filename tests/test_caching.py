@@ -0,0 +1,93 @@
+import time
+
+from tests import TestCase, create_season
+from lib.caching import LRUCache, Cache, MISSING
+from models import Team, Season
+
+
+class LRUCacheTest(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), MISSING)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_replace_and_delete(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('a', 2)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get('a'), 2)
+        cache.delete('a')
+        cache.delete('b')
+        self.assertEqual(cache.get('a', None), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_ttl(self):
+        cache = LRUCache()
+        cache.set('a', 1, ttl=0.01)
+        cache.set('b', 2)
+        time.sleep(0.02)
+        self.assertEqual(cache.get('a'), MISSING)
+        self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(len(cache), 1)
+
+
+class CacheTest(TestCase):
+
+    def setUp(self):
+        super(CacheTest, self).setUp()
+        self.cache = Cache('test-cache')
+
+    def test_get_and_set(self):
+        self.assertEqual(self.cache.get('a'), None)
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.cache.local.clear()
+        self.assertEqual(self.cache.get('a'), 1)
+        stats = self.cache.stats
+        self.assertEqual((stats['hits'], stats['local_hits'],
+                          stats['misses']), (2, 1, 1))
+
+    def test_none_is_cached(self):
+        calls = []
+        def func():
+            calls.append(True)
+            return None
+        self.assertEqual(self.cache.get_or_set('a', func), None)
+        self.assertEqual(self.cache.get_or_set('a', func), None)
+        self.assertEqual(len(calls), 1)
+
+    def test_models(self):
+        team = Team(key_name='ne', place='New England', name='Patriots')
+        team.put()
+        self.cache.set_multi({ 'team': team, 'teams': [team] })
+        self.cache.local.clear()
+        found = self.cache.get_multi(['team', 'teams', 'other'])
+        self.assertEqual(sorted(found.keys()), ['team', 'teams'])
+        self.assertEqual(found['team'].key(), team.key())
+        self.assertEqual([t.name for t in found['teams']], ['Patriots'])
+
+    def test_invalidate(self):
+        self.cache.set('a', 1)
+        self.cache.invalidate()
+        self.assertEqual(self.cache.get('a'), None)
+        # Other processes see the new generation too
+        other = Cache('test-cache')
+        other.set('b', 2)
+        self.assertEqual(self.cache.get('b'), 2)
+
+
+class CurrentSeasonTest(TestCase):
+
+    def test_no_season_is_not_cached(self):
+        self.assertEqual(Season.current(), None)
+        season = create_season()
+        self.assertEqual(Season.current().key(), season.key())
@@ -0,0 +1,100 @@
+from google.appengine.api import memcache
+
+from tests import TestCase, create_season, create_pool, create_account
+from lib import counters
+import settings
+
+
+class CounterTest(TestCase):
+
+    def test_increment(self):
+        self.assertEqual(counters.get_count('things'), 0)
+        counters.increment('things')
+        counters.increment('things', 5)
+        counters.increment('things', -2)
+        self.assertEqual(counters.get_count('things'), 4)
+        memcache.flush_all()
+        self.assertEqual(counters.get_count('things'), 4)
+
+    def test_reset(self):
+        counters.increment('things', initial=lambda: 10)
+        counters.increment('things')
+        counters.reset('things')
+        self.assertEqual(counters.get_count('things'), 0)
+        self.assertEqual(counters.get_count('things', initial=lambda: 3), 3)
+
+    def test_seeded_once(self):
+        calls = []
+        def initial():
+            calls.append(True)
+            return 10
+        self.assertEqual(counters.get_count('things', initial=initial), 10)
+        counters.increment('things', initial=initial)
+        memcache.flush_all()
+        self.assertEqual(counters.get_count('things', initial=initial), 11)
+        self.assertEqual(len(calls), 1)
+
+    def test_increment_seeds_instead(self):
+        # The thing being counted is already included in the initial count
+        counters.increment('things', initial=lambda: 10)
+        self.assertEqual(counters.get_count('things'), 10)
+
+    def test_increments_before_seeding(self):
+        counters.increment('things', 3)
+        self.assertEqual(counters.get_count('things', initial=lambda: 10),
+                         10)
+        counters.increment('things', initial=lambda: 100)
+        self.assertEqual(counters.get_count('things'), 11)
+
+
+class ModelCounterTest(TestCase):
+
+    def setUp(self):
+        super(ModelCounterTest, self).setUp()
+        settings.ENTRIES_MIGRATED = True
+        self.season = create_season()
+        self.pool = create_pool()
+
+    def test_seeded_from_existing_entries(self):
+        # Entries added before the counters existed
+        for email in ('a@example.com', 'b@example.com'):
+            self.pool.add_entry(create_account(email))
+        self.assertEqual(self.pool.entry_count, 2)
+        self.assertEqual(self.season.pool_count, 1)
+
+    def test_counted_by_tasks(self):
+        self.assertEqual(self.pool.entry_count, 0)
+        self.assertEqual(self.pool.active_count, 0)
+        self.assertEqual(self.season.entry_count, 0)
+        for email in ('a@example.com', 'b@example.com'):
+            self.pool.add_entry(create_account(email))
+        self.run_tasks()
+        self.assertEqual(self.pool.entry_count, 2)
+        self.assertEqual(self.pool.active_count, 2)
+        self.assertEqual(self.season.entry_count, 2)
+
+    def test_eliminated_entries(self):
+        entry, created = self.pool.add_entry(create_account('a@example.com'))
+        self.run_tasks()
+        week = self.season.schedule.get_week(1)
+        self.pool.eliminate_entries([entry.key()], week)
+        self.run_tasks()
+        self.assertEqual(self.pool.entry_count, 1)
+        self.assertEqual(self.pool.active_count, 0)
+
+    def test_new_pool(self):
+        pool = create_pool(name='New Pool')
+        pool.seed_counters()
+        # The new pool's counters aren't seeded by queries any more
+        self.assertEqual(counters.get_count(
+                pool.entry_counter, initial=lambda: 100), 0)
+        pool.add_entry(create_account('a@example.com'))
+        self.run_tasks()
+        self.assertEqual(pool.entry_count, 1)
+        self.assertEqual(pool.active_count, 1)
+
+    def test_count_pool(self):
+        from models import count_pool
+        pool = create_pool(name='New Pool')
+        count_pool(pool.key())
+        self.assertEqual(self.season.pool_count, 2)
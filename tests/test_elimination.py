@@ -0,0 +1,101 @@
+from google.appengine.ext import db
+
+from tests import TestCase, create_season, create_pool, create_account, \
+    finish_game
+from models import Entry
+from data import elimination
+
+
+class EliminationTest(TestCase):
+
+    def setUp(self):
+        super(EliminationTest, self).setUp()
+        season = create_season()
+        self.week = season.schedule.get_week(1)
+        games = self.week.games.fetch(10)
+        # Every entry picks from the first game, which the home team wins
+        self.winning_game = finish_game(games[0], 24, 10)
+        self.other_game = games[1]
+
+    def create_entries(self, **kwargs):
+        """Creates a suicide pool with an entry that picks a winner, one that
+        picks a loser and one that doesn't pick at all."""
+        pool = create_pool(is_suicide=True, **kwargs)
+        winner = self.create_entry(pool, 'winner@example.com')
+        winner.make_pick(self.week, self.winning_game,
+                         self.winning_game.home_team)
+        loser = self.create_entry(pool, 'loser@example.com')
+        loser.make_pick(self.week, self.winning_game,
+                        self.winning_game.away_team)
+        absent = self.create_entry(pool, 'absent@example.com')
+        return winner, loser, absent
+
+    def create_entry(self, pool, email):
+        entry, created = pool.add_entry(create_account(email))
+        return entry
+
+    def eliminate(self):
+        elimination.eliminate_losers(self.week.key())
+        self.run_tasks()
+
+    def active(self, *entries):
+        keys = [entry.key() for entry in entries]
+        return [entry.active for entry in Entry.get(keys)]
+
+    def test_nobody_eliminated_before_week_is_over(self):
+        winner, loser, absent = self.create_entries()
+        self.eliminate()
+        self.assertEqual(self.active(winner, loser, absent),
+                         [True, True, True])
+
+    def test_losers_and_absent_entries_eliminated(self):
+        winner, loser, absent = self.create_entries()
+        finish_game(self.other_game, 10, 24)
+        self.eliminate()
+        self.assertEqual(self.active(winner, loser, absent),
+                         [True, False, False])
+        entry = Entry.get(loser.key())
+        self.assertEqual(
+            Entry.eliminated_week.get_value_for_datastore(entry),
+            self.week.key())
+
+    def test_default_team_won(self):
+        home_key = self.winning_game.home_team.key()
+        winner, loser, absent = self.create_entries(default_team=home_key)
+        finish_game(self.other_game, 10, 24)
+        self.eliminate()
+        self.assertEqual(self.active(winner, loser, absent),
+                         [True, False, True])
+
+    def test_default_team_lost(self):
+        away_key = self.winning_game.away_team.key()
+        winner, loser, absent = self.create_entries(default_team=away_key)
+        finish_game(self.other_game, 10, 24)
+        self.eliminate()
+        self.assertEqual(self.active(winner, loser, absent),
+                         [True, False, False])
+
+    def test_default_team_on_bye(self):
+        bye_key = db.Key.from_path('Team', 'sf')
+        winner, loser, absent = self.create_entries(default_team=bye_key)
+        finish_game(self.other_game, 10, 24)
+        self.eliminate()
+        self.assertEqual(self.active(absent), [False])
+
+    def test_pools_that_have_not_started(self):
+        next_week = self.week.schedule.get_week(2)
+        winner, loser, absent = self.create_entries(start_week=next_week)
+        finish_game(self.other_game, 10, 24)
+        self.eliminate()
+        self.assertEqual(self.active(winner, loser, absent),
+                         [True, True, True])
+
+    def test_standings_updated(self):
+        winner, loser, absent = self.create_entries()
+        finish_game(self.other_game, 10, 24)
+        self.eliminate()
+        pool = Entry.get(loser.key()).get_pool()
+        rows = dict((row['id'], row) for row in pool.standings.rows)
+        self.assertEqual(rows[winner.key().name()]['active'], True)
+        self.assertEqual(rows[loser.key().name()]['eliminated'], 1)
+        self.assertEqual(rows[absent.key().name()]['eliminated'], 1)
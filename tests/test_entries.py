@@ -0,0 +1,129 @@
+from google.appengine.ext import db
+
+from tests import TestCase, create_season, create_pool, create_account
+from models import Entry, Pick, PoolStandings, sync_pool_entry, \
+    sync_account_name
+from data import migrations
+import settings
+
+
+class EntryKeyTest(TestCase):
+
+    def setUp(self):
+        super(EntryKeyTest, self).setUp()
+        self.pool = create_pool()
+        self.account = create_account('player@example.com')
+
+    def test_key_for(self):
+        key = Entry.key_for(self.pool, self.account.key())
+        self.assertEqual(key.parent(), None)
+        self.assertEqual(key.name(), '%s:player@example.com' % (
+                self.pool.key().id()))
+
+    def test_add_entry_is_idempotent(self):
+        entry, created = self.pool.add_entry(self.account)
+        self.assertTrue(created)
+        self.assertEqual(entry.key(), Entry.key_for(self.pool, self.account))
+        self.assertEqual(entry.pool_key(), self.pool.key())
+        self.run_tasks()
+
+        again, created = self.pool.add_entry(self.account)
+        self.assertFalse(created)
+        self.assertEqual(again.key(), entry.key())
+        self.assertEqual(self.run_tasks(), 0)
+        self.assertEqual(self.pool.entries.count(), 1)
+        self.assertEqual(PoolStandings.for_pool(self.pool).count, 1)
+
+    def test_find_for(self):
+        other = create_pool(name='Other Pool')
+        entry, created = other.add_entry(self.account)
+        found = Entry.find_for([self.pool, other], self.account)
+        self.assertEqual(found[0], None)
+        self.assertEqual(found[1].key(), entry.key())
+        self.assertFalse(self.pool.is_member(self.account))
+        self.assertTrue(other.is_member(self.account))
+
+
+class LegacyEntryTest(TestCase):
+    """Entries created before entries were keyed by pool and account, as
+    children of their pool."""
+
+    def setUp(self):
+        super(LegacyEntryTest, self).setUp()
+        self.pool = create_pool()
+        self.account = create_account('player@example.com')
+        self.entry = Entry(parent=self.pool, account=self.account)
+        self.entry.put()
+
+    def test_found_and_not_duplicated(self):
+        found = self.pool.find_entry_for(self.account)
+        self.assertEqual(found.key(), self.entry.key())
+        self.assertEqual(found.pool_key(), self.pool.key())
+        entry, created = self.pool.add_entry(self.account)
+        self.assertFalse(created)
+        self.assertEqual(entry.key(), self.entry.key())
+
+    def test_not_looked_for_once_migrated(self):
+        settings.ENTRIES_MIGRATED = True
+        self.assertEqual(self.pool.find_entry_for(self.account), None)
+
+    def test_rekeyed(self):
+        season = create_season()
+        week = season.schedule.get_week(1)
+        game = week.games.get()
+        Pick(key=db.Key.from_path('Pick', 1, parent=self.entry.key()),
+             week=week, game=game, team=game.home_team).put()
+
+        migrations.rekey_entries()
+        self.run_tasks()
+        new_key = Entry.key_for(self.pool, self.account)
+        self.assertEqual(Entry.get(self.entry.key()), None)
+        entry = Entry.get(new_key)
+        self.assertEqual(entry.pool_key(), self.pool.key())
+        self.assertEqual(entry.picks.count(), 1)
+        self.assertEqual(self.pool.find_entry_for(self.account).key(),
+                         new_key)
+
+    def test_counted_until_migrated(self):
+        self.assertEqual(self.pool.entry_count, 1)
+        self.assertEqual(self.pool.active_count, 1)
+        self.assertEqual(self.pool.standings.count, 1)
+
+    def test_counters_reset_by_migration(self):
+        # Counters seeded before the migration miss the old entries
+        settings.ENTRIES_MIGRATED = True
+        self.assertEqual(self.pool.entry_count, 0)
+        migrations.rekey_entries()
+        self.assertEqual(self.pool.entry_count, 1)
+        self.assertEqual(self.pool.active_count, 1)
+
+
+class StandingsNameTest(TestCase):
+
+    def setUp(self):
+        super(StandingsNameTest, self).setUp()
+        self.pool = create_pool()
+        self.account = create_account('player@example.com')
+        self.entry, created = self.pool.add_entry(self.account)
+        self.run_tasks()
+        # Build the standings
+        self.pool.standings
+
+    def name(self):
+        standings = PoolStandings.get(PoolStandings.key_for(self.pool))
+        return standings.find_row(self.entry)['name']
+
+    def test_renamed_account(self):
+        self.assertEqual(self.name(), 'Test User')
+        self.account.first_name = 'Renamed'
+        self.account.put()
+        sync_account_name(self.account.key())
+        self.assertEqual(self.name(), 'Renamed User')
+
+    def test_name_refreshed_with_entry(self):
+        self.account.first_name = 'Renamed'
+        self.account.put()
+        self.entry.revision += 1
+        self.entry.put()
+        sync_pool_entry(self.entry.key())
+        self.assertEqual(self.name(), 'Renamed User')
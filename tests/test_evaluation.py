@@ -0,0 +1,51 @@
+from tests import TestCase, create_season, create_pool, create_account, \
+    finish_game
+from models import Pick
+from data import evaluation
+
+
+class EvaluationTest(TestCase):
+
+    def setUp(self):
+        super(EvaluationTest, self).setUp()
+        season = create_season()
+        self.week = season.schedule.get_week(1)
+        self.game = self.week.games.get()
+        self.home = self.game.home_team
+        self.away = self.game.away_team
+        pool = create_pool()
+        self.home_pick = self.make_pick(pool, 'home@example.com', self.home)
+        self.away_pick = self.make_pick(pool, 'away@example.com', self.away)
+
+    def make_pick(self, pool, email, team):
+        entry, created = pool.add_entry(create_account(email))
+        return entry.make_pick(self.week, self.game, team)
+
+    def reload(self, pick):
+        return Pick.get(pick.key())
+
+    def test_winner_and_loser(self):
+        finish_game(self.game, 24, 10)
+        self.assertEqual(evaluation.evaluate_games([self.game.key()]), 2)
+        self.assertEqual(self.reload(self.home_pick).correct, True)
+        self.assertEqual(self.reload(self.away_pick).correct, False)
+
+    def test_tie_counts_as_a_win(self):
+        finish_game(self.game, 17, 17)
+        evaluation.evaluate_games([self.game])
+        self.assertEqual(self.reload(self.home_pick).correct, True)
+        self.assertEqual(self.reload(self.away_pick).correct, True)
+
+    def test_unfinished_games_are_skipped(self):
+        self.assertEqual(evaluation.evaluate_games([self.game.key()]), 0)
+        self.assertEqual(self.reload(self.home_pick).correct, None)
+
+    def test_only_changed_picks_are_written(self):
+        finish_game(self.game, 24, 10)
+        evaluation.evaluate_games([self.game])
+        self.assertEqual(evaluation.evaluate_games([self.game]), 0)
+
+        # A corrected score flips both picks
+        finish_game(self.game, 10, 24)
+        self.assertEqual(evaluation.evaluate_games([self.game]), 2)
+        self.assertEqual(self.reload(self.away_pick).correct, True)
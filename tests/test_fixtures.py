@@ -0,0 +1,127 @@
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+from StringIO import StringIO
+
+from google.appengine.ext import db
+from django.utils import simplejson as json
+
+from tests import TestCase, ROOT, data_path
+
+# Imported the way the fabfile imports it, without needing Fabric itself
+sys.path.append(os.path.join(ROOT, 'lib', 'fabric'))
+import fixtures
+
+
+# The fixture files, in the order they have to be loaded
+FIXTURES = ['teams.json', 'seasons.json', 'weeks.json', 'games.json']
+
+
+def values(entity):
+    """The given entity's property values, with references as keys."""
+    values = {}
+    for name, prop in entity.properties().iteritems():
+        if isinstance(prop, db.ReferenceProperty):
+            values[name] = prop.get_value_for_datastore(entity)
+        else:
+            values[name] = getattr(entity, name)
+    return values
+
+
+class IterRecordsTest(TestCase):
+
+    def iter_records(self, content, read_size=4):
+        old_size = fixtures.READ_SIZE
+        fixtures.READ_SIZE = read_size
+        try:
+            return list(fixtures.iter_records(StringIO(content)))
+        finally:
+            fixtures.READ_SIZE = old_size
+
+    def test_array(self):
+        self.assertEqual(self.iter_records(' [{"a": 1}, {"b": [2, 3]}]'),
+                         [{'a': 1}, {'b': [2, 3]}])
+
+    def test_empty_array(self):
+        self.assertEqual(self.iter_records('[\n]'), [])
+
+    def test_items_starting_with_arrays(self):
+        self.assertEqual(self.iter_records('[[1, 2], [[3]], [], 4]'),
+                         [[1, 2], [[3]], [], 4])
+
+    def test_json_lines(self):
+        self.assertEqual(self.iter_records('{"a": 1}\n\n{"b": 2}\n'),
+                         [{'a': 1}, {'b': 2}])
+
+    def test_unterminated_array(self):
+        self.assertRaises(ValueError, self.iter_records, '[{"a": 1},')
+
+    def test_fixture_files(self):
+        for name in FIXTURES:
+            path = data_path('fixtures', name)
+            streamed = list(fixtures.iter_records(open(path)))
+            self.assertEqual(streamed, json.load(open(path)))
+
+
+class RoundTripTest(TestCase):
+    """Loads the fixtures, dumps them again and checks that loading the dump
+    gives back the same entities."""
+
+    def test_fixtures_round_trip(self):
+        for name in FIXTURES:
+            path = data_path('fixtures', name)
+            self.assertTrue(fixtures.load_fixtures(path))
+
+        for name in FIXTURES:
+            records = list(fixtures.iter_records(
+                    open(data_path('fixtures', name)),
+                    object_hook=fixtures.json_decoder))
+            model = fixtures.get_model(records[0]['model'])
+            originals = db.get([record['key'] for record in records])
+            dumped = [fixtures.serialize_entity(record['model'], entity)
+                      for record, entity in zip(records, originals)]
+            for line, original in zip(dumped, originals):
+                data = json.loads(line, object_hook=fixtures.json_decoder)
+                copy = fixtures.build_entity(
+                    model, data['key'], data['fields'])
+                self.assertEqual(copy.key(), original.key())
+                self.assertEqual(values(copy), values(original))
+
+    def test_dates_and_byte_strings(self):
+        from models import Season, Entry
+        season = Season(key_name='2011-2012',
+                        start_date=datetime.date(2011, 9, 8))
+        entry = Entry(key_name='1:2',
+                      pick_teams=db.ByteString('\x00\x01\xff'))
+        for entity in (season, entry):
+            line = fixtures.serialize_entity('models.%s' % entity.kind(),
+                                             entity)
+            data = json.loads(line, object_hook=fixtures.json_decoder)
+            copy = fixtures.build_entity(
+                type(entity), data['key'], data['fields'])
+            self.assertEqual(values(copy), values(entity))
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(ExportTest, self).tearDown()
+
+    def test_export_kinds(self):
+        for name in ('teams.json', 'seasons.json'):
+            fixtures.load_fixtures(data_path('fixtures', name))
+        failed = fixtures.export_kinds(
+            ['models.Team', 'models.Season', 'models.Bogus'],
+            directory=self.directory, threads=3, batch_size=10)
+        self.assertEqual(failed, ['models.Bogus'])
+        path = os.path.join(self.directory, 'models.Team.jsonl')
+        records = list(fixtures.iter_records(open(path)))
+        self.assertEqual(len(records), 32)
+        self.assertFalse(os.path.exists(path + '.cursor'))
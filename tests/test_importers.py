@@ -0,0 +1,70 @@
+import os
+import sys
+
+from google.appengine.ext import db
+
+from tests import TestCase, ROOT, data_path
+from models import Season, Week, Game
+from data import importers
+
+sys.path.append(os.path.join(ROOT, 'lib', 'fabric'))
+import fixtures
+
+
+SCHEDULE_PATH = data_path('examples', '2011-2012-schedule.csv')
+
+
+class ImportScheduleTest(TestCase):
+
+    def setUp(self):
+        super(ImportScheduleTest, self).setUp()
+        for name in ('teams.json', 'seasons.json'):
+            self.assertTrue(fixtures.load_fixtures(
+                    data_path('fixtures', name)))
+        self.season = Season.get_by_key_name('2011-2012')
+
+    def import_schedule(self, **kwargs):
+        return importers.import_schedule(SCHEDULE_PATH, self.season,
+                                         **kwargs)
+
+    def test_import(self):
+        report = self.import_schedule()
+        self.assertEqual(len(report['created']), 17 + 256)
+        self.assertEqual(report['updated'], [])
+        self.assertEqual(Week.all().ancestor(self.season).count(), 17)
+        self.assertEqual(Game.all().ancestor(self.season).count(1000), 256)
+
+        # Games are keyed by week and matchup, with kickoffs in UTC
+        week = Week.get(db.Key.from_path('Week', 1,
+                                         parent=self.season.key()))
+        game = Game.get(db.Key.from_path('Game', 'oak@den', parent=week))
+        self.assertEqual(game.home_team.slug, 'den')
+        self.assertEqual(game.away_team.slug, 'oak')
+        self.assertEqual(str(game.start), '2011-09-13 02:15:00')
+        self.assertEqual(str(week.start), '2011-09-09 00:30:00')
+
+    def test_idempotent(self):
+        self.import_schedule()
+        version = Season.get(self.season.key()).schedule_version
+        report = self.import_schedule()
+        self.assertEqual((report['created'], report['updated']), ([], []))
+        self.assertEqual(report['unchanged'], 17 + 256)
+        # Nothing changed, so the schedule wasn't invalidated
+        self.assertEqual(Season.get(self.season.key()).schedule_version,
+                         version)
+
+    def test_changed_game(self):
+        self.import_schedule()
+        game = Game.all().ancestor(self.season).get()
+        kickoff = game.start
+        game.start = kickoff.replace(year=2000)
+        game.put()
+        report = self.import_schedule()
+        self.assertEqual(report['updated'], [game.key()])
+        self.assertEqual(Game.get(game.key()).start, kickoff)
+
+    def test_dry_run(self):
+        report = self.import_schedule(dry_run=True)
+        self.assertEqual(len(report['created']), 17 + 256)
+        self.assertEqual(Week.all().ancestor(self.season).count(), 0)
+        self.assertEqual(Game.all().ancestor(self.season).count(), 0)
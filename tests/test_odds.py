@@ -0,0 +1,116 @@
+import datetime
+
+from google.appengine.ext import db
+
+from tests import TestCase, create_season
+from models import LineHistory
+
+
+EVENT = """
+  <event>
+    <eventDescriptor>
+      <homeTeamName>%(home)s</homeTeamName>
+      <awayTeamName>%(away)s</awayTeamName>
+      <postTimeDateString>%(date)s</postTimeDateString>
+    </eventDescriptor>
+    <markets>
+      <market>
+        <lineType>ML</lineType>
+        <points>150</points>
+      </market>
+      <market>
+        <lineType>PSH</lineType>
+        <points>%(points)s</points>
+      </market>
+    </markets>
+  </event>"""
+
+
+def make_feed(*events):
+    """Makes a feed with an event for each of the given (home, away, date,
+    points) tuples. Test teams are named after their slugs."""
+    return '<lines>%s</lines>' % ''.join(
+        EVENT % dict(home='%s(%s)' % (home, home.upper()),
+                     away='%s(%s)' % (away, away.upper()),
+                     date=date.strftime('%m-%d-%y'),
+                     points=points)
+        for home, away, date, points in events)
+
+
+class OddsTest(TestCase):
+
+    def setUp(self):
+        super(OddsTest, self).setUp()
+        self.start = datetime.datetime(2011, 9, 11, 17, 0)
+        self.season = create_season(start=self.start)
+        # The odds module loads the teams when it is first imported
+        from data import odds
+        self.odds = odds
+        self.game = self.find_game(1, 'ne')
+
+    def find_game(self, week_num, team_slug):
+        week = self.season.schedule.get_week(week_num)
+        return week.games.filter(
+            'teams =', db.Key.from_path('Team', team_slug)).get()
+
+    def test_parse_lines(self):
+        posted = datetime.date(2011, 9, 6)
+        lines = self.odds.parse_lines(make_feed(
+                ('ne', 'mia', posted, '-7.5'),
+                ('dal', 'nyg', posted, 'PK')))
+        self.assertEqual(len(lines), 2)
+        home, away, date, points = lines[0]
+        self.assertEqual((home.slug, away.slug, date, points),
+                         ('ne', 'mia', posted, -7.5))
+        self.assertEqual(lines[1][3], None)
+
+    def test_matches_next_game(self):
+        # Posted before week 1, and again before week 2
+        week1 = datetime.date(2011, 9, 6)
+        week2 = datetime.date(2011, 9, 13)
+        changed = self.odds.handle_content(make_feed(
+                ('ne', 'mia', week1, '-7'),
+                ('ne', 'mia', week2, '-3'),
+                ('ne', 'dal', week1, '-1')))
+        self.assertEqual(len(changed), 2)
+        self.assertEqual(db.get(self.game.key()).spread, -7.0)
+        self.assertEqual(db.get(self.find_game(2, 'ne').key()).spread, -3.0)
+
+    def test_unchanged_lines_not_written(self):
+        feed = make_feed(('ne', 'mia', datetime.date(2011, 9, 6), '-7'))
+        self.assertEqual(len(self.odds.handle_content(feed)), 1)
+        self.assertEqual(self.odds.handle_content(feed), [])
+
+    def test_too_late(self):
+        # Posted after the last week's games
+        feed = make_feed(('ne', 'mia', datetime.date(2011, 9, 30), '-7'))
+        self.assertEqual(self.odds.handle_content(feed), [])
+
+
+class LineHistoryTest(TestCase):
+
+    def test_append(self):
+        history = LineHistory(key=LineHistory.key_for(
+                db.Key.from_path('Game', 1)))
+        self.assertEqual(history.lines, [])
+        self.assertEqual(history.latest, None)
+        first = datetime.datetime(2011, 9, 6, 12, 0)
+        history.append(-7.0, first)
+        history.append(-6.5, first + datetime.timedelta(hours=1))
+        history.put()
+        history = LineHistory.get(history.key())
+        self.assertEqual(history.lines, [
+                (first, -7.0),
+                (first + datetime.timedelta(hours=1), -6.5)])
+        self.assertEqual(history.latest[1], -6.5)
+
+    def test_recorded_by_feed(self):
+        create_season(start=datetime.datetime(2011, 9, 11, 17, 0))
+        from data import odds
+        posted = datetime.date(2011, 9, 6)
+        odds.handle_content(make_feed(('ne', 'mia', posted, '-7')))
+        odds.handle_content(make_feed(('ne', 'mia', posted, '-7')))
+        [game] = odds.handle_content(make_feed(('ne', 'mia', posted, '-6')))
+        history = LineHistory.get(LineHistory.key_for(game))
+        self.assertEqual([points for when, points in history.lines],
+                         [-7.0, -6.0])
@@ -0,0 +1,52 @@
+import datetime
+
+from google.appengine.ext import testbed
+
+from tests import TestCase, create_season, create_pool, create_account
+import pickbuffer
+
+
+class PickBufferTest(TestCase):
+
+    def setUp(self):
+        super(PickBufferTest, self).setUp()
+        season = create_season()
+        self.week = season.schedule.get_week(1)
+        self.game = self.week.games.get()
+        pool = create_pool()
+        self.entry, created = pool.add_entry(create_account(
+                'player@example.com'))
+
+    def buffer_pick(self, team, minutes_before):
+        now = self.week.start - datetime.timedelta(minutes=minutes_before)
+        pickbuffer.buffer_pick(self.entry, self.week, team, now=now)
+
+    def tasks(self, queue_name):
+        stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        return stub.GetTasks(queue_name)
+
+    def leftover_tasks(self):
+        return self.tasks(pickbuffer.QUEUE_NAME)
+
+    def test_latest_pick_applied(self):
+        self.buffer_pick(self.game.away_team, 2)
+        self.buffer_pick(self.game.home_team, 1)
+        self.buffer_pick(self.game.away_team, 3)
+        self.assertEqual(pickbuffer.drain_picks(), 1)
+        pick = self.entry.find_pick_for_week(self.week)
+        self.assertEqual(pick.team.key(), self.game.home_team.key())
+        self.assertEqual(self.leftover_tasks(), [])
+
+    def test_late_pick_dropped(self):
+        self.buffer_pick(self.game.home_team, -1)
+        self.assertEqual(pickbuffer.drain_picks(), 0)
+        self.assertEqual(self.entry.find_pick_for_week(self.week), None)
+        self.assertEqual(self.leftover_tasks(), [])
+
+    def test_drain_scheduled_once_per_slot(self):
+        now = datetime.datetime(2011, 9, 11, 16, 59, 1)
+        pickbuffer.schedule_drain(now)
+        pickbuffer.schedule_drain(now + datetime.timedelta(seconds=1))
+        drains = [task for task in self.tasks('default')
+                  if task['name'].startswith('drain-picks-')]
+        self.assertEqual(len(drains), 1)
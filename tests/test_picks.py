@@ -0,0 +1,87 @@
+import datetime
+from array import array
+
+from google.appengine.ext import db
+
+from tests import TestCase, create_season, create_pool, create_account
+from models import TEAM_NUMBERS, Entry, Pick, DuplicatePickError
+from data import migrations
+
+
+class PickTeamsTest(TestCase):
+
+    def setUp(self):
+        super(PickTeamsTest, self).setUp()
+        season = create_season(weeks=3)
+        self.ne = db.Key.from_path('Team', 'ne')
+        self.weeks = [season.schedule.get_week(i) for i in (1, 2, 3)]
+        # Miami at New England, every week
+        self.games = [week.games.filter('teams =', self.ne).get()
+                      for week in self.weeks]
+        pool = create_pool(is_suicide=True)
+        self.entry, created = pool.add_entry(create_account(
+                'player@example.com'))
+
+    def reload(self):
+        return Entry.get(self.entry.key())
+
+    def test_encoding(self):
+        game = self.games[2]
+        self.entry.make_pick(self.weeks[2], game, game.home_team)
+        entry = self.reload()
+        expected = [0, 0, TEAM_NUMBERS['ne'] + 1]
+        self.assertEqual(array('B', entry.pick_teams).tolist(), expected)
+        self.assertEqual(entry.team_for_week(self.weeks[2]).slug, 'ne')
+        self.assertEqual(entry.team_for_week(self.weeks[0]), None)
+        self.assertEqual(entry.pick_count, 1)
+        self.assertEqual(entry.revision, 1)
+
+    def test_replaced_pick(self):
+        game = self.games[0]
+        self.entry.make_pick(self.weeks[0], game, game.home_team)
+        self.entry.make_pick(self.weeks[0], game, game.away_team)
+        entry = self.reload()
+        self.assertEqual(entry.team_for_week(self.weeks[0]).slug, 'mia')
+        self.assertFalse(entry.has_picked_team(game.home_team))
+        self.assertTrue(entry.has_picked_team(game.away_team))
+        self.assertEqual(entry.pick_count, 1)
+
+    def test_older_submission_is_ignored(self):
+        game = self.games[0]
+        now = datetime.datetime.now()
+        self.entry.make_pick(self.weeks[0], game, game.home_team,
+                             submitted_at=now)
+        self.entry.make_pick(self.weeks[0], game, game.away_team,
+                             submitted_at=now - datetime.timedelta(minutes=1))
+        self.assertEqual(self.reload().team_for_week(self.weeks[0]).slug,
+                         'ne')
+
+    def test_unique(self):
+        game = self.games[0]
+        self.entry.make_pick(self.weeks[0], game, game.home_team,
+                             unique=True)
+        self.assertRaises(DuplicatePickError, self.entry.make_pick,
+                          self.weeks[1], self.games[1],
+                          self.games[1].home_team, unique=True)
+        # Repicking the same team for the same week is fine
+        self.entry.make_pick(self.weeks[0], game, game.home_team,
+                             unique=True)
+        self.assertEqual(self.reload().pick_count, 1)
+
+    def test_built_from_picks(self):
+        # An entry from before pick_teams existed
+        for week, game in zip(self.weeks, self.games)[:2]:
+            Pick(key=self.entry.pick_key_for_week(week), week=week,
+                 game=game, team=game.away_team).put()
+        self.entry.pick_teams = None
+        self.entry.put()
+
+        entry = self.reload()
+        self.assertEqual(entry.pick_count, 2)
+        self.assertEqual(self.reload().pick_teams, None)
+
+        self.assertTrue(migrations.store_pick_teams(entry.key()))
+        self.assertFalse(migrations.store_pick_teams(entry.key()))
+        expected = [TEAM_NUMBERS['mia'] + 1] * 2
+        self.assertEqual(array('B', self.reload().pick_teams).tolist(),
+                         expected)
@@ -0,0 +1,102 @@
+import datetime
+
+from google.appengine.ext import db
+
+from tests import TestCase, create_season
+from lib import schedule
+from models import Week, Game
+
+
+class ScheduleIndexTest(TestCase):
+
+    def setUp(self):
+        super(ScheduleIndexTest, self).setUp()
+        self.season = create_season()
+        self.index = schedule.get_index(self.season)
+        self.week = self.index.get_week(1)
+        self.ne = db.Key.from_path('Team', 'ne')
+
+    def test_weeks_and_games(self):
+        self.assertEqual([week.key().id() for week in self.index.weeks],
+                         [1, 2])
+        self.assertEqual(self.index.get_week(3), None)
+        self.assertEqual(len(self.index.games_for_week(self.week)), 2)
+        self.assertEqual(len(self.index.games_for_team(self.ne)), 2)
+
+    def test_find_game(self):
+        game = self.index.find_game(self.week, self.ne)
+        self.assertEqual(game.parent_key(), self.week.key())
+        self.assertEqual(game.away_team.slug, 'mia')
+        self.assertEqual(self.index.find_game(
+                self.week, db.Key.from_path('Team', 'sf')), None)
+
+    def test_grouped_games(self):
+        groups = self.week.grouped_games
+        self.assertEqual(len(groups), 1)
+        date, times = groups[0]
+        self.assertEqual(date, schedule.local_date(self.week.games.get()))
+        self.assertEqual([len(games) for time, games in times], [2])
+
+    def test_reused_until_invalidated(self):
+        self.assertTrue(schedule.get_index(self.season) is self.index)
+        game = Game(parent=self.week, home_team=self.ne,
+                    away_team=db.Key.from_path('Team', 'sf'),
+                    teams=[self.ne, db.Key.from_path('Team', 'sf')],
+                    start=self.week.start)
+        game.put()
+        schedule.invalidate(self.season)
+        index = schedule.get_index(self.season.key())
+        self.assertFalse(index is self.index)
+        self.assertEqual(len(index.games_for_week(self.week)), 3)
+
+    def test_version_checked_by_other_processes(self):
+        # Another process bumps the version
+        schedule.invalidate(self.season)
+        schedule._indexes[self.season.key()] = self.index
+        self.index.checked_at = 0
+        self.assertFalse(schedule.get_index(self.season) is self.index)
+
+
+class ResolveWeeksTest(TestCase):
+
+    def setUp(self):
+        super(ResolveWeeksTest, self).setUp()
+        self.start = datetime.datetime(2011, 9, 8, 20, 30)
+        season = create_season(weeks=3, start=self.start)
+        self.index = schedule.get_index(season)
+
+    def resolve(self, **kwargs):
+        now = self.start + datetime.timedelta(**kwargs)
+        return tuple(week and week.key().id()
+                     for week in self.index.resolve_weeks(now))
+
+    def test_before_season(self):
+        self.assertEqual(self.resolve(days=-1), (None, 1))
+
+    def test_boundaries(self):
+        self.assertEqual(self.resolve(), (1, 2))
+        self.assertEqual(self.resolve(days=7, seconds=-1), (1, 2))
+        self.assertEqual(self.resolve(days=7), (2, 3))
+
+    def test_after_last_week_starts(self):
+        self.assertEqual(self.resolve(days=14), (3, None))
+        self.assertEqual(self.resolve(days=365), (3, None))
+
+    def test_resolution_reused_within_boundaries(self):
+        self.resolve(days=1)
+        resolution = self.index._resolution
+        self.assertEqual(self.resolve(days=6), (1, 2))
+        self.assertTrue(self.index._resolution is resolution)
+        self.assertEqual(self.resolve(days=8), (2, 3))
+        self.assertFalse(self.index._resolution is resolution)
+        # Going back in time still gives the right answer
+        self.assertEqual(self.resolve(days=-1), (None, 1))
+
+
+class CurrentWeekTest(TestCase):
+
+    def test_current_and_next(self):
+        # The season starts a day from now by default
+        create_season(weeks=2)
+        self.assertEqual(Week.current(), None)
+        self.assertEqual(Week.next().key().id(), 1)
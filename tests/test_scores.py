@@ -0,0 +1,76 @@
+import datetime
+
+from google.appengine.ext import db
+from django.utils import simplejson as json
+
+from tests import TestCase, create_season, data_path
+from models import TEAM_SLUGS, Season, Game
+from data import scores
+
+
+def load_feed(name):
+    return json.loads(open(data_path('examples', name)).read())
+
+
+class ParseResultTest(TestCase):
+
+    def test_examples(self):
+        for name in ('scores.json', 'scores-1-game.json', 'week2.json',
+                     'week3.json'):
+            feed = load_feed(name)
+            results = [scores.parse_result(game_id, data)
+                       for game_id, data in feed.iteritems()]
+            self.assertEqual(len(filter(None, results)), len(feed))
+            for result in results:
+                self.assertTrue(result['home'] in TEAM_SLUGS, result)
+                self.assertTrue(result['away'] in TEAM_SLUGS, result)
+                self.assertTrue(result['final'])
+
+    def test_result(self):
+        feed = load_feed('scores-1-game.json')
+        result = scores.parse_result('2010090900', feed['2010090900'])
+        self.assertEqual(result, dict(home='no', away='min',
+                                      date=datetime.date(2010, 9, 9),
+                                      home_score=14, away_score=9,
+                                      final=True))
+
+    def test_not_started_or_bad(self):
+        data = load_feed('scores-1-game.json')['2010090900']
+        data['home']['score']['T'] = None
+        data['qtr'] = None
+        self.assertEqual(scores.parse_result('2010090900', data), None)
+        self.assertEqual(scores.parse_result('2010090900', {}), None)
+        self.assertEqual(scores.parse_result('bogus', data), None)
+
+
+class HandleFeedTest(TestCase):
+
+    def setUp(self):
+        super(HandleFeedTest, self).setUp()
+        # Minnesota at New Orleans kicked off at 8:30pm local time
+        start = datetime.datetime(2010, 9, 10, 0, 30)
+        self.season = create_season(weeks=1, start=start)
+        week = self.season.schedule.get_week(1)
+        home = db.Key.from_path('Team', 'no')
+        away = db.Key.from_path('Team', 'min')
+        self.game = Game(parent=week, home_team=home, away_team=away,
+                         teams=[home, away], start=start)
+        self.game.put()
+
+    def test_updates_game(self):
+        feed = load_feed('scores-1-game.json')
+        changed = scores.handle_feed(feed, self.season)
+        self.assertEqual([game.key() for game in changed], [self.game.key()])
+        game = Game.get(self.game.key())
+        self.assertEqual((game.home_score, game.away_score, game.final),
+                         (14, 9, True))
+        # Scores don't change the schedule itself, so its index is kept
+        self.assertEqual(Season.get(self.season.key()).schedule_version, 0)
+        # Evaluation was kicked off, but the week isn't over yet
+        self.assertEqual(self.run_tasks(), 1)
+
+        self.assertEqual(scores.handle_feed(feed, self.season), [])
+
+    def test_unknown_games_skipped(self):
+        feed = load_feed('week2.json')
+        self.assertEqual(scores.handle_feed(feed, self.season), [])
@@ -7,11 +7,13 @@ urls = [
     Route(r'/pools', views.pools.PoolsHandler, 'pools'),
     Route(r'/pools/<:\d+>', views.pools.PoolHandler, 'pool'),
     Route(r'/pools/<:\d+>/entries', views.pools.EntriesHandler, 'entries'),
-    Route(r'/pools/<:\d+>/entries/<:\d+>', views.pools.EntryHandler, 'entry'),
-    Route(r'/pools/<:\d+>/entries/<:\d+>/picks',
+    Route(r'/pools/<:\d+>/entries/<:[^/]+>',
+          views.pools.EntryHandler,
+          'entry'),
+    Route(r'/pools/<:\d+>/entries/<:[^/]+>/picks',
           views.pools.PicksHandler,
           'picks'),
-    Route(r'/pools/<:\d+>/entries/<:\d+>/picks/<:\d+>',
+    Route(r'/pools/<:\d+>/entries/<:[^/]+>/picks/<:\d+>',
           views.pools.PickHandler,
           'pick'),
 
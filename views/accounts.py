@@ -3,19 +3,16 @@ from cgi import parse_qs
 from urllib import urlencode
 
 from google.appengine.ext import db
+from google.appengine.ext import deferred
 from google.appengine.api import urlfetch
 from django.utils import simplejson as json
 
 from lib.webapp import RequestHandler
 
-from models import Account
+from models import Account, sync_account_name
 import settings
 
 
-# Cookies last for 14 days
-COOKIE_AGE = 60 * 60 * 24 * 14
-
-
 class LoginHandler(RequestHandler):
 
     def get(self):
@@ -81,8 +78,23 @@ class FacebookLoginHandler(RequestHandler):
                 last_name=profile['last_name'],
                 oauth_token=access_token)
 
-            self.set_secure_cookie(
-                'account', str(acc.key()), max_age=COOKIE_AGE)
+            # Keep the account up to date with the Facebook profile, bumping
+            # its version if anything in the cookie snapshot has changed.
+            names = (profile['first_name'], profile['last_name'])
+            if names != (acc.first_name, acc.last_name) or \
+                    access_token != acc.oauth_token:
+                renamed = names != (acc.first_name, acc.last_name)
+                if renamed:
+                    acc.first_name, acc.last_name = names
+                    acc.version += 1
+                acc.oauth_token = access_token
+                acc.put()
+                acc.cache_version()
+                # The pools' standings show the old name until they're synced
+                if renamed:
+                    deferred.defer(sync_account_name, acc.key())
+
+            self.set_account_cookie(acc)
             next = self.get_secure_cookie('next')
             if next:
                 self.delete_cookie('next')
@@ -2,15 +2,18 @@ import logging
 import datetime
 
 from google.appengine.ext import db
-from google.appengine.api import mail
+from google.appengine.ext import deferred
 
 from webob.exc import HTTPNotFound, HTTPBadRequest, HTTPConflict
 
 from lib.webapp import RequestHandler, SecureRequestHandler
 from lib.decorators import objects_required
+from lib.prefetch import prefetch
 
 import models
 import forms
+import invitations
+import pickbuffer
 
 import settings
 
@@ -21,8 +24,14 @@ class IndexHandler(RequestHandler):
         if not self.account:
             return self.render('pools/index.html')
         else:
-            pools = self.account.pools.fetch(1000)
-            entries = self.account.entries.fetch(1000)
+            account_key = self.account.key()
+            pools = models.Pool.all()\
+                .filter('manager =', account_key)\
+                .fetch(1000)
+            entries = models.Entry.all()\
+                .filter('account =', account_key)\
+                .fetch(1000)
+            prefetch(entries, 'pool', 'parent')
             ctx = {
                 'form': forms.PoolForm(),
                 }
@@ -39,8 +48,14 @@ class PoolsHandler(SecureRequestHandler):
     def post(self):
         form = forms.PoolForm(self.request.params)
         if form.is_valid():
-            form.cleaned_data['manager'] = self.account
-            pool = form.save()
+            form.cleaned_data['manager'] = self.account.key()
+            pool = form.save(commit=False)
+            def txn():
+                pool.put()
+                deferred.defer(models.count_pool, pool.key(),
+                               _transactional=True)
+            db.run_in_transaction(txn)
+            pool.seed_counters()
             entry, added = pool.add_entry(self.account)
             return self.redirect(
                 self.uri_for('pool', pool.key().id()))
@@ -60,18 +75,16 @@ class PoolHandler(SecureRequestHandler):
 
         # We should either have a public pool or a private one with a valid
         # entry at this point.
-        entries = pool.entries.fetch(1000)
-        active_entries = filter(lambda e: e.active, entries)
-        inactive_entries = filter(lambda e: not e.active, entries)
+        standings = pool.standings
 
         week = models.Week.current() or models.Week.next()
-        picks = week.picks.fetch(1000) if week.closed else []
+        picks = models.WeekPicks.for_pool(pool, week) if week.closed else None
 
         ctx = dict(pool=pool,
                    entry=entry,
-                   entries=entries,
-                   active_entries=active_entries,
-                   inactive_entries=inactive_entries,
+                   entries=standings.rows,
+                   active_entries=standings.active,
+                   inactive_entries=standings.eliminated,
                    season=week.parent(),
                    week=week,
                    picks=picks,
@@ -89,14 +102,15 @@ class JoinHandler(SecureRequestHandler):
         ctx = dict(pool=pool,
                    code=code,
                    week=models.Week.next(),
-                   entries=pool.entries.fetch(1000))
+                   entries=pool.standings.rows)
         return self.render('pools/pool_preview.html', ctx)
 
     @objects_required('Pool')
     def post(self, pool, code):
         if pool.check_invite_code(code):
             entry, joined = pool.add_entry(self.account)
-            url = self.uri_for('entry', pool.key().id(), entry.key().id())
+            url = self.uri_for(
+                'entry', pool.key().id(), entry.key().id_or_name())
             return self.redirect(url)
         else:
             error = "Invalid invitation code: %s" % code
@@ -121,21 +135,16 @@ class InviteHandler(SecureRequestHandler):
 
         email_context = dict(
             pool=pool,
-            entries=pool.entries.count())
+            entries=pool.entry_count)
 
         subject = u'Invitation to join NFL pool %s' % pool
         body = self.render_to_string('pools/invite.txt', email_context)
         body = wordwrap(body, 72)
 
-        emails = form.cleaned_data['emails']
-
-        for email in form.cleaned_data['emails']:
-            mail.send_mail(
-                sender=settings.EMAIL_FROM,
-                to=email,
-                subject=subject,
-                body=body)
-
+        # The emails themselves are sent in the background
+        invitations.send_invitations(
+            pool, self.account, subject, body, form.cleaned_data['emails'])
+        return self.redirect(self.uri_for('pool', pool.key().id()))
 
 
 class EntriesHandler(SecureRequestHandler):
@@ -147,14 +156,18 @@ class EntryHandler(SecureRequestHandler):
     @objects_required('Pool', 'Entry')
     def get(self, pool, entry):
         season = models.Season.current()
-        weeks = season.weeks.fetch(25)
+        weeks = season.schedule.weeks
         week =  models.Week.next()
+        week_picks = entry.picks_by_week()
+        prefetch([pool], 'manager')
+        prefetch([entry], 'account')
+        prefetch(week_picks.values(), 'team')
         ctx = dict(season=season,
                    weeks=weeks,
                    week=week,
                    pool=pool,
                    entry=entry,
-                   picks=entry.picks.fetch(1000))
+                   week_picks=week_picks)
 
         template = 'pools/entry.html'
         return self.render(template, ctx)
@@ -170,17 +183,29 @@ class PickHandler(SecureRequestHandler):
     def get(self, pool, entry, week_num):
         season = models.Season.current()
         week = self.get_week(week_num, season=season)
-        pick_key = db.Key.from_path(
-            'Pick', week.key().id(), parent=entry.key())
-        pick = db.get(pick_key)
-        weeks = season.weeks.fetch(25)
+        week_picks = entry.picks_by_week()
+        pick = week_picks.get(week.key().id())
+        prefetch([pool], 'manager')
+        prefetch([entry], 'account')
+        prefetch(week_picks.values(), 'team')
+        weeks = season.schedule.weeks
+
+        # A pick that was buffered (see pickbuffer) but hasn't been applied
+        # yet is shown as pending
+        pending = models.Team.registry().get(self.request.GET.get('pending'))
+        if pending and pick:
+            team_key = models.Pick.team.get_value_for_datastore(pick)
+            if team_key == pending.key():
+                pending = None
+
         ctx = dict(season=season,
                    weeks=weeks,
                    week=week,
                    pool=pool,
                    entry=entry,
                    pick=pick,
-                   picks=entry.picks.fetch(1000))
+                   pending=pending,
+                   week_picks=week_picks)
 
         template = 'pools/pick.html'
         return self.render(template, ctx)
@@ -195,7 +220,7 @@ class PickHandler(SecureRequestHandler):
         if team_slug is None:
             raise HTTPBadRequest('Pick required')
 
-        team = models.Team.get_by_key_name(team_slug)
+        team = models.Team.registry().get(team_slug)
         if team is None:
             raise HTTPBadRequest('Unknown team: %s' % team_slug)
 
@@ -203,38 +228,40 @@ class PickHandler(SecureRequestHandler):
         if game is None:
             raise HTTPBadRequest('No game for %s in week %s' % (team, week))
 
-        if pool.is_suicide:
-            previous_pick = entry.has_picked_team(team)
-            if previous_pick and previous_pick.game != game:
-                raise HTTPConflict(u'Already picked %s' % team)
-
-        # We should have enough data to create the pick (in a transaction)
-        pick_key = db.Key.from_path(
-            'Pick', week.key().id(), parent=entry.key())
-        pick = models.Pick(
-            key=pick_key,
-            week=week,
-            game=game,
-            team=team)
-        pick.put()
-        logging.info(u'Created pick %s for team %s' % (pick, team))
+        if pool.is_suicide and entry.has_picked_team(team, exclude_week=week):
+            raise HTTPConflict(u'Already picked %s' % team)
+
+        # We should have enough data to create the pick. Right before the
+        # deadline, it's buffered and written in the background instead.
+        if pickbuffer.in_fast_window(week):
+            pickbuffer.buffer_pick(entry, week, team)
+            logging.info(u'Buffered pick of %s for %s' % (team, entry))
+            status = 202
+        else:
+            try:
+                pick = entry.make_pick(week, game, team,
+                                       unique=pool.is_suicide)
+            except models.DuplicatePickError, e:
+                raise HTTPConflict(unicode(e))
+            logging.info(u'Created pick %s for team %s' % (pick, team))
+            status = 201
 
         if self.request.is_ajax():
             resp = { 'team': unicode(team),
                      'place': team.place,
                      'name': team.name }
-            return self.send_json(resp, status=201)
+            return self.send_json(resp, status=status)
 
         else:
             url = self.uri_for(
-                'pick', pool.key().id(), entry.key().id(), week_num)
+                'pick', pool.key().id(), entry.key().id_or_name(), week_num)
+            if status == 202:
+                url += '?pending=%s' % team.slug
             return self.redirect(url)
 
     def get_week(self, week_num, season=None):
         season = season or models.Season.current()
-        week_key = db.Key.from_path(
-            'Week', int(week_num), parent=season.key())
-        week = db.get(week_key)
+        week = season.schedule.get_week(int(week_num))
         if week is None:
             raise HTTPNotFound('Week %s not found' % week_num)
         return week
@@ -6,6 +6,7 @@ from google.appengine.ext import db
 
 from lib.webapp import RequestHandler
 from lib.decorators import objects_required
+from lib.prefetch import prefetch
 
 import models
 import forms
@@ -16,12 +17,10 @@ class SeasonHandler(RequestHandler):
     @objects_required('Season')
     def get(self, season):
         weeks = season.weeks.fetch(25)
-        pool_count = season.pools.count()
-        entry_count = db.Query(models.Entry).ancestor(season).count()
         ctx = dict(season=season,
                    weeks=weeks,
-                   pool_count=pool_count,
-                   entry_count=entry_count)
+                   pool_count=season.pool_count,
+                   entry_count=season.entry_count)
         return self.render('seasons/season.html', ctx)
 
 
@@ -29,7 +28,8 @@ class WeekHandler(RequestHandler):
 
     @objects_required('Season', 'Week')
     def get(self, season, week):
-        games = groupby(week.games.fetch(25), lambda g: g.start.date())
+        games = prefetch(week.games.fetch(25), 'home_team', 'away_team')
+        games = groupby(games, lambda g: g.start.date())
         ctx = dict(season=season,
                    week=week,
                    games=games)